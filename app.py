@@ -1,6 +1,5 @@
-from flask import Flask, request, abort, jsonify, redirect
+from flask import Flask, Response, request, abort, jsonify, redirect
 from linebot.v3 import WebhookHandler
-from linebot.v3.exceptions import InvalidSignatureError
 from linebot.v3.webhooks import (
     MessageEvent,
     TextMessageContent,
@@ -10,8 +9,6 @@ from linebot.v3.webhooks import (
 
 from linebot.v3.messaging import (
     Configuration,
-    ApiClient,
-    MessagingApi,
     ReplyMessageRequest,
     PushMessageRequest,
     TextMessage,
@@ -20,11 +17,15 @@ from linebot.v3.messaging import (
     MessageAction,
     URIAction,
     PostbackAction,
+    QuickReply,
+    QuickReplyItem,
 )
 from linebot.exceptions import LineBotApiError
 
 import os
+import atexit
 import json
+import time
 import random
 import urllib.parse
 import requests
@@ -35,7 +36,16 @@ import pytz
 
 # ===== 拆出去的模組 =====
 from ledger import parse_ledger_command, resolve_ledger_range, TAIPEI_TZ
-from gsheets_repo import LedgerRepo
+from ledger_store import LedgerRepoHolder, group_executor
+from webhook_worker import EventDispatcher, EventPrefilter, dispatch_event, parse_events
+import metrics
+from line_client import PooledMessagingClient
+from line_bulk import BulkSender
+from user_registry import UserRegistry
+from event_dedup import create_dedup_store, event_key, is_redelivery
+from query_cursors import CursorCache, QueryCursor
+from ledger_export import csv_chunks, export_url, make_export_token, read_export_token
+from fx_rates import FxService, fx_reply, parse_fx_command
 
 app = Flask(__name__)
 
@@ -47,50 +57,203 @@ USER_ID = os.getenv("USER_ID")
 configuration = Configuration(access_token=channel_access_token)
 handler = WebhookHandler(channel_secret)
 
+# 整個 process 共用的 MessagingApi（連線池重複使用）
+line_client = PooledMessagingClient(configuration)
+
+# 大量推播（multicast 分塊 + 限速 + 429 重試）；要帶 Bearer BULK_SEND_TOKEN，沒設就關閉
+bulk_sender = BulkSender(line_client)
+BULK_SEND_TOKEN = os.getenv("BULK_SEND_TOKEN")
+
+# CSV 匯出：聊天室產生的連結有效 EXPORT_LINK_TTL 秒；EXPORT_TOKEN 有設才開放管理用的 Bearer 匯出
+EXPORT_LINK_TTL = float(os.getenv("EXPORT_LINK_TTL", "3600"))
+EXPORT_TOKEN = os.getenv("EXPORT_TOKEN")
+
+# ===== Webhook 非同步處理（WEBHOOK_ASYNC=1 開啟）=====
+WEBHOOK_ASYNC = os.getenv("WEBHOOK_ASYNC", "0") == "1"
+dispatcher = (
+    EventDispatcher(
+        handler,
+        workers=int(os.getenv("WEBHOOK_WORKERS", "4")),
+        queue_size=int(os.getenv("WEBHOOK_QUEUE_SIZE", "100")),
+    )
+    if WEBHOOK_ASYNC
+    else None
+)
+if dispatcher:
+    atexit.register(dispatcher.shutdown)
+
+# ===== Webhook 去重（LINE 重送的同一個 webhookEventId 只處理一次）=====
+dedup = create_dedup_store()
+
+
+def _is_duplicate(event) -> bool:
+    key = event_key(event)
+    if dedup is None or key is None:
+        return False
+    if not dedup.seen_before(key):
+        return False
+    metrics.WEBHOOK_DUPLICATES.inc(redelivery="true" if is_redelivery(event) else "false")
+    print(f"[webhook] duplicate event skipped: {key}")
+    return True
+
 # ===== 你原本的 Secret JSON 存放（保留） =====
 SECRET_FILES_PATH = "/etc/secrets"
 JSON_FILE_PATH = os.path.join(SECRET_FILES_PATH, "user_ids.json")
 
 
-def initialize_json_file():
-    if not os.path.exists(JSON_FILE_PATH):
-        os.makedirs(SECRET_FILES_PATH, exist_ok=True)
-        with open(JSON_FILE_PATH, "w", encoding="utf-8") as f:
-            json.dump({"user_ids": []}, f)
-            print(f"Created new JSON file at {JSON_FILE_PATH}")
+# 記憶體 set + append-only log（user_ids.json.log），定期壓回 user_ids.json
+user_registry = UserRegistry(JSON_FILE_PATH)
 
 
 def add_user_id_to_json(user_id):
-    initialize_json_file()
-    with open(JSON_FILE_PATH, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    if user_id not in data["user_ids"]:
-        data["user_ids"].append(user_id)
-
-    with open(JSON_FILE_PATH, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=4, ensure_ascii=False)
+    return user_registry.add(user_id)
 
 
 def get_all_user_ids():
-    initialize_json_file()
-    with open(JSON_FILE_PATH, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    return data["user_ids"]
+    return user_registry.all()
 
 
 # =========================================================
 # ✅ 記帳設定
 # =========================================================
-LEDGER_SPREADSHEET_ID = os.getenv("LEDGER_SPREADSHEET_ID")
 ENABLE_TRIGGER = "啟用記帳功能"
 
-repo = LedgerRepo(spreadsheet_id=LEDGER_SPREADSHEET_ID) if LEDGER_SPREADSHEET_ID else None
+# backend 由 LEDGER_BACKEND 決定（sheets / sqlite），見 ledger_store.create_ledger_repo
+# repo 在背景建立，沒好之前非記帳的回覆照常；記帳指令最多等 LEDGER_INIT_WAIT 秒
+ledger = LedgerRepoHolder()
+LEDGER_INIT_WAIT = float(os.getenv("LEDGER_INIT_WAIT", "10"))
+if os.getenv("LEDGER_EAGER_INIT", "1") == "1":
+    ledger.start()
+atexit.register(ledger.close)
+
+# ===== 匯率（背景抓牌價，查詢只讀快取）=====
+# 第一次有人查匯率才開背景 thread（get() 會自己 start），import / 開機時不爬
+fx_service = FxService()
+
+
+# 查詢結果分頁：完整結果放 server-side cursor，「下一頁」postback 從記憶體切
+query_cursors = CursorCache()
+QUERY_PAGE_SIZE = int(os.getenv("QUERY_PAGE_SIZE", "10"))
+
+
+def _query_page(cursor, page: int) -> list:
+    size = QUERY_PAGE_SIZE
+    pages = (len(cursor) + size - 1) // size
+    offset = page * size
+    if page == 0:
+        head = f"共 {len(cursor)} 筆，合計 {cursor.total_amount} 元"
+        if pages > 1:
+            head += f"（第 1/{pages} 頁）"
+    else:
+        head = f"第 {page + 1}/{pages} 頁（共 {len(cursor)} 筆）"
+    lines = [f"- {ts} {cat} {amount} {item}" for ts, cat, amount, item in cursor.page(offset, size)]
+    msg = TextMessage(text=head + "\n" + "\n".join(lines))
+
+    if offset + size < len(cursor):
+        msg.quick_reply = QuickReply(items=[QuickReplyItem(action=PostbackAction(
+            label="下一頁", data=cursor.postback_data(page + 1), display_text="下一頁",
+        ))])
+    return [msg]
+
+
+def _looks_like_ledger(text: str) -> bool:
+    return ENABLE_TRIGGER in text or parse_ledger_command(text)["type"] != "unknown"
+
+
+# ===== Webhook prefilter：parse 成 model 前先用原始 JSON 過濾 =====
+# WEBHOOK_PREFILTER=0 關掉；WEBHOOK_SKIP_DISABLED_GROUPS=1 時沒啟用記帳的群組整個不回（不再回音 / 吃什麼）
+WEBHOOK_PREFILTER = os.getenv("WEBHOOK_PREFILTER", "1") == "1"
+WEBHOOK_SKIP_DISABLED_GROUPS = os.getenv("WEBHOOK_SKIP_DISABLED_GROUPS", "0") == "1"
+
+
+def _skip_raw_event(ev: dict) -> str | None:
+    if not WEBHOOK_SKIP_DISABLED_GROUPS or ev.get("type") != "message":
+        return None
+    src = ev.get("source") or {}
+    if src.get("type") != "group":
+        return None
+    if ENABLE_TRIGGER in ((ev.get("message") or {}).get("text") or ""):
+        return None
+    repo = ledger.get()
+    # repo 還沒好 / 快取不確定 -> 照常處理
+    if repo is not None and repo.peek_group_enabled(src.get("groupId")) is False:
+        return "group_disabled"
+    return None
+
+
+prefilter = EventPrefilter(handler, skip=_skip_raw_event) if WEBHOOK_PREFILTER else None
+
+
+def _runtime_collector():
+    # /metrics render 時才取的現在值：webhook queue、記帳寫入排隊、LINE 連線池、匯率快取
+    families = []
+    if dispatcher:
+        st = dispatcher.stats()
+        families.append((
+            "linebot_webhook_queue", "gauge", "Webhook worker queue state",
+            {(k,): st[k] for k in ("depth", "capacity", "max_depth", "workers")}, ("field",),
+        ))
+        families.append((
+            "linebot_webhook_events_total", "counter", "Webhook events by outcome",
+            {(k,): st[k] for k in ("enqueued", "processed", "failed", "inline")}, ("outcome",),
+        ))
+    st = group_executor.stats()
+    families.append((
+        "linebot_ledger_serial", "gauge", "Per-group ledger mutation queues",
+        {(k,): st[k] for k in ("keys", "running", "queued", "workers")}, ("field",),
+    ))
+    pool = line_client.stats()
+    values = {}
+    for host, h in pool["hosts"].items():
+        for k, v in h.items():
+            values[(host, k)] = v
+    families.append(("linebot_line_pool", "gauge", "LINE API connection pool state", values, ("host", "field")))
+    fx = fx_service.status()
+    if fx["age_seconds"] is not None:
+        families.append((
+            "linebot_fx_table", "gauge", "Cached exchange-rate table",
+            {("currencies",): fx["currencies"], ("age_seconds",): fx["age_seconds"]}, ("field",),
+        ))
+    return families
+
+
+metrics.register_collector(_runtime_collector)
 
 
 @app.route("/health", methods=["HEAD", "GET"])
 def health_check():
-    return "OK", 200
+    # 服務本身活著就 200；記帳 repo 的狀態另外放在 ledger 欄位
+    status = ledger.status()
+    return jsonify({"status": "OK", "ledger": status, "ready": status["state"] in ("ready", "disabled")}), 200
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+def webhook_events(body: str, signature: str) -> list | None:
+    """
+    /callback 的前段（Flask 跟 asgi.py 共用）：驗簽章 -> prefilter -> parse -> 去重
+    簽章不對回 None
+    """
+    with metrics.WEBHOOK_STAGE_SECONDS.time(stage="verify"):
+        valid = handler.parser.signature_validator.validate(body, signature)
+    if not valid:
+        return None
+
+    with metrics.WEBHOOK_STAGE_SECONDS.time(stage="prefilter"):
+        raw_events = json.loads(body).get("events", [])
+        if prefilter:
+            raw_events = prefilter.filter(raw_events)
+    if not raw_events:
+        return []
+
+    with metrics.WEBHOOK_STAGE_SECONDS.time(stage="parse"):
+        events = parse_events({"events": raw_events})
+
+    with metrics.WEBHOOK_STAGE_SECONDS.time(stage="dedup"):
+        return [e for e in events if not _is_duplicate(e)]
 
 
 @app.route("/callback", methods=["POST"])
@@ -98,25 +261,43 @@ def callback():
     signature = request.headers.get("X-Line-Signature", "")
     body = request.get_data(as_text=True)
 
-    try:
-        handler.handle(body, signature)
-    except InvalidSignatureError:
+    events = webhook_events(body, signature)
+    if events is None:
         abort(400)
+    if not events:
+        return "OK"
+
+    if dispatcher:
+        # 丟 queue，立刻回 200
+        for event in events:
+            dispatcher.submit(event)
+        return "OK"
+
+    with metrics.WEBHOOK_STAGE_SECONDS.time(stage="dispatch"):
+        for event in events:
+            dispatch_event(handler, event)
 
     return "OK"
 
 
+def record_follower(event) -> None:
+    user_id = event.source.user_id
+    if user_id:
+        try:
+            add_user_id_to_json(user_id)
+        except Exception as e:
+            print(f"[users] add user id error: {e}")
+
+
 @handler.add(FollowEvent)
 def handle_follow(event):
-    user_id = event.source.user_id
-    with ApiClient(configuration) as api_client:
-        line_bot_api = MessagingApi(api_client)
-        line_bot_api.reply_message(
-            ReplyMessageRequest(
-                reply_token=event.reply_token,
-                messages=[TextMessage(text="感謝加入好友")],
-            )
+    record_follower(event)
+    line_client.api.reply_message(
+        ReplyMessageRequest(
+            reply_token=event.reply_token,
+            messages=[TextMessage(text="感謝加入好友")],
         )
+    )
 
 
 @app.route("/send_message", methods=["POST", "GET"])
@@ -129,305 +310,399 @@ def send_message():
     message = data["message"]
 
     try:
-        with ApiClient(configuration) as api_client:
-            line_bot_api = MessagingApi(api_client)
-            line_bot_api.push_message(
-                PushMessageRequest(
-                    to=to_user_id,
-                    messages=[TextMessage(text=message)],
-                )
+        line_client.api.push_message(
+            PushMessageRequest(
+                to=to_user_id,
+                messages=[TextMessage(text=message)],
             )
+        )
         return jsonify({"status": "success"}), 200
     except LineBotApiError as e:
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/export.csv", methods=["GET"])
+def export_csv():
+    """
+    串流匯出一個群組、一段區間的記帳 CSV：
+      - ?token=...：聊天室「匯出」指令產生的簽章連結（綁群組 + 區間，有時效）
+      - 或 Authorization: Bearer EXPORT_TOKEN + ?group_id=&start=&end=（管理用，EXPORT_TOKEN 沒設就關閉）
+    repo 分頁讀、邊讀邊送，不先把整段查出來
+    """
+    token = request.args.get("token")
+    if token:
+        req = read_export_token(token)
+        if req is None:
+            return jsonify({"error": "invalid or expired token"}), 403
+    elif EXPORT_TOKEN and request.headers.get("Authorization", "") == f"Bearer {EXPORT_TOKEN}":
+        req = {k: request.args.get(k) for k in ("group_id", "start", "end")}
+        if not all(req.values()):
+            return jsonify({"error": "group_id, start and end are required"}), 400
+    else:
+        return jsonify({"error": "unauthorized"}), 401
+
+    repo = ledger.get(timeout=LEDGER_INIT_WAIT)
+    if repo is None:
+        return jsonify({"error": "ledger unavailable"}), 503
+
+    def generate():
+        try:
+            yield from csv_chunks(repo.iter_records(req["group_id"], req["start"], req["end"]))
+        except Exception as e:
+            # header 已經送出，改不了 status，只能記 log 後結束
+            print(f"[export] stream error: {e}")
+
+    filename = f"ledger_{req['start'][:10]}_{req['end'][:10]}.csv"
+    return Response(
+        generate(),
+        mimetype="text/csv",
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "Cache-Control": "no-store",
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
+@app.route("/send_bulk", methods=["POST"])
+def send_bulk():
+    """
+    body：{"message": "...", "user_ids": [...]（省略 = 所有好友）, "broadcast": false, "notification_disabled": false}
+    回傳每一塊 multicast 的結果
+    """
+    if not BULK_SEND_TOKEN or request.headers.get("Authorization", "") != f"Bearer {BULK_SEND_TOKEN}":
+        return jsonify({"error": "unauthorized"}), 401
+
+    data = request.json or {}
+    if not data.get("message"):
+        return jsonify({"error": "message is required"}), 400
+
+    messages = [TextMessage(text=data["message"])]
+    silent = bool(data.get("notification_disabled", False))
+
+    if data.get("broadcast"):
+        result = bulk_sender.broadcast(messages, notification_disabled=silent)
+        return jsonify(result), 200 if result["status"] == "ok" else 502
+
+    user_ids = data.get("user_ids")
+    if user_ids is None:
+        user_ids = get_all_user_ids()
+    if not isinstance(user_ids, list):
+        return jsonify({"error": "user_ids must be a list"}), 400
+
+    result = bulk_sender.multicast(user_ids, messages, notification_disabled=silent)
+    status = 200 if result["failed"] == 0 else (207 if result["sent"] else 502)
+    return jsonify(result), status
+
+
 @handler.add(MessageEvent, message=TextMessageContent)
 def handle_message(event):
+    # 依指令類型記延遲（stat["type"] 由 _reply_messages 依走到的分支填）
+    stat = {"type": "echo"}
+    started = time.perf_counter()
+    try:
+        messages = _reply_messages(event, stat)
+        if messages:
+            line_client.api.reply_message(
+                ReplyMessageRequest(reply_token=event.reply_token, messages=messages)
+            )
+    finally:
+        metrics.COMMAND_SECONDS.observe(time.perf_counter() - started, type=stat["type"])
+
+
+def _reply_messages(event, stat) -> list:
+    """
+    文字訊息 -> 要回覆的 messages（不呼叫 LINE API）；記帳 repo 的呼叫可能會 block
+    Flask（handle_message）跟 ASGI（asgi.py）共用
+    """
     text = (event.message.text or "").strip()
     source_type = event.source.type  # user / group / room
 
-    with ApiClient(configuration) as api_client:
-        line_bot_api = MessagingApi(api_client)
+    # =========================
+    # 群組才處理記帳功能
+    # =========================
+    group_id = None
+    if source_type == "group":
+        group_id = event.source.group_id
+
+    # === 記帳功能（多群組動態啟用）===
+    repo = None
+    if source_type == "group" and group_id:
+        repo = ledger.get()
+        if repo is None and ledger.state != "disabled" and _looks_like_ledger(text):
+            repo = ledger.get(timeout=LEDGER_INIT_WAIT)
+            if repo is None and ledger.state != "disabled":
+                # 等了還沒好：明確告訴使用者，不要掉到回音 / 吃什麼
+                stat["type"] = "not_ready"
+                return [TextMessage(text="記帳初始化中，請稍後再試")]
+
+    if repo:
+        # 1) 觸發啟用
+        if ENABLE_TRIGGER in text:
+            stat["type"] = "enable"
+            try:
+                repo.enable_group(group_id=group_id, actor_user_id=event.source.user_id)
+                return [TextMessage(text="此群組已啟用記帳功能")]
+            except Exception as e:
+                return [TextMessage(text=f"啟用失敗：{e}")]
 
-        # =========================
-        # 群組才處理記帳功能
-        # =========================
-        group_id = None
-        if source_type == "group":
-            group_id = event.source.group_id
+        # 2) gate：已啟用才處理記帳/查詢/彙整/指令
+        try:
+            enabled = repo.get_group_enabled(group_id)
+        except Exception as e:
+            print(f"[ledger] get_group_enabled error: {e}")
+            enabled = False
 
-        # === 記帳功能（多群組動態啟用）===
-        if source_type == "group" and group_id and repo:
-            # 1) 觸發啟用
-            if ENABLE_TRIGGER in text:
+        if enabled:
+            with metrics.WEBHOOK_STAGE_SECONDS.time(stage="parse_command"):
+                cmd = parse_ledger_command(text)
+            stat["type"] = cmd["type"]
+
+            # 2.1 指令說明
+            if cmd["type"] == "help":
+                msg = (
+                    "記帳指令：\n"
+                    "1) 啟用：啟用記帳功能\n"
+                    "2) 存入：存入 金額\n"
+                    "   例：存入 5000\n"
+                    "3) 記帳：類別 金額 商品\n"
+                    "   例：餐飲 120 午餐\n"
+                    "   多筆：第一行「記帳」，之後一行一筆\n"
+                    "4) 查餘額：查餘額 / 餘額\n"
+                    "5) 查詢：查今天 / 查昨天 / 查本月 / 查 2026-02-01\n"
+                    "   例：查本月 餐飲\n"
+                    "6) 彙整：彙整 今天 / 彙整 昨天 / 彙整 本月 / 彙整 2026-02-01\n"
+                    "   例：彙整 本月\n"
+                    "7) 重建彙整：重建彙整\n"
+                    "8) 匯出 CSV：匯出 / 匯出 本月 / 匯出 2026-02 / 匯出 2026-02-01\n"
+                )
+                return [TextMessage(text=msg)]
+                # 2.x 查餘額
+            if cmd["type"] == "balance":
                 try:
-                    repo.enable_group(group_id=group_id, actor_user_id=event.source.user_id)
-                    line_bot_api.reply_message(
-                        ReplyMessageRequest(
-                            reply_token=event.reply_token,
-                            messages=[TextMessage(text="此群組已啟用記帳功能")],
-                        )
+                    balance = repo.get_balance(group_id)
+                    return [TextMessage(text=f"目前儲存金餘額：{balance} 元")]
+                except Exception as e:
+                    return [TextMessage(text=f"查詢餘額失敗：{e}")]
+            if cmd["type"] == "deposit":
+                try:
+                    new_balance = repo.deposit(
+                        group_id=group_id,
+                        amount=cmd["amount"],
+                        actor_user_id=event.source.user_id
                     )
+                    return [TextMessage(text=f"已存入 {cmd['amount']} 元\n目前儲存金：{new_balance} 元")]
                 except Exception as e:
-                    line_bot_api.reply_message(
-                        ReplyMessageRequest(
-                            reply_token=event.reply_token,
-                            messages=[TextMessage(text=f"啟用失敗：{e}")],
-                        )
+                    return [TextMessage(text=f"存入失敗：{e}")]
+            # 2.2 記帳：類別 金額 商品
+            if cmd["type"] == "add":
+                try:
+                    ts = datetime.now(TAIPEI_TZ).strftime("%Y-%m-%d %H:%M:%S")
+                    # ✅ 記帳 + 扣儲存金一起送，回覆餘額
+                    balance = repo.add_expense(
+                        group_id=group_id,
+                        user_id=event.source.user_id,
+                        raw_text=text,
+                        item=cmd["item"],
+                        amount=cmd["amount"],
+                        category=cmd["category"],
+                        currency="TWD",
+                        ts=ts,
                     )
-                return
 
-            # 2) gate：已啟用才處理記帳/查詢/彙整/指令
-            try:
-                enabled = repo.get_group_enabled(group_id)
-            except Exception as e:
-                print(f"[ledger] get_group_enabled error: {e}")
-                enabled = False
-
-            if enabled:
-                cmd = parse_ledger_command(text)
-
-                # 2.1 指令說明
-                if cmd["type"] == "help":
-                    msg = (
-                        "記帳指令：\n"
-                        "1) 啟用：啟用記帳功能\n"
-                        "2) 存入：存入 金額\n"
-                        "   例：存入 5000\n"
-                        "3) 記帳：類別 金額 商品\n"
-                        "   例：餐飲 120 午餐\n"
-                        "4) 查餘額：查餘額 / 餘額\n"
-                        "5) 查詢：查今天 / 查昨天 / 查本月 / 查 2026-02-01\n"
-                        "   例：查本月 餐飲\n"
-                        "6) 彙整：彙整 今天 / 彙整 昨天 / 彙整 本月 / 彙整 2026-02-01\n"
-                        "   例：彙整 本月\n"
-                    )
-                    line_bot_api.reply_message(
-                        ReplyMessageRequest(
-                            reply_token=event.reply_token,
-                            messages=[TextMessage(text=msg)],
+                    return [TextMessage(
+                        text=(
+                            f"已記錄：{cmd['category']} {cmd['amount']} {cmd['item']}\n"
+                            f"剩餘儲存金：{balance} 元"
                         )
+                    )]
+                except Exception as e:
+                    return [TextMessage(text=f"記錄失敗：{e}")]
+
+            # 2.2b 多行記帳：整批寫一次、合計扣一次；有一行不對就整批不記
+            if cmd["type"] == "add_many":
+                if cmd["errors"]:
+                    lines = [f"格式有誤，這次全部未記錄（共 {len(cmd['errors'])} 行），請修正後整批重貼："]
+                    lines += [f"- 第 {err['line']} 行「{err['text']}」：{err['reason']}" for err in cmd["errors"][:10]]
+                    return [TextMessage(text="\n".join(lines))]
+                try:
+                    ts = datetime.now(TAIPEI_TZ).strftime("%Y-%m-%d %H:%M:%S")
+                    entries = cmd["entries"]
+                    balance = repo.add_expenses(
+                        group_id=group_id,
+                        user_id=event.source.user_id,
+                        entries=entries,
+                        currency="TWD",
+                        ts=ts,
                     )
-                    return
-                    # 2.x 查餘額
-                if cmd["type"] == "balance":
-                    try:
-                        balance = repo.get_balance(group_id)
-                        line_bot_api.reply_message(
-                            ReplyMessageRequest(
-                                reply_token=event.reply_token,
-                                messages=[TextMessage(text=f"目前儲存金餘額：{balance} 元")]
-                            )
-                        )
-                    except Exception as e:
-                        line_bot_api.reply_message(
-                            ReplyMessageRequest(
-                                reply_token=event.reply_token,
-                                messages=[TextMessage(text=f"查詢餘額失敗：{e}")]
-                            )
-                        )
-                    return
-                if cmd["type"] == "deposit":
-                    try:
-                        new_balance = repo.deposit(
-                            group_id=group_id,
-                            amount=cmd["amount"],
-                            actor_user_id=event.source.user_id
-                        )
-                        line_bot_api.reply_message(
-                            ReplyMessageRequest(
-                                reply_token=event.reply_token,
-                                messages=[TextMessage(text=f"已存入 {cmd['amount']} 元\n目前儲存金：{new_balance} 元")]
-                            )
-                        )
-                    except Exception as e:
-                        line_bot_api.reply_message(
-                            ReplyMessageRequest(
-                                reply_token=event.reply_token,
-                                messages=[TextMessage(text=f"存入失敗：{e}")]
-                            )
-                        )
-                    return
-                # 2.2 記帳：類別 金額 商品
-                if cmd["type"] == "add":
-                    try:
-                        ts = datetime.now(TAIPEI_TZ).strftime("%Y-%m-%d %H:%M:%S")
-                        repo.add_record(
-                            group_id=group_id,
-                            user_id=event.source.user_id,
-                            raw_text=text,
-                            item=cmd["item"],
-                            amount=cmd["amount"],
-                            category=cmd["category"],
-                            currency="TWD",
-                            ts=ts,
-                        )
-
-                        # ✅ 新增：扣儲存金並回覆餘額
-                        balance = repo.deduct(
-                            group_id=group_id,
-                            amount=cmd["amount"],
-                            actor_user_id=event.source.user_id
-                        )
+                    total = sum(e["amount"] for e in entries)
+                    lines = [f"已記錄 {len(entries)} 筆，合計 {total} 元"]
+                    lines += [f"- {e['category']} {e['amount']} {e['item']}" for e in entries]
+                    lines.append(f"剩餘儲存金：{balance} 元")
+                    return [TextMessage(text="\n".join(lines))]
+                except Exception as e:
+                    return [TextMessage(text=f"記錄失敗：{e}")]
 
-                        line_bot_api.reply_message(
-                            ReplyMessageRequest(
-                                reply_token=event.reply_token,
-                                messages=[TextMessage(
-                                    text=(
-                                        f"已記錄：{cmd['category']} {cmd['amount']} {cmd['item']}\n"
-                                        f"剩餘儲存金：{balance} 元"
-                                    )
-                                )],
-                            )
-                        )
-                    except Exception as e:
-                        line_bot_api.reply_message(
-                            ReplyMessageRequest(
-                                reply_token=event.reply_token,
-                                messages=[TextMessage(text=f"記錄失敗：{e}")],
-                            )
-                        )
-                    return
-
-                # 2.3 查詢明細
-                if cmd["type"] == "query":
-                    try:
-                        start_dt, end_dt = resolve_ledger_range(cmd["range"])
-                        start_iso = start_dt.strftime("%Y-%m-%d %H:%M:%S")
-                        end_iso = end_dt.strftime("%Y-%m-%d %H:%M:%S")
-
-                        rows = repo.query_records(
-                            group_id=group_id,
-                            start_iso=start_iso,
-                            end_iso=end_iso,
-                            category=cmd.get("category"),
-                            limit=50,
-                        )
+            # 2.3 查詢明細
+            if cmd["type"] == "query":
+                try:
+                    start_dt, end_dt = resolve_ledger_range(cmd["range"])
+                    start_iso = start_dt.strftime("%Y-%m-%d %H:%M:%S")
+                    end_iso = end_dt.strftime("%Y-%m-%d %H:%M:%S")
+
+                    rows = repo.query_records(
+                        group_id=group_id,
+                        start_iso=start_iso,
+                        end_iso=end_iso,
+                        category=cmd.get("category"),
+                        limit=None,
+                    )
 
-                        if not rows:
-                            msg = "查無資料"
-                        else:
-                            total = sum(int(r.get("amount", 0)) for r in rows)
-                            head = f"共 {len(rows)} 筆，合計 {total} 元"
-                            lines = [
-                                f"- {r.get('ts','')} {r.get('category','')} {r.get('amount','')} {r.get('item','')}"
-                                for r in rows[:10]
-                            ]
-                            more = "" if len(rows) <= 10 else "\n(僅顯示前 10 筆；可用：查本月 餐飲)"
-                            msg = head + "\n" + "\n".join(lines) + more
-
-                        line_bot_api.reply_message(
-                            ReplyMessageRequest(
-                                reply_token=event.reply_token,
-                                messages=[TextMessage(text=msg)],
-                            )
-                        )
-                    except Exception as e:
-                        line_bot_api.reply_message(
-                            ReplyMessageRequest(
-                                reply_token=event.reply_token,
-                                messages=[TextMessage(text=f"查詢失敗：{e}")],
-                            )
-                        )
-                    return
-
-                # 2.4 彙整：各類別合計
-                if cmd["type"] == "summary":
-                    try:
-                        start_dt, end_dt = resolve_ledger_range(cmd["range"])
-                        start_iso = start_dt.strftime("%Y-%m-%d %H:%M:%S")
-                        end_iso = end_dt.strftime("%Y-%m-%d %H:%M:%S")
-
-                        data = repo.summary_by_category(
-                            group_id=group_id,
-                            start_iso=start_iso,
-                            end_iso=end_iso,
-                            category=cmd.get("category"),
-                        )
+                    if not rows:
+                        return [TextMessage(text="查無資料")]
+                    if len(rows) > QUERY_PAGE_SIZE:
+                        cursor = query_cursors.create(group_id, start_iso, end_iso, cmd.get("category"), rows)
+                    else:
+                        # 一頁放得下：不用留 cursor
+                        cursor = QueryCursor("", group_id, start_iso, end_iso, cmd.get("category"), rows)
+                    return _query_page(cursor, 0)
+                except Exception as e:
+                    return [TextMessage(text=f"查詢失敗：{e}")]
 
-                        if data["total_count"] == 0:
-                            msg = "查無資料"
-                        else:
-                            head = f"彙整（{cmd['range']}）共 {data['total_count']} 筆，合計 {data['total_amount']} 元"
-                            lines = []
-                            for i, (cat, v) in enumerate(data["by_category"].items()):
-                                if i >= 10:
-                                    break
-                                lines.append(f"- {cat}：{v['amount']} 元（{v['count']} 筆）")
-                            more = "" if len(data["by_category"]) <= 10 else "\n(僅顯示前 10 類)"
-                            msg = head + "\n" + "\n".join(lines) + more
-
-                        line_bot_api.reply_message(
-                            ReplyMessageRequest(
-                                reply_token=event.reply_token,
-                                messages=[TextMessage(text=msg)],
-                            )
-                        )
-                    except Exception as e:
-                        line_bot_api.reply_message(
-                            ReplyMessageRequest(
-                                reply_token=event.reply_token,
-                                messages=[TextMessage(text=f"彙整失敗：{e}")],
-                            )
-                        )
-                    return
-
-        # =========================
-        # 你原本的其他功能（保留）
-        # =========================
-        if re.search(r"吃.*麼|吃啥", text):
-            eat = random.choice(["八方", "7-11", "滷肉飯", "涼麵", "牛肉麵", "麥噹噹", "摩斯", "拉麵", "咖哩飯", "粥", "秀秀早餐", "聽寶的"])
-            line_bot_api.reply_message(
-                ReplyMessageRequest(reply_token=event.reply_token, messages=[TextMessage(text=eat)])
-            )
-            return
+            # 2.3b 匯出：回一個有時效的 CSV 下載連結
+            if cmd["type"] == "export":
+                try:
+                    start_dt, end_dt = resolve_ledger_range(cmd["range"])
+                    token = make_export_token(
+                        group_id,
+                        start_dt.strftime("%Y-%m-%d %H:%M:%S"),
+                        end_dt.strftime("%Y-%m-%d %H:%M:%S"),
+                        ttl=EXPORT_LINK_TTL,
+                    )
+                    url = export_url(token)
+                    if url is None:
+                        return [TextMessage(text="匯出失敗：未設定 PUBLIC_BASE_URL")]
+                    return [TextMessage(text=f"匯出（{cmd['range']}）CSV，{int(EXPORT_LINK_TTL // 60)} 分鐘內有效：\n{url}")]
+                except Exception as e:
+                    return [TextMessage(text=f"匯出失敗：{e}")]
 
-        if re.search(r"喝.*麼|喝啥", text):
-            drink = random.choice(["可不可", "得正", "50嵐", "鶴茶樓", "再睡", "一沐日", "青山", "UG", "壽奶茶", "迷客夏", "COCO", "聽寶的"])
-            line_bot_api.reply_message(
-                ReplyMessageRequest(reply_token=event.reply_token, messages=[TextMessage(text=drink)])
-            )
-            return
-
-        if "查詢" in text:
-            user_input_for_search = text.replace("查詢", "").strip()
-            q = urllib.parse.quote(user_input_for_search)
-            buttons_template = ButtonsTemplate(
-                title="查詢任意門",
-                thumbnail_image_url="https://i.imgur.com/nwFbufB.jpeg",
-                text="請選擇以下連結",
-                actions=[
-                    MessageAction(label="說哈囉", text="Hello!"),
-                    URIAction(label="GOOGLE", uri=f"https://www.google.com/search?q={q}"),
-                    URIAction(label="維基", uri=f"https://zh.wikipedia.org/wiki/{q}"),
-                    URIAction(label="Google Maps", uri=f"https://www.google.com/maps/search/{q}"),
-                ],
-            )
-            template_message = TemplateMessage(alt_text="查詢任意門", template=buttons_template)
-            line_bot_api.reply_message(
-                ReplyMessageRequest(reply_token=event.reply_token, messages=[template_message])
-            )
-            return
+            # 2.4 彙整：各類別合計
+            if cmd["type"] == "summary":
+                try:
+                    start_dt, end_dt = resolve_ledger_range(cmd["range"])
+                    start_iso = start_dt.strftime("%Y-%m-%d %H:%M:%S")
+                    end_iso = end_dt.strftime("%Y-%m-%d %H:%M:%S")
+
+                    data = repo.summary_by_category(
+                        group_id=group_id,
+                        start_iso=start_iso,
+                        end_iso=end_iso,
+                        category=cmd.get("category"),
+                    )
 
-        if "匯率" in text:
-            # 簡化版：你原本匯率爬蟲可自行替換回去
-            line_bot_api.reply_message(
-                ReplyMessageRequest(reply_token=event.reply_token, messages=[TextMessage(text="匯率功能：爬取中...")])
-            )
-            return
+                    if data["total_count"] == 0:
+                        msg = "查無資料"
+                    else:
+                        head = f"彙整（{cmd['range']}）共 {data['total_count']} 筆，合計 {data['total_amount']} 元"
+                        lines = []
+                        for i, (cat, v) in enumerate(data["by_category"].items()):
+                            if i >= 10:
+                                break
+                            lines.append(f"- {cat}：{v['amount']} 元（{v['count']} 筆）")
+                        more = "" if len(data["by_category"]) <= 10 else "\n(僅顯示前 10 類)"
+                        msg = head + "\n" + "\n".join(lines) + more
+
+                    return [TextMessage(text=msg)]
+                except Exception as e:
+                    return [TextMessage(text=f"彙整失敗：{e}")]
 
-        # 預設回音
-        line_bot_api.reply_message(
-            ReplyMessageRequest(reply_token=event.reply_token, messages=[TextMessage(text=text)])
+            # 2.5 重建彙整
+            if cmd["type"] == "rebuild_rollups":
+                try:
+                    repo.rebuild_rollups()
+                    msg = "彙整資料已重建"
+                except Exception as e:
+                    msg = f"重建失敗：{e}"
+                return [TextMessage(text=msg)]
+
+    # =========================
+    # 你原本的其他功能（保留）
+    # =========================
+    if re.search(r"吃.*麼|吃啥", text):
+        stat["type"] = "eat"
+        eat = random.choice(["八方", "7-11", "滷肉飯", "涼麵", "牛肉麵", "麥噹噹", "摩斯", "拉麵", "咖哩飯", "粥", "秀秀早餐", "聽寶的"])
+        return [TextMessage(text=eat)]
+
+    if re.search(r"喝.*麼|喝啥", text):
+        stat["type"] = "drink"
+        drink = random.choice(["可不可", "得正", "50嵐", "鶴茶樓", "再睡", "一沐日", "青山", "UG", "壽奶茶", "迷客夏", "COCO", "聽寶的"])
+        return [TextMessage(text=drink)]
+
+    if "查詢" in text:
+        stat["type"] = "search"
+        user_input_for_search = text.replace("查詢", "").strip()
+        q = urllib.parse.quote(user_input_for_search)
+        buttons_template = ButtonsTemplate(
+            title="查詢任意門",
+            thumbnail_image_url="https://i.imgur.com/nwFbufB.jpeg",
+            text="請選擇以下連結",
+            actions=[
+                MessageAction(label="說哈囉", text="Hello!"),
+                URIAction(label="GOOGLE", uri=f"https://www.google.com/search?q={q}"),
+                URIAction(label="維基", uri=f"https://zh.wikipedia.org/wiki/{q}"),
+                URIAction(label="Google Maps", uri=f"https://www.google.com/maps/search/{q}"),
+            ],
         )
+        template_message = TemplateMessage(alt_text="查詢任意門", template=buttons_template)
+        return [template_message]
+
+    if "匯率" in text:
+        stat["type"] = "fx"
+        table = fx_service.get()
+        if table is None:
+            return [TextMessage(text="匯率資料準備中，請稍後再試")]
+        stale = time.time() - table.fetched_at >= fx_service.ttl
+        return [TextMessage(text=fx_reply(table, parse_fx_command(text), stale=stale))]
+
+    # 預設回音
+    stat["type"] = "echo"
+    return [TextMessage(text=text)]
+
+
+def _reply_postback(event) -> list | None:
+    """
+    postback -> 要回覆的 messages（Flask / ASGI 共用）；目前只有查詢結果的「下一頁」
+    """
+    data = dict(urllib.parse.parse_qsl(event.postback.data or ""))
+    if data.get("a") != "page":
+        return None
+
+    group_id = getattr(event.source, "group_id", None)
+    if event.source.type != "group" or not group_id:
+        return None
+    try:
+        page = max(0, int(data.get("p", "0")))
+    except ValueError:
+        page = 0
+
+    cursor = query_cursors.get(data.get("c", ""), group_id)
+    metrics.cache_hit("query_cursor", cursor is not None)
+    if cursor is None:
+        # 過期 / 在別的 worker 建的
+        return [TextMessage(text="查詢結果已過期，請重新查詢")]
+
+    if page * QUERY_PAGE_SIZE >= len(cursor):
+        return [TextMessage(text="沒有更多資料了")]
+    return _query_page(cursor, page)
 
 
 @handler.add(PostbackEvent)
 def handle_postback(event):
-    # 你原本 postback 邏輯可自行補回
-    pass
+    messages = _reply_postback(event)
+    if messages:
+        line_client.api.reply_message(
+            ReplyMessageRequest(reply_token=event.reply_token, messages=messages)
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,118 @@
+"""
+把整張 records 拆成月份分區（records_2026-01、records_2026-02 ...），給 LEDGER_PARTITION=month 用
+
+  - 依 ts 的 YYYY-MM 分組（ts 跟 index 一樣寬鬆解析，2026/2/1 9:05:00 也認得），分區不存在就建立（含 header），每個分區分批 append_rows
+  - 分區裡已經有的列（整列相同）會略過，重跑不會重複
+  - ts 讀不出月份的列不搬，最後列出來
+  - 原本的 records 不刪；--rename-source 可以改名（例：records_archive）避免再被寫入
+
+用法：
+  LEDGER_SPREADSHEET_ID=... python archive_records.py --dry-run
+  LEDGER_SPREADSHEET_ID=... python archive_records.py --rename-source records_archive
+"""
+import argparse
+import os
+import sys
+
+from gspread.exceptions import WorksheetNotFound
+
+from partitions import partition_key, partition_title
+from records_index import RECORD_COLUMNS, epoch_to_ts, ts_to_epoch
+
+
+def _month_of(ts) -> str | None:
+    epoch = ts_to_epoch(ts)
+    return None if epoch is None else partition_key(epoch_to_ts(epoch))
+
+
+def _get_or_create(sh, title: str, header: list[str], dry_run: bool):
+    try:
+        return sh.worksheet(title)
+    except WorksheetNotFound:
+        if dry_run:
+            return None
+    ws = sh.add_worksheet(title=title, rows=1000, cols=len(header))
+    ws.append_row(header, value_input_option="USER_ENTERED")
+    return ws
+
+
+def split_records(sh, source: str = "records", prefix: str = "records", dry_run: bool = False,
+                  batch_size: int = 5000) -> dict:
+    """
+    回傳 {"partitions": {YYYY-MM: 寫入筆數}, "skipped_existing": n, "bad_rows": [列號...]}
+    """
+    values = sh.worksheet(source).get_all_values()
+    if not values:
+        return {"partitions": {}, "skipped_existing": 0, "bad_rows": []}
+
+    header = [str(h).strip() for h in values[0]] or list(RECORD_COLUMNS)
+    ts_col = header.index("ts") if "ts" in header else 0
+
+    by_month: dict[str, list[list]] = {}
+    bad_rows = []
+    for i, row in enumerate(values[1:], start=2):
+        if not any(str(c).strip() for c in row):
+            continue
+        key = _month_of(row[ts_col] if ts_col < len(row) else "")
+        if key is None:
+            bad_rows.append(i)
+            continue
+        by_month.setdefault(key, []).append(row)
+
+    written: dict[str, int] = {}
+    skipped = 0
+    for key in sorted(by_month):
+        rows = by_month[key]
+        ws = _get_or_create(sh, partition_title(prefix, key), header, dry_run)
+
+        if ws is not None:
+            existing = {tuple(r) for r in ws.get_all_values()[1:]}
+            fresh = [r for r in rows if tuple(r) not in existing]
+            skipped += len(rows) - len(fresh)
+            rows = fresh
+
+        if not dry_run:
+            for i in range(0, len(rows), batch_size):
+                ws.append_rows(rows[i:i + batch_size], value_input_option="USER_ENTERED")
+        written[key] = len(rows)
+        print(f"[archive] {partition_title(prefix, key)}: {len(rows)} row(s){' (dry-run)' if dry_run else ''}")
+
+    return {"partitions": written, "skipped_existing": skipped, "bad_rows": bad_rows}
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="split the records worksheet into monthly partitions")
+    ap.add_argument("--source", default="records")
+    ap.add_argument("--prefix", default="records", help="分區名稱前綴（跟 LedgerRepo 的 records_sheet 一樣）")
+    ap.add_argument("--dry-run", action="store_true")
+    ap.add_argument("--rename-source", default=None, help="搬完後把原本的 records 改名")
+    args = ap.parse_args(argv)
+
+    spreadsheet_id = os.getenv("LEDGER_SPREADSHEET_ID")
+    if not spreadsheet_id:
+        print("Missing env: LEDGER_SPREADSHEET_ID")
+        return 2
+
+    import gspread
+    from google.oauth2.service_account import Credentials
+    from gsheets_repo import GS_SCOPES, ensure_service_account_file
+
+    creds = Credentials.from_service_account_file(ensure_service_account_file(), scopes=GS_SCOPES)
+    sh = gspread.authorize(creds).open_by_key(spreadsheet_id)
+
+    result = split_records(sh, source=args.source, prefix=args.prefix, dry_run=args.dry_run)
+    print(
+        f"[archive] done: {sum(result['partitions'].values())} row(s) in {len(result['partitions'])} partition(s), "
+        f"{result['skipped_existing']} already present"
+    )
+    if result["bad_rows"]:
+        print(f"[archive] rows without a valid ts (not moved): {result['bad_rows'][:50]}")
+
+    if args.rename_source and not args.dry_run:
+        sh.worksheet(args.source).update_title(args.rename_source)
+        print(f"[archive] renamed {args.source} -> {args.rename_source}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,337 @@
+"""
+ASGI 入口（app:app 的替代）：一個 process 用 asyncio 同時處理幾百個 event
+
+  uvicorn asgi:app --host 0.0.0.0 --port $PORT
+  gunicorn asgi:app -k uvicorn.workers.UvicornWorker
+
+  - /callback：驗簽章 / prefilter / parse / 去重跟 app.py 共用（app.webhook_events，在 thread pool 跑：
+    prefilter / 去重可能查 SQLite），每個 event 一個 asyncio task，立刻回 200；body 不是 UTF-8 回 400；同時最多 ASGI_MAX_INFLIGHT 個（預設 500），滿了就在 request 裡處理完再回
+  - LINE 回覆走 AsyncMessagingApi（aiohttp），等回覆時不佔 thread
+  - 記帳（gspread / SQLite）、寫 user registry 這類會 block 的呼叫丟到 ASGI_BLOCKING_WORKERS 條 thread（預設 32）
+  - 文字訊息 / 加好友 / postback 有 async handler；其他 event 照 app.handler 的註冊表在 thread pool 跑 sync handler
+  - /health、/metrics 直接回；其他路由（/send_message、/send_bulk、/export.csv ...）轉給 Flask app，
+    在 thread pool 跑，回應一段一段轉出去（串流不會被整段收起來）
+  - lifespan shutdown 時等進行中的 event 處理完（最多 ASGI_DRAIN_TIMEOUT 秒）
+"""
+import asyncio
+import contextvars
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from linebot.v3.messaging import ReplyMessageRequest, TextMessage
+from linebot.v3.webhooks import MessageEvent
+
+import app as bot
+import metrics
+from line_client import AsyncMessagingClient
+from webhook_worker import dispatch_event
+
+
+line_client = AsyncMessagingClient(bot.configuration)
+
+
+class AsyncEventRunner:
+    """
+    event -> asyncio task：
+      - handlers：跟 WebhookHandler 一樣的 key（MessageEvent_TextMessageContent、FollowEvent ...）-> async 函式
+      - 沒有 async handler 的 event 用 dispatch_event 在 thread pool 跑原本的 sync handler
+      - run_blocking()：丟到 bounded thread pool，帶著目前的 contextvars（metrics.current_event_ts）
+      - fork-safe：pid 變了就重建 thread pool
+    """
+
+    def __init__(self, handler, workers: int | None = None, max_inflight: int | None = None):
+        if workers is None:
+            workers = int(os.getenv("ASGI_BLOCKING_WORKERS", "32"))
+        if max_inflight is None:
+            max_inflight = int(os.getenv("ASGI_MAX_INFLIGHT", "500"))
+
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        self.max_inflight = max(1, int(max_inflight))
+        self.handlers: dict[str, object] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._pool: ThreadPoolExecutor | None = None
+        self._pid: int | None = None
+        self._stats = {"processed": 0, "failed": 0, "inline": 0, "max_inflight_seen": 0}
+
+    def add(self, key: str):
+        def deco(fn):
+            self.handlers[key] = fn
+            return fn
+
+        return deco
+
+    def _executor(self) -> ThreadPoolExecutor:
+        if self._pid != os.getpid():
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="asgi-blocking")
+            self._pid = os.getpid()
+        return self._pool
+
+    async def run_blocking(self, fn, *args):
+        ctx = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self._executor(), ctx.run, fn, *args)
+
+    # =========================
+    # 分派
+    # =========================
+    def _lookup(self, event):
+        func = None
+        if isinstance(event, MessageEvent):
+            func = self.handlers.get(f"{event.__class__.__name__}_{event.message.__class__.__name__}")
+        if func is None:
+            func = self.handlers.get(event.__class__.__name__)
+        return func
+
+    async def _process(self, event) -> None:
+        token = metrics.current_event_ts.set(getattr(event, "timestamp", None))
+        try:
+            func = self._lookup(event)
+            if func is not None:
+                await func(event)
+            else:
+                await self.run_blocking(dispatch_event, self.handler, event)
+        except Exception as e:
+            print(f"[asgi] handler error: {e}")
+            self._stats["failed"] += 1
+        else:
+            self._stats["processed"] += 1
+        finally:
+            metrics.current_event_ts.reset(token)
+
+    async def submit(self, event) -> bool:
+        """
+        開 task 回 True；進行中的已經滿了就直接 await 處理完再回 False（backpressure）
+        """
+        if len(self._tasks) >= self.max_inflight:
+            self._stats["inline"] += 1
+            await self._process(event)
+            return False
+        task = asyncio.create_task(self._process(event))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        if len(self._tasks) > self._stats["max_inflight_seen"]:
+            self._stats["max_inflight_seen"] = len(self._tasks)
+        return True
+
+    async def drain(self, timeout: float) -> None:
+        if self._tasks:
+            done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+            if pending:
+                print(f"[asgi] shutdown timeout, {len(pending)} event(s) still running")
+
+    def shutdown(self) -> None:
+        if self._pool is not None and self._pid == os.getpid():
+            self._pool.shutdown(wait=False)
+        self._pool = None
+        self._pid = None
+
+    def stats(self) -> dict:
+        out = dict(self._stats)
+        out["inflight"] = len(self._tasks)
+        out["max_inflight"] = self.max_inflight
+        out["workers"] = self.workers
+        return out
+
+
+runner = AsyncEventRunner(bot.handler)
+
+
+# =========================
+# async handlers
+# =========================
+@runner.add("MessageEvent_TextMessageContent")
+async def handle_message(event):
+    stat = {"type": "echo"}
+    started = time.perf_counter()
+    try:
+        # 可能碰到記帳 repo / 匯率抓取 -> thread pool
+        messages = await runner.run_blocking(bot._reply_messages, event, stat)
+        if messages:
+            await line_client.api.reply_message(
+                ReplyMessageRequest(reply_token=event.reply_token, messages=messages)
+            )
+    finally:
+        metrics.COMMAND_SECONDS.observe(time.perf_counter() - started, type=stat["type"])
+
+
+@runner.add("FollowEvent")
+async def handle_follow(event):
+    await runner.run_blocking(bot.record_follower, event)
+    await line_client.api.reply_message(
+        ReplyMessageRequest(
+            reply_token=event.reply_token,
+            messages=[TextMessage(text="感謝加入好友")],
+        )
+    )
+
+
+@runner.add("PostbackEvent")
+async def handle_postback(event):
+    # 只翻記憶體裡的 cursor，不碰 repo，直接在 event loop 上做
+    messages = bot._reply_postback(event)
+    if messages:
+        await line_client.api.reply_message(
+            ReplyMessageRequest(reply_token=event.reply_token, messages=messages)
+        )
+
+
+def _runtime_collector():
+    st = runner.stats()
+    return [(
+        "linebot_asgi_events", "gauge", "ASGI in-flight webhook events",
+        {(k,): st[k] for k in ("inflight", "max_inflight", "max_inflight_seen", "processed", "failed", "inline")},
+        ("field",),
+    )]
+
+
+metrics.register_collector(_runtime_collector)
+
+
+# =========================
+# HTTP
+# =========================
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        msg = await receive()
+        chunks.append(msg.get("body", b""))
+        if not msg.get("more_body", False):
+            return b"".join(chunks)
+
+
+async def _respond(send, status: int, body: bytes, content_type: str = "text/plain; charset=utf-8") -> None:
+    headers = [(b"content-type", content_type.encode("latin-1")), (b"content-length", str(len(body)).encode())]
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+
+def _header(scope, name: bytes) -> str:
+    for k, v in scope.get("headers", []):
+        if k.lower() == name:
+            return v.decode("latin-1")
+    return ""
+
+
+async def _callback(scope, receive, send) -> None:
+    try:
+        body = (await _read_body(receive)).decode("utf-8")
+    except UnicodeDecodeError:
+        await _respond(send, 400, b"Bad Request")
+        return
+    events = await runner.run_blocking(bot.webhook_events, body, _header(scope, b"x-line-signature"))
+    if events is None:
+        await _respond(send, 400, b"Bad Request")
+        return
+
+    with metrics.WEBHOOK_STAGE_SECONDS.time(stage="dispatch"):
+        for event in events:
+            await runner.submit(event)
+    await _respond(send, 200, b"OK")
+
+
+def _wsgi_environ(scope, body: bytes) -> dict:
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        "PATH_INFO": scope["path"],
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": str(server[0]),
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for k, v in scope.get("headers", []):
+        name = k.decode("latin-1").upper().replace("-", "_")
+        value = v.decode("latin-1")
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif name != "CONTENT_LENGTH":
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+def _start_wsgi(environ: dict):
+    out = {}
+
+    def start_response(status, headers, exc_info=None):
+        out["status"] = int(status.split(" ", 1)[0])
+        out["headers"] = headers
+        return lambda data: None
+
+    result = bot.app(environ, start_response)
+    it = iter(result)
+    # start_response 可能要等第一段 body 才被呼叫（generator 型的 app）
+    first = next(it, None)
+    return out["status"], out["headers"], result, it, first
+
+
+def _next_chunk(it):
+    return next(it, None)
+
+
+async def _flask(scope, receive, send) -> None:
+    """
+    WSGI 的回應一段一段轉出去（串流的 Response，例如 /export.csv，第一段不用等全部讀完）
+    每段 next() 都在 thread pool 跑
+    """
+    environ = _wsgi_environ(scope, await _read_body(receive))
+    status, headers, result, it, chunk = await runner.run_blocking(_start_wsgi, environ)
+    try:
+        raw = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]
+        await send({"type": "http.response.start", "status": status, "headers": raw})
+        while chunk is not None:
+            if chunk:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            chunk = await runner.run_blocking(_next_chunk, it)
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        if hasattr(result, "close"):
+            await runner.run_blocking(result.close)
+
+
+async def _lifespan(receive, send) -> None:
+    while True:
+        msg = await receive()
+        if msg["type"] == "lifespan.startup":
+            if os.getenv("LEDGER_EAGER_INIT", "1") == "1":
+                bot.ledger.start()
+            await send({"type": "lifespan.startup.complete"})
+        elif msg["type"] == "lifespan.shutdown":
+            await runner.drain(float(os.getenv("ASGI_DRAIN_TIMEOUT", "25")))
+            await line_client.close()
+            runner.shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    path, method = scope["path"], scope["method"]
+    if path == "/callback" and method == "POST":
+        await _callback(scope, receive, send)
+    elif path == "/health" and method in ("GET", "HEAD"):
+        status = bot.ledger.status()
+        body = json.dumps({"status": "OK", "ledger": status, "ready": status["state"] in ("ready", "disabled")})
+        await _respond(send, 200, body.encode(), "application/json")
+    elif path == "/metrics" and method == "GET":
+        await _respond(send, 200, metrics.render().encode(), "text/plain; version=0.0.4")
+    else:
+        await _flask(scope, receive, send)
@@ -0,0 +1,247 @@
+import re
+import threading
+import time
+from collections import Counter
+
+from gspread.exceptions import WorksheetNotFound
+
+
+_A1 = re.compile(r"^([A-Z]+)(\d+)(?::([A-Z]+)(\d*))?$")
+
+
+def _col_index(letters: str) -> int:
+    n = 0
+    for ch in letters:
+        n = n * 26 + (ord(ch) - 64)
+    return n - 1
+
+
+class FakeCell:
+    def __init__(self, value):
+        self.value = value
+
+
+class CallStats:
+    """
+    所有假物件共用的呼叫計數（method -> 次數 / 總耗時）
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts: Counter = Counter()
+        self.seconds: Counter = Counter()
+
+    def record(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.counts[name] += 1
+            self.seconds[name] += seconds
+
+    def snapshot(self) -> Counter:
+        with self._lock:
+            return Counter(self.counts)
+
+    def total(self) -> int:
+        with self._lock:
+            return sum(self.counts.values())
+
+
+class FakeWorksheet:
+    """
+    記憶體版 gspread Worksheet，只實作 LedgerRepo 會用到的方法
+    latency：每次呼叫固定 sleep 的秒數（模擬 Google 往返）
+    值都存成字串（跟 FORMATTED_VALUE 讀回來一樣）
+    """
+
+    def __init__(self, title: str, rows: list[list], stats: CallStats, latency: float = 0.0):
+        self.title = title
+        self.rows: list[list] = [[str(c) for c in r] for r in rows]
+        self.stats = stats
+        self.latency = latency
+        self._lock = threading.Lock()
+
+    def _call(self, name: str) -> None:
+        t0 = time.perf_counter()
+        if self.latency:
+            time.sleep(self.latency)
+        self.stats.record(f"{self.title}.{name}", time.perf_counter() - t0)
+
+    @staticmethod
+    def _parse(a1: str) -> tuple[int, int, int | None, int | None]:
+        m = _A1.match(a1)
+        if not m:
+            raise ValueError(f"unsupported range: {a1}")
+        c0 = _col_index(m.group(1))
+        r0 = int(m.group(2))
+        c1 = _col_index(m.group(3)) if m.group(3) else c0
+        r1 = int(m.group(4)) if m.group(4) else (None if m.group(3) else r0)
+        return r0, c0, r1, c1
+
+    def _set(self, row: int, col: int, value) -> None:
+        while len(self.rows) < row:
+            self.rows.append([])
+        r = self.rows[row - 1]
+        while len(r) <= col:
+            r.append("")
+        r[col] = str(value)
+
+    # =========================
+    # 讀
+    # =========================
+    def get_all_records(self, **kwargs) -> list[dict]:
+        self._call("get_all_records")
+        with self._lock:
+            if not self.rows:
+                return []
+            header = self.rows[0]
+            out = []
+            for r in self.rows[1:]:
+                d = {h: (r[i] if i < len(r) else "") for i, h in enumerate(header)}
+                for k, v in d.items():
+                    # gspread 預設會把數字字串轉成數字
+                    if v.lstrip("-").isdigit():
+                        d[k] = int(v)
+                out.append(d)
+            return out
+
+    def get_all_values(self, **kwargs) -> list[list]:
+        self._call("get_all_values")
+        with self._lock:
+            return [list(r) for r in self.rows]
+
+    def row_values(self, row: int, **kwargs) -> list:
+        self._call("row_values")
+        with self._lock:
+            return list(self.rows[row - 1]) if row <= len(self.rows) else []
+
+    def get(self, range_name: str, **kwargs) -> list[list]:
+        self._call("get")
+        r0, c0, r1, c1 = self._parse(range_name)
+        with self._lock:
+            end = len(self.rows) if r1 is None else min(r1, len(self.rows))
+            return [list(r[c0:c1 + 1]) for r in self.rows[r0 - 1:end]]
+
+    def batch_get(self, ranges: list[str], **kwargs) -> list[list[list]]:
+        # 跟真的 API 一樣：一次呼叫、每個範圍各自回傳
+        self._call("batch_get")
+        out = []
+        with self._lock:
+            for rng in ranges:
+                r0, c0, r1, c1 = self._parse(rng)
+                end = len(self.rows) if r1 is None else min(r1, len(self.rows))
+                out.append([list(r[c0:c1 + 1]) for r in self.rows[r0 - 1:end]])
+        return out
+
+    def acell(self, label: str, **kwargs) -> FakeCell:
+        self._call("acell")
+        r0, c0, _, _ = self._parse(label)
+        with self._lock:
+            r = self.rows[r0 - 1] if r0 <= len(self.rows) else []
+            return FakeCell(r[c0] if c0 < len(r) else None)
+
+    # =========================
+    # 寫
+    # =========================
+    def _append(self, values: list[list]) -> dict:
+        with self._lock:
+            start = len(self.rows) + 1
+            self.rows.extend([str(c) for c in v] for v in values)
+            end = len(self.rows)
+        return {"updates": {"updatedRange": f"{self.title}!A{start}:Z{end}", "updatedRows": len(values)}}
+
+    def append_row(self, values: list, **kwargs) -> dict:
+        self._call("append_row")
+        return self._append([values])
+
+    def append_rows(self, values: list[list], **kwargs) -> dict:
+        self._call("append_rows")
+        return self._append(values)
+
+    def update_acell(self, label: str, value) -> dict:
+        self._call("update_acell")
+        r0, c0, _, _ = self._parse(label)
+        with self._lock:
+            self._set(r0, c0, value)
+        return {}
+
+    def batch_update(self, data: list[dict], **kwargs) -> dict:
+        self._call("batch_update")
+        with self._lock:
+            for d in data:
+                r0, c0, _, _ = self._parse(d["range"])
+                for i, row in enumerate(d["values"]):
+                    for j, v in enumerate(row):
+                        self._set(r0 + i, c0 + j, v)
+        return {}
+
+
+class FakeSpreadsheet:
+    """
+    記憶體版 gspread Spreadsheet：只有分頁清單 / 找分頁 / 新增分頁（月份分區用）
+    """
+
+    def __init__(self, stats: CallStats, latency: float = 0.0, worksheets: list[FakeWorksheet] | None = None):
+        self.stats = stats
+        self.latency = latency
+        self._sheets: dict[str, FakeWorksheet] = {ws.title: ws for ws in (worksheets or [])}
+
+    def _call(self, name: str) -> None:
+        t0 = time.perf_counter()
+        if self.latency:
+            time.sleep(self.latency)
+        self.stats.record(f"spreadsheet.{name}", time.perf_counter() - t0)
+
+    def worksheets(self) -> list[FakeWorksheet]:
+        self._call("worksheets")
+        return list(self._sheets.values())
+
+    def worksheet(self, title: str) -> FakeWorksheet:
+        # gspread 的 worksheet() 也會打一次 API
+        self._call("worksheet")
+        if title not in self._sheets:
+            raise WorksheetNotFound(title)
+        return self._sheets[title]
+
+    def add_worksheet(self, title: str, rows: int = 1000, cols: int = 26, **kwargs) -> FakeWorksheet:
+        self._call("add_worksheet")
+        if title in self._sheets:
+            raise ValueError(f"worksheet already exists: {title}")
+        ws = FakeWorksheet(title, [], self.stats, self.latency)
+        self._sheets[title] = ws
+        return ws
+
+
+class StubMessagingApi:
+    """
+    假的 LINE MessagingApi：記錄回覆內容，可加延遲
+    """
+
+    def __init__(self, stats: CallStats, latency: float = 0.0):
+        self.stats = stats
+        self.latency = latency
+        self.last_messages = None
+
+    def _call(self, name: str) -> None:
+        t0 = time.perf_counter()
+        if self.latency:
+            time.sleep(self.latency)
+        self.stats.record(f"line.{name}", time.perf_counter() - t0)
+
+    def reply_message(self, req) -> None:
+        self._call("reply_message")
+        self.last_messages = req.messages
+
+    def push_message(self, req) -> None:
+        self._call("push_message")
+        self.last_messages = req.messages
+
+
+class StubLineClient:
+    """
+    取代 app.line_client（PooledMessagingClient）
+    """
+
+    def __init__(self, api: StubMessagingApi):
+        self.api = api
+
+    def stats(self) -> dict:
+        return {"hosts": {}}
@@ -0,0 +1,322 @@
+"""
+離線 benchmark：不連 Google / LINE，量 app.handle_message + LedgerRepo 在不同資料量下的表現
+
+  - Sheets 換成 fake_gspread.FakeWorksheet（每次呼叫可注入延遲）
+  - LINE 換成 StubMessagingApi
+  - 每種 parse_ledger_command 指令各跑 N 次：throughput、p50/p99、每個指令打幾次 Sheets
+  - /callback 整段（驗簽 -> prefilter -> parse -> handler）用一批熱鬧群組的混合 event 量每個 event 的 CPU，
+    比較 prefilter 關 / 只濾沒 handler 的 / 再加上略過沒啟用記帳的群組
+  - 結果寫成 JSON，方便跨版本比較
+
+用法：
+  python benchmarks/run_bench.py --rows 1000 10000 100000 --latency-ms 50 --iterations 30
+  python benchmarks/run_bench.py --rows 1000000 --latency-ms 0 --out bench_1m.json
+  python benchmarks/run_bench.py --rows 100000 --partition-by-month   # records 先拆成月份分區
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# app.py import 時需要的 env；不給 spreadsheet id -> app 不會自己連 Google
+os.environ.setdefault("LINE_CHANNEL_SECRET", "bench")
+os.environ.setdefault("LINE_CHANNEL_ACCESS_TOKEN", "bench")
+os.environ["LEDGER_BACKEND"] = "sheets"
+os.environ.pop("LEDGER_SPREADSHEET_ID", None)
+os.environ["LEDGER_EAGER_INIT"] = "0"
+# 假的 Sheets 不用配額節流（SHEETS_QUOTA=1 可以量節流 / 合併的效果）
+os.environ.setdefault("SHEETS_QUOTA", "0")
+# 匯出指令要組下載連結
+os.environ.setdefault("PUBLIC_BASE_URL", "https://bench.invalid")
+
+import app  # noqa: E402
+from archive_records import split_records  # noqa: E402
+from fake_gspread import CallStats, FakeSpreadsheet, FakeWorksheet, StubLineClient, StubMessagingApi  # noqa: E402
+from gsheets_repo import LedgerRepo  # noqa: E402
+from ledger import TAIPEI_TZ, parse_ledger_command  # noqa: E402
+from records_index import RECORD_COLUMNS  # noqa: E402
+from webhook_worker import EventPrefilter  # noqa: E402
+
+
+BENCH_GROUP = "Cbench"
+BENCH_USER = "Ubench"
+QUIET_GROUP = "Cquiet"  # 沒啟用記帳的群組
+CATEGORIES = ["餐飲", "交通", "日用", "娛樂", "醫療", "其他"]
+
+
+def _commands() -> list[tuple[str, str]]:
+    today = datetime.now(TAIPEI_TZ).strftime("%Y-%m-%d")
+    return [
+        ("help", "指令"),
+        ("balance", "餘額"),
+        ("deposit", "存入 100"),
+        ("add", "餐飲 120 午餐"),
+        ("add_many", "記帳\n餐飲 120 午餐\n交通 30 公車"),
+        ("query", "查本月"),
+        ("query_category", "查本月 餐飲"),
+        ("query_date", f"查 {today}"),
+        ("summary", "彙整 本月"),
+        ("summary_date", f"彙整 {today}"),
+        ("rebuild_rollups", "重建彙整"),
+        ("export", "匯出 本月"),
+        ("unknown", "今天天氣不錯"),
+    ]
+
+
+def build_sheets(n_rows: int, n_groups: int, stats: CallStats, latency: float, seed: int = 0):
+    """
+    n_rows 筆 records 平均分到 n_groups 個群組（含 BENCH_GROUP），時間散在最近一年
+    """
+    rnd = random.Random(seed)
+    groups = [BENCH_GROUP] + [f"Cgroup{i}" for i in range(1, n_groups)]
+    now = datetime.now(TAIPEI_TZ).replace(tzinfo=None)
+
+    records = [list(RECORD_COLUMNS)]
+    for i in range(n_rows):
+        ts = (now - timedelta(seconds=rnd.randrange(365 * 86400))).strftime("%Y-%m-%d %H:%M:%S")
+        records.append([ts, rnd.randrange(10, 2000), rnd.choice(CATEGORIES), f"item{i % 100}",
+                        "TWD", BENCH_USER, "bench", groups[i % n_groups]])
+    records[1:] = sorted(records[1:], key=lambda r: r[0])
+
+    ws_records = FakeWorksheet("records", records, stats, latency)
+    ws_groups = FakeWorksheet(
+        "groups",
+        [["group_id", "enabled", "created_at", "created_by", "note"]]
+        + [[g, "TRUE", "", BENCH_USER, ""] for g in groups],
+        stats,
+        latency,
+    )
+    ws_wallet = FakeWorksheet(
+        "wallet",
+        [["group_id", "balance", "updated_at", "updated_by"]] + [[g, 100000, "", BENCH_USER] for g in groups],
+        stats,
+        latency,
+    )
+    return ws_records, ws_groups, ws_wallet
+
+
+def _event(text: str):
+    return SimpleNamespace(
+        reply_token="bench-reply-token",
+        message=SimpleNamespace(text=text),
+        source=SimpleNamespace(type="group", group_id=BENCH_GROUP, user_id=BENCH_USER),
+    )
+
+
+def _percentile(sorted_vals: list[float], p: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    k = max(0, min(len(sorted_vals) - 1, int(round(p / 100 * len(sorted_vals) + 0.5)) - 1))
+    return sorted_vals[k]
+
+
+def _sheets_calls(c: Counter) -> Counter:
+    return Counter({k: v for k, v in c.items() if not k.startswith("line.")})
+
+
+def run_size(n_rows: int, args) -> list[dict]:
+    stats = CallStats()
+    latency = args.latency_ms / 1000
+    ws_records, ws_groups, ws_wallet = build_sheets(n_rows, args.groups, stats, latency)
+
+    if args.partition_by_month:
+        sh = FakeSpreadsheet(stats, latency, [ws_records, ws_groups, ws_wallet])
+        split_records(sh)
+        repo = LedgerRepo.from_worksheets(
+            None, ws_groups, ws_wallet, write_behind=False, spreadsheet=sh, partition_by_month=True
+        )
+    else:
+        repo = LedgerRepo.from_worksheets(ws_records, ws_groups, ws_wallet, write_behind=False)
+    app.ledger.set(repo)
+    app.line_client = StubLineClient(StubMessagingApi(stats, args.line_latency_ms / 1000))
+
+    results = []
+    for label, text in _commands():
+        cmd_type = parse_ledger_command(text)["type"]
+        iterations = args.iterations if cmd_type != "rebuild_rollups" else max(1, args.iterations // 10)
+
+        # 第一次（冷）單獨記
+        before = stats.snapshot()
+        t0 = time.perf_counter()
+        app.handle_message(_event(text))
+        cold_ms = (time.perf_counter() - t0) * 1000
+        cold_calls = sum(_sheets_calls(stats.snapshot() - before).values())
+
+        lat = []
+        before = stats.snapshot()
+        started = time.perf_counter()
+        for _ in range(iterations):
+            t0 = time.perf_counter()
+            app.handle_message(_event(text))
+            lat.append((time.perf_counter() - t0) * 1000)
+        elapsed = time.perf_counter() - started
+        calls = _sheets_calls(stats.snapshot() - before)
+
+        lat.sort()
+        results.append({
+            "rows": n_rows,
+            "command": label,
+            "type": cmd_type,
+            "text": text,
+            "iterations": iterations,
+            "throughput_per_s": round(iterations / elapsed, 2) if elapsed else None,
+            "mean_ms": round(sum(lat) / len(lat), 3),
+            "p50_ms": round(_percentile(lat, 50), 3),
+            "p99_ms": round(_percentile(lat, 99), 3),
+            "cold_ms": round(cold_ms, 3),
+            "cold_sheets_calls": cold_calls,
+            "sheets_calls_per_cmd": round(sum(calls.values()) / iterations, 3),
+            "sheets_calls_by_method": {k: round(v / iterations, 3) for k, v in sorted(calls.items())},
+        })
+    return results
+
+
+# =========================
+# /callback：prefilter 前後比較
+# =========================
+def _raw_event(seq: int, kind: str) -> dict:
+    ev = {
+        "type": "message",
+        "mode": "active",
+        "timestamp": int(time.time() * 1000),
+        "webhookEventId": f"bench{seq}",
+        "deliveryContext": {"isRedelivery": False},
+        "source": {"type": "group", "groupId": QUIET_GROUP, "userId": BENCH_USER},
+        "replyToken": "bench-reply-token",
+    }
+    if kind == "sticker":
+        ev["message"] = {"type": "sticker", "id": str(seq), "quoteToken": "q", "packageId": "1", "stickerId": "1",
+                         "stickerResourceType": "STATIC"}
+    elif kind == "image":
+        ev["message"] = {"type": "image", "id": str(seq), "quoteToken": "q",
+                         "contentProvider": {"type": "line"}}
+    elif kind == "ledger":
+        ev["source"]["groupId"] = BENCH_GROUP
+        ev["message"] = {"type": "text", "id": str(seq), "quoteToken": "q", "text": "餘額"}
+    else:
+        ev["message"] = {"type": "text", "id": str(seq), "quoteToken": "q", "text": "哈哈哈好好笑"}
+    return ev
+
+
+# 熱鬧群組：大多是貼圖 / 圖片 / 閒聊，少數是記帳
+WEBHOOK_MIX = ["sticker"] * 4 + ["image"] * 2 + ["chat"] * 3 + ["ledger"]
+
+
+def run_webhook(n_rows: int, args) -> list[dict]:
+    client = app.app.test_client()
+    secret = os.environ["LINE_CHANNEL_SECRET"].encode()
+    saved = (app.prefilter, app.dedup, app.WEBHOOK_SKIP_DISABLED_GROUPS)
+    app.dedup = None
+
+    variants = [
+        ("off", None, False),
+        ("no_handler", EventPrefilter(app.handler, skip=app._skip_raw_event), False),
+        ("skip_disabled", EventPrefilter(app.handler, skip=app._skip_raw_event), True),
+    ]
+    results = []
+    seq = 0
+    try:
+        for label, pf, skip_disabled in variants:
+            app.prefilter, app.WEBHOOK_SKIP_DISABLED_GROUPS = pf, skip_disabled
+            cpu = wall = 0.0
+            for _ in range(args.iterations):
+                events = []
+                for kind in WEBHOOK_MIX:
+                    seq += 1
+                    events.append(_raw_event(seq, kind))
+                body = json.dumps({"destination": "Ubot", "events": events}).encode()
+                sig = base64.b64encode(hmac.new(secret, body, hashlib.sha256).digest()).decode()
+
+                c0, w0 = time.process_time(), time.perf_counter()
+                resp = client.post("/callback", data=body, headers={"X-Line-Signature": sig})
+                cpu += time.process_time() - c0
+                wall += time.perf_counter() - w0
+                assert resp.status_code == 200, resp.status_code
+
+            n_events = args.iterations * len(WEBHOOK_MIX)
+            results.append({
+                "rows": n_rows,
+                "prefilter": label,
+                "events": n_events,
+                "cpu_us_per_event": round(cpu / n_events * 1e6, 2),
+                "wall_us_per_event": round(wall / n_events * 1e6, 2),
+            })
+    finally:
+        app.prefilter, app.dedup, app.WEBHOOK_SKIP_DISABLED_GROUPS = saved
+    return results
+
+
+def _git_rev() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="offline line-bot ledger benchmark")
+    ap.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    ap.add_argument("--groups", type=int, default=20, help="records 平均分到幾個群組")
+    ap.add_argument("--iterations", type=int, default=30)
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="每次 Sheets 呼叫的注入延遲")
+    ap.add_argument("--line-latency-ms", type=float, default=0.0, help="每次 LINE 呼叫的注入延遲")
+    ap.add_argument("--partition-by-month", action="store_true", help="records 拆成月份分區再跑")
+    ap.add_argument("--out", default="bench_results.json")
+    args = ap.parse_args(argv)
+
+    all_results = []
+    webhook_results = []
+    for n in args.rows:
+        print(f"== rows={n}")
+        for r in run_size(n, args):
+            all_results.append(r)
+            print(
+                f"  {r['command']:<16} p50 {r['p50_ms']:>9.3f} ms  p99 {r['p99_ms']:>9.3f} ms  "
+                f"{r['throughput_per_s'] or 0:>9.1f}/s  sheets/cmd {r['sheets_calls_per_cmd']:>6.2f}  "
+                f"cold {r['cold_ms']:>9.3f} ms ({r['cold_sheets_calls']} calls)"
+            )
+        for r in run_webhook(n, args):
+            webhook_results.append(r)
+            print(
+                f"  /callback prefilter={r['prefilter']:<14} cpu {r['cpu_us_per_event']:>9.1f} us/event  "
+                f"wall {r['wall_us_per_event']:>9.1f} us/event"
+            )
+
+    covered = {r["type"] for r in all_results}
+    out = {
+        "meta": {
+            "git_rev": _git_rev(),
+            "python": platform.python_version(),
+            "timestamp": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
+            "latency_ms": args.latency_ms,
+            "line_latency_ms": args.line_latency_ms,
+            "iterations": args.iterations,
+            "groups": args.groups,
+            "partition_by_month": args.partition_by_month,
+            "command_types": sorted(covered),
+        },
+        "results": all_results,
+        "webhook": webhook_results,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(out, f, ensure_ascii=False, indent=2)
+    print(f"wrote {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""
+webhook event 去重：LINE 因為我們回太慢而重送（isRedelivery=true）時，
+同一個 webhookEventId 只處理一次，避免重複 add_record + deduct
+
+  - MemoryDedupStore：單一 process，OrderedDict 做 TTL + 容量上限
+  - SQLiteDedupStore：多個 gunicorn worker 共用一個 sqlite 檔
+  - 標記是在處理「之前」做的：第一次處理到一半失敗，重送也不會再處理（寧可少記不要重扣）
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def event_key(event) -> str | None:
+    """
+    webhookEventId（SDK model 是 webhook_event_id）；舊格式 / UnknownEvent 可能沒有
+    """
+    return getattr(event, "webhook_event_id", None) or None
+
+
+def is_redelivery(event) -> bool:
+    ctx = getattr(event, "delivery_context", None)
+    return bool(getattr(ctx, "is_redelivery", False))
+
+
+class MemoryDedupStore:
+    def __init__(self, ttl: float = 600.0, max_size: int = 10000):
+        self.ttl = ttl
+        self.max_size = max(1, int(max_size))
+        self._lock = threading.Lock()
+        self._seen: OrderedDict[str, float] = OrderedDict()  # key -> 過期時間（插入順序 = 過期順序）
+
+    def seen_before(self, key: str) -> bool:
+        """
+        看過回 True；沒看過就記下來並回 False
+        """
+        now = time.monotonic()
+        with self._lock:
+            while self._seen:
+                exp = next(iter(self._seen.values()))
+                if exp > now and len(self._seen) < self.max_size:
+                    break
+                self._seen.popitem(last=False)
+
+            exp = self._seen.get(key)
+            if exp is not None and exp > now:
+                return True
+            self._seen[key] = now + self.ttl
+            return False
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+
+class SQLiteDedupStore:
+    def __init__(self, path: str, ttl: float = 600.0, purge_every: int = 500):
+        self.path = path
+        self.ttl = ttl
+        self.purge_every = purge_every
+        self._local = threading.local()
+        self._count = 0
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS webhook_events (event_id TEXT PRIMARY KEY, expires_at REAL NOT NULL)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def seen_before(self, key: str) -> bool:
+        now = time.time()
+        conn = self._conn()
+
+        self._count += 1
+        if self._count % self.purge_every == 0:
+            conn.execute("DELETE FROM webhook_events WHERE expires_at <= ?", (now,))
+
+        # 過期的舊紀錄先讓位，再 INSERT OR IGNORE：有插進去 = 第一次看到
+        conn.execute("DELETE FROM webhook_events WHERE event_id = ? AND expires_at <= ?", (key, now))
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO webhook_events (event_id, expires_at) VALUES (?, ?)",
+            (key, now + self.ttl),
+        )
+        return cur.rowcount == 0
+
+
+def create_dedup_store():
+    """
+    WEBHOOK_DEDUP=memory（預設）/ sqlite / off
+      - WEBHOOK_DEDUP_TTL（秒，預設 600）、WEBHOOK_DEDUP_SIZE（memory 上限，預設 10000）
+      - WEBHOOK_DEDUP_PATH（sqlite 檔，預設 webhook_dedup.db）
+    """
+    mode = os.getenv("WEBHOOK_DEDUP", "memory").strip().lower()
+    ttl = float(os.getenv("WEBHOOK_DEDUP_TTL", "600"))
+    if mode == "off":
+        return None
+    if mode == "sqlite":
+        return SQLiteDedupStore(os.getenv("WEBHOOK_DEDUP_PATH", "webhook_dedup.db"), ttl=ttl)
+    if mode == "memory":
+        return MemoryDedupStore(ttl=ttl, max_size=int(os.getenv("WEBHOOK_DEDUP_SIZE", "10000")))
+    raise RuntimeError(f"Unknown WEBHOOK_DEDUP: {mode}")
@@ -0,0 +1,365 @@
+import os
+import re
+import threading
+import time
+
+import requests
+from bs4 import BeautifulSoup
+
+import metrics
+
+
+# 臺灣銀行牌價；FX_SOURCE_URL 可以指到本地的 fixture server（測試用同樣格式的 HTML）
+BOT_RATE_URL = "https://rate.bot.com.tw/xrt?Lang=zh-TW"
+
+# 每個幣別存 (現金買入, 現金賣出, 即期買入, 即期賣出)，沒有掛牌的是 None
+RATE_FIELDS = ("本行現金買入", "本行現金賣出", "本行即期買入", "本行即期賣出")
+CASH_BUY, CASH_SELL, SPOT_BUY, SPOT_SELL = range(4)
+
+# 表上沒有、但大家會打的叫法
+FX_ALIASES = {
+    "台幣": "TWD", "臺幣": "TWD", "新台幣": "TWD", "新臺幣": "TWD",
+    "美金": "USD", "美元": "USD", "日幣": "JPY", "日元": "JPY", "日圓": "JPY", "韓元": "KRW", "韓幣": "KRW",
+    "英鎊": "GBP", "港元": "HKD", "澳元": "AUD", "人民幣": "CNY",
+}
+
+
+def _rate(text: str) -> float | None:
+    try:
+        v = float(text.strip())
+    except ValueError:
+        return None
+    return v if v > 0 else None
+
+
+def parse_bot_rates(html: str | bytes) -> tuple[dict[str, tuple], dict[str, str], str]:
+    """
+    臺銀牌價頁 -> ({幣別: (現金買入, 現金賣出, 即期買入, 即期賣出)}, {幣別: 中文名}, 掛牌時間)
+    欄位優先用 data-table 屬性找，沒有就照順序取幣別後面四格
+    給 bytes 由 BeautifulSoup 判斷編碼（header 沒寫 charset 時 requests 會猜成 latin-1）
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    rates: dict[str, tuple] = {}
+    names: dict[str, str] = {}
+    for tr in soup.select("tbody tr"):
+        tds = tr.find_all("td")
+        if not tds:
+            continue
+        label = " ".join(tds[0].get_text(" ", strip=True).split())
+        m = re.search(r"\(([A-Z]{3})\)", label)
+        if not m:
+            continue
+        code = m.group(1)
+
+        by_field: dict[str, str] = {}
+        for td in tds[1:]:
+            key = td.get("data-table")
+            if key in RATE_FIELDS and key not in by_field:
+                by_field[key] = td.get_text(strip=True)
+        if len(by_field) == len(RATE_FIELDS):
+            values = tuple(_rate(by_field[k]) for k in RATE_FIELDS)
+        else:
+            cells = [td.get_text(strip=True) for td in tds[1:1 + len(RATE_FIELDS)]]
+            values = tuple(_rate(c) for c in cells) + (None,) * (len(RATE_FIELDS) - len(cells))
+
+        rates[code] = values
+        # 「美金 (USD)」手機版、桌面版各一份，取第一個名字
+        name = label[:m.start()].split()
+        names[code] = name[0] if name else code
+
+    quoted = soup.select_one("span.time")
+    return rates, names, quoted.get_text(strip=True) if quoted else ""
+
+
+class RateTable:
+    """
+    一次抓下來的牌價（抓完就不再改，換新的整個替換）
+    """
+
+    __slots__ = ("rates", "names", "quoted_at", "fetched_at", "source")
+
+    def __init__(self, rates: dict[str, tuple], names: dict[str, str], quoted_at: str = "", source: str = ""):
+        self.rates = rates
+        self.names = names
+        self.quoted_at = quoted_at
+        self.fetched_at = time.time()
+        self.source = source
+
+    def __len__(self) -> int:
+        return len(self.rates)
+
+    def resolve(self, token: str) -> str | None:
+        """
+        USD / usd / 美金 / 美元 -> USD；TWD 一定有
+        別名對到的幣別這次的牌價表上沒有也回 None（查無幣別）
+        """
+        t = token.strip()
+        code = t.upper()
+        if code == "TWD" or code in self.rates:
+            return code
+        alias = FX_ALIASES.get(t)
+        if alias is not None:
+            return alias if alias == "TWD" or alias in self.rates else None
+        for c, name in self.names.items():
+            if name == t:
+                return c
+        return None
+
+    def _side(self, code: str, spot: int, cash: int) -> float | None:
+        if code == "TWD":
+            return 1.0
+        r = self.rates.get(code)
+        if r is None:
+            return None
+        # 有即期用即期，沒有（例如只收現鈔的幣別）用現金
+        return r[spot] if r[spot] is not None else r[cash]
+
+    def bank_buy(self, code: str) -> float | None:
+        # 你把外幣換成台幣的價格
+        return self._side(code, SPOT_BUY, CASH_BUY)
+
+    def bank_sell(self, code: str) -> float | None:
+        # 你用台幣買外幣的價格
+        return self._side(code, SPOT_SELL, CASH_SELL)
+
+    def convert(self, amount: float, src: str, dst: str) -> float | None:
+        """
+        照銀行實際會給的價格換：src 以銀行買入價換成台幣，再以 dst 的銀行賣出價換出去
+        """
+        buy, sell = self.bank_buy(src), self.bank_sell(dst)
+        if buy is None or sell is None:
+            return None
+        return amount * buy / sell
+
+
+class HtmlRateSource:
+    """
+    預設的來源：GET 一個牌價頁（env FX_SOURCE_URL，預設臺銀），用 parser 解析
+    要換來源就給別的 url / parser，或自己寫一個有 fetch() -> RateTable 的物件
+    """
+
+    def __init__(self, url: str | None = None, parser=parse_bot_rates, timeout: float | None = None):
+        if url is None:
+            url = os.getenv("FX_SOURCE_URL", BOT_RATE_URL)
+        if timeout is None:
+            timeout = float(os.getenv("FX_SOURCE_TIMEOUT", "10"))
+        self.url = url
+        self.parser = parser
+        self.timeout = timeout
+
+    def fetch(self) -> RateTable:
+        resp = requests.get(self.url, timeout=self.timeout, headers={"User-Agent": "Mozilla/5.0 line-bot"})
+        resp.raise_for_status()
+        rates, names, quoted_at = self.parser(resp.content)
+        if not rates:
+            raise ValueError("no rates found in page")
+        return RateTable(rates, names, quoted_at, self.url)
+
+
+class FxService:
+    """
+    匯率快取，查詢不會等爬蟲：
+      - 第一次 get() 才開背景 thread，之後每 ttl 秒（env FX_TTL，預設 600）抓一次，成功才換掉舊表
+      - get()：直接回目前這份；過了 ttl 就叫背景 thread 提早重抓，這次先回舊的（stale-while-revalidate）
+      - 超過 max_stale 秒（env FX_MAX_STALE，預設 86400）的資料不回，當作沒有
+      - 抓失敗留著舊表，retry_interval 秒（env FX_RETRY_INTERVAL，預設 60）後再試，不會每次查詢都去打
+      - 還沒抓到任何資料時 get() 回 None，不等
+      - fork-safe：pid 變了就在新 process 重開背景 thread
+    """
+
+    def __init__(
+        self,
+        source=None,
+        ttl: float | None = None,
+        max_stale: float | None = None,
+        retry_interval: float | None = None,
+    ):
+        if ttl is None:
+            ttl = float(os.getenv("FX_TTL", "600"))
+        if max_stale is None:
+            max_stale = float(os.getenv("FX_MAX_STALE", "86400"))
+        if retry_interval is None:
+            retry_interval = float(os.getenv("FX_RETRY_INTERVAL", "60"))
+
+        self.source = source if source is not None else HtmlRateSource()
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.retry_interval = retry_interval
+        self._table: RateTable | None = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid: int | None = None
+        self._failed_at: float | None = None
+        self.error: str | None = None
+
+    def start(self) -> None:
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._wake = threading.Event()
+            threading.Thread(target=self._run, name="fx-refresh", daemon=True).start()
+
+    def _run(self) -> None:
+        pid = os.getpid()
+        delay = 0.0
+        while self._pid == pid:
+            self._wake.wait(delay)
+            self._wake.clear()
+
+            now = time.time()
+            if self._failed_at is not None and now - self._failed_at < self.retry_interval:
+                delay = self.retry_interval - (now - self._failed_at)
+                continue
+            table = self._table
+            if table is not None and now - table.fetched_at < self.ttl:
+                delay = self.ttl - (now - table.fetched_at)
+                continue
+            delay = self.ttl if self.refresh() else self.retry_interval
+
+    def refresh(self) -> bool:
+        """
+        同步抓一次（背景 thread 在用；也可以手動呼叫），回傳成功與否
+        """
+        t0 = time.perf_counter()
+        try:
+            table = self.source.fetch()
+        except Exception as e:
+            print(f"[fx] refresh error: {e}")
+            metrics.FX_REFRESH.inc(result="error")
+            self._failed_at = time.time()
+            self.error = str(e)
+            return False
+        metrics.FX_REFRESH_SECONDS.observe(time.perf_counter() - t0)
+        metrics.FX_REFRESH.inc(result="ok")
+        self._table = table
+        self._failed_at = None
+        self.error = None
+        return True
+
+    def set(self, table: RateTable | None) -> None:
+        """
+        直接指定牌價（測試用）
+        """
+        self._table = table
+
+    def get(self) -> RateTable | None:
+        self.start()
+        table = self._table
+        if table is None:
+            metrics.cache_hit("fx", False)
+            self._wake.set()
+            return None
+        age = time.time() - table.fetched_at
+        fresh = age < self.ttl
+        metrics.cache_hit("fx", fresh)
+        if not fresh:
+            self._wake.set()
+        return table if age < self.max_stale else None
+
+    def status(self) -> dict:
+        table = self._table
+        return {
+            "currencies": len(table) if table else 0,
+            "age_seconds": round(time.time() - table.fetched_at, 1) if table else None,
+            "quoted_at": table.quoted_at if table else None,
+            "error": self.error,
+        }
+
+
+# =========================
+# 指令
+# =========================
+_AMOUNT = re.compile(r"^\d[\d,]*(?:\.\d+)?$")
+
+
+def parse_fx_command(text: str) -> dict:
+    """
+    匯率                -> {"type": "overview"}
+    匯率 USD / 匯率 美金  -> {"type": "rate", "currencies": ["USD"]}
+    匯率 USD 100        -> {"type": "convert", "currencies": ["USD"], "amount": 100.0}（換成台幣）
+    匯率 USD JPY 100 / 匯率 USD/JPY -> 兩個幣別：第一個換成第二個（沒給金額 = 1）
+    幣別先不檢查（中文名要看牌價表），交給 fx_reply
+    """
+    t = (text or "").strip()
+    m = re.match(r"^匯率\s*(.*)$", t, re.S)
+    if not m or not m.group(1).strip():
+        return {"type": "overview"}
+
+    currencies, amount = [], None
+    for tok in re.split(r"[\s/]+", m.group(1).strip()):
+        if not tok:
+            continue
+        if _AMOUNT.match(tok) and amount is None:
+            amount = float(tok.replace(",", ""))
+        else:
+            currencies.append(tok)
+
+    if not currencies or len(currencies) > 2:
+        return {"type": "error", "reason": "格式：匯率 USD / 匯率 USD 100 / 匯率 USD JPY 100"}
+    if len(currencies) == 1 and amount is None:
+        return {"type": "rate", "currencies": currencies}
+    return {"type": "convert", "currencies": currencies, "amount": amount if amount is not None else 1.0}
+
+
+def _fmt(v: float | None) -> str:
+    return "-" if v is None else f"{v:g}"
+
+
+def _money(v: float) -> str:
+    return f"{v:,.2f}".rstrip("0").rstrip(".")
+
+
+def fx_reply(table: RateTable, cmd: dict, stale: bool = False) -> str:
+    """
+    指令 + 牌價 -> 回覆文字
+    """
+    head = f"臺灣銀行牌價（{table.quoted_at}）" if table.quoted_at else "匯率"
+    if stale:
+        head += "（更新中，先顯示上一份）"
+
+    if cmd["type"] == "error":
+        return cmd["reason"]
+
+    if cmd["type"] == "overview":
+        codes = [c.strip() for c in os.getenv("FX_OVERVIEW", "USD,JPY,EUR,CNY,HKD,GBP,AUD,KRW").split(",")]
+        lines = [head, "幣別 即期買入 / 即期賣出"]
+        for c in codes:
+            if c in table.rates:
+                r = table.rates[c]
+                lines.append(f"{c} {table.names.get(c, '')} {_fmt(r[SPOT_BUY])} / {_fmt(r[SPOT_SELL])}")
+        lines.append("例：匯率 USD 100 / 匯率 USD JPY 100")
+        return "\n".join(lines)
+
+    codes = []
+    for tok in cmd["currencies"]:
+        code = table.resolve(tok)
+        if code is None:
+            return f"查無幣別：{tok}"
+        codes.append(code)
+
+    if cmd["type"] == "rate":
+        code = codes[0]
+        if code == "TWD":
+            return "TWD 是本幣；例：匯率 TWD USD 1000"
+        r = table.rates[code]
+        return "\n".join([
+            head,
+            f"{table.names.get(code, code)} {code}",
+            f"現金 買入 {_fmt(r[CASH_BUY])} / 賣出 {_fmt(r[CASH_SELL])}",
+            f"即期 買入 {_fmt(r[SPOT_BUY])} / 賣出 {_fmt(r[SPOT_SELL])}",
+        ])
+
+    src = codes[0]
+    dst = codes[1] if len(codes) > 1 else "TWD"
+    amount = cmd["amount"]
+    got = table.convert(amount, src, dst)
+    if got is None:
+        return f"{src} → {dst} 目前沒有掛牌價"
+    used = [f"{src} 銀行買入 {_fmt(table.bank_buy(src))}"] if src != "TWD" else []
+    if dst != "TWD":
+        used.append(f"{dst} 銀行賣出 {_fmt(table.bank_sell(dst))}")
+    lines = [head, f"{_money(amount)} {src} ≈ {_money(got)} {dst}"]
+    if used:
+        lines.append(f"（{'、'.join(used)}）")
+    return "\n".join(lines)
@@ -1,8 +1,24 @@
 import os
+import threading
+import time
 from datetime import datetime
+from itertools import chain
+from typing import Iterator
 import gspread
 from google.oauth2.service_account import Credentials
 
+import metrics
+from ledger_store import LedgerStore
+from partitions import months_in_range, partition_key, partition_runs, partition_title
+from records_index import (
+    ENTRY_ID_COLUMN, INDEX_COLUMNS, RecordsIndex, RECORD_COLUMNS, new_entry_id, row_to_record, ts_to_epoch,
+)
+from rollups import UNCATEGORIZED, build_summary
+from sheets_client import wrap_spreadsheet, wrap_worksheet
+from sheets_util import col_letter, updated_rows
+from wallet_events import WALLET_EVENT_COLUMNS, EventWallet
+from write_behind import RecordWriteBehind, ensure_entry_id_header, entry_id_of, read_entry_ids
+
 
 GS_SCOPES = [
     "https://www.googleapis.com/auth/spreadsheets",
@@ -30,16 +46,78 @@ def ensure_service_account_file(path: str = "service_account.json") -> str:
     return path
 
 
-class LedgerRepo:
+def _column_ranges(header: list[str], columns: list[str], start: int) -> tuple[list[str], list[int], list[str]]:
+    """
+    只抓 columns 這幾欄：依 header 位置併成連續的範圍
+    e.g. ts,amount,category,item,group_id 在 A-D、H -> (["A12:D", "H12:H"], [4, 1], 依序的欄名)
+    """
+    cols = sorted(header.index(c) + 1 for c in columns if c in header)
+    spans: list[list[int]] = []
+    for c in cols:
+        if spans and spans[-1][1] == c - 1:
+            spans[-1][1] = c
+        else:
+            spans.append([c, c])
+    ranges = [f"{col_letter(a)}{start}:{col_letter(b)}" for a, b in spans]
+    widths = [b - a + 1 for a, b in spans]
+    names = [header[c - 1] for c in cols]
+    return ranges, widths, names
+
+
+class RecordsPartition:
+    """
+    一張 records worksheet 跟它的 RecordsIndex（分區模式下一個月一張）
+    """
+
+    def __init__(self, title: str, ws):
+        self.title = title
+        self.ws = ws
+        self.index = RecordsIndex()
+        self.synced_at: float | None = None
+        self.entry_header_ok = False  # header 已確認有 entry_id 欄
+        self.sync_lock = threading.Lock()  # 同一個分區同時只有一個增量同步在讀 sheet
+
+
+class LedgerRepo(LedgerStore):
     """
     Google Sheets:
-      - records: ts,amount,category,item,currency,user_id,raw_text,group_id
+      - records: ts,amount,category,item,currency,user_id,raw_text,group_id,entry_id
+        （entry_id 是 bot 寫入時產生的唯一 id；舊的分頁第一次寫入時自動補上這欄 header）
       - groups : group_id,enabled,created_at,created_by,note
       - wallet : group_id,balance,updated_at,updated_by
 
     注意：
       - records/groups/wallet 的 header(第一列) 必須「唯一且不要有空白」
       - wallet 若 header 重複，get_all_records() 會直接爆
+
+    快取：
+      - groups 表整張快取在記憶體（group_id -> enabled/row），enable_group 直接寫回快取
+      - groups_ttl 秒後自動重讀（預設讀 env LEDGER_GROUPS_TTL，0 表示不過期，只靠 refresh_groups()）
+      - records 建 RecordsIndex（依群組、依 ts 排序的欄式存放），只增量抓新增的列、只抓查詢用得到的欄；
+        records_sync_interval 秒內不再回 sheet 同步（env LEDGER_RECORDS_SYNC_INTERVAL）
+      - wallet 一次 get_all_values() 快取 row/balance，wallet_ttl 秒後重讀（env LEDGER_WALLET_TTL）
+        存入/扣款直接用快取餘額，B:D 一次 batch_update；TTL 內假設只有 bot 在改 wallet
+        同一群組的寫入要依序（KeyedProxy），不同群組可同時寫
+      - 彙整走 index 內的每日 / 每月 rollup，rebuild_rollups() 整張重讀重建
+      - add_expense（記帳+扣款）快取熱的時候三個 Sheets call：records append_row + wallet 讀 B 格 + batch_update
+      - 所有 Sheets call 經過 sheets_client：讀 / 寫配額節流、429 / 5xx 退避重試、同樣的讀取同時只送一次
+
+    月份分區（partition_by_month=True 或 env LEDGER_PARTITION=month）：
+      - records 改成一個月一張：records_2026-02、records_2026-03 ...，add_record 寫到該月時才建立
+      - 查詢 / 彙整依 resolve_ledger_range 的區間只載入碰到的月份，查今天只讀這個月
+      - 舊的整張 records 用 archive_records.py 拆成分區
+
+    事件式儲存金（wallet_events=True 或 env LEDGER_WALLET_MODE=events）：
+      - 存入 / 扣款改成 append 到 wallet_events 分頁（沒有就建立），不再讀-改-寫 wallet 的格子
+      - 餘額 = 最新 snapshot + 之後的異動，由 wallet_events.EventWallet 在記憶體維護
+      - 第一次啟用前先跑一次 seed_wallet_events.py，把 wallet 分頁現有的餘額搬成 set 事件；
+        沒搬就啟動（wallet_events 空的、wallet 有餘額）直接丟錯，不讓每個 worker 各搬一次
+      - 之後 wallet 分頁只在 snapshot 時更新（顯示用）
+      - balance_at(group_id, ts) 可以重算任一時間點的餘額
+
+    write-behind（write_behind=True 或 env LEDGER_WRITE_BEHIND=1）：
+      - add_record 只寫本地 journal（LEDGER_JOURNAL_DIR），背景批次 append_rows
+      - query_records / summary_by_category 會一起算還沒寫進 sheet 的筆
     """
 
     def __init__(
@@ -48,6 +126,12 @@ class LedgerRepo:
         records_sheet: str = "records",
         groups_sheet: str = "groups",
         wallet_sheet: str = "wallet",
+        groups_ttl: float | None = None,
+        records_sync_interval: float | None = None,
+        wallet_ttl: float | None = None,
+        write_behind: bool | None = None,
+        partition_by_month: bool | None = None,
+        wallet_events: bool | None = None,
     ):
         if not spreadsheet_id:
             raise RuntimeError("Missing spreadsheet_id")
@@ -56,9 +140,12 @@ class LedgerRepo:
         creds = Credentials.from_service_account_file(sa_path, scopes=GS_SCOPES)
 
         self.gc = gspread.authorize(creds)
-        self.sh = self.gc.open_by_key(spreadsheet_id)
+        self.sh = wrap_spreadsheet(self.gc.open_by_key(spreadsheet_id))
 
-        self.ws_records = self.sh.worksheet(records_sheet)
+        if partition_by_month is None:
+            partition_by_month = os.getenv("LEDGER_PARTITION", "") == "month"
+        # 分區模式下不需要整張的 records
+        self.ws_records = None if partition_by_month else self.sh.worksheet(records_sheet)
         self.ws_groups = self.sh.worksheet(groups_sheet)
 
         # wallet 可能不存在 -> 給出明確錯誤
@@ -67,38 +154,350 @@ class LedgerRepo:
         except Exception as e:
             raise RuntimeError(f"Wallet worksheet '{wallet_sheet}' not found. Please create it.") from e
 
+        if wallet_events is None:
+            wallet_events = os.getenv("LEDGER_WALLET_MODE", "sheet") == "events"
+        ws_wallet_events = None
+        if wallet_events:
+            title = f"{wallet_sheet}_events"
+            try:
+                ws_wallet_events = self.sh.worksheet(title)
+            except gspread.exceptions.WorksheetNotFound:
+                ws_wallet_events = self._add_worksheet(title, WALLET_EVENT_COLUMNS)
+
+        self._init_state(
+            groups_ttl, records_sync_interval, wallet_ttl, write_behind, records_sheet, partition_by_month,
+            ws_wallet_events,
+        )
+
+    @classmethod
+    def from_worksheets(
+        cls,
+        ws_records,
+        ws_groups,
+        ws_wallet,
+        groups_ttl: float | None = None,
+        records_sync_interval: float | None = None,
+        wallet_ttl: float | None = None,
+        write_behind: bool | None = False,
+        spreadsheet=None,
+        partition_by_month: bool = False,
+        ws_wallet_events=None,
+    ) -> "LedgerRepo":
+        """
+        直接用現成的 worksheet（或介面相容的假物件）建立，不連 Google（benchmark / 本地測試用）
+        分區模式要給 spreadsheet（用來找 / 建每個月的分頁），ws_records 可以是 None
+        給 ws_wallet_events（含 header）就是事件式儲存金
+        """
+        repo = cls.__new__(cls)
+        repo.gc = None
+        repo.sh = wrap_spreadsheet(spreadsheet)
+        repo.ws_records = ws_records
+        repo.ws_groups = ws_groups
+        repo.ws_wallet = ws_wallet
+        repo._init_state(
+            groups_ttl, records_sync_interval, wallet_ttl, write_behind,
+            getattr(ws_records, "title", "records"), partition_by_month, ws_wallet_events,
+        )
+        return repo
+
+    def _init_state(
+        self,
+        groups_ttl: float | None,
+        records_sync_interval: float | None,
+        wallet_ttl: float | None,
+        write_behind: bool | None,
+        records_sheet: str = "records",
+        partition_by_month: bool = False,
+        ws_wallet_events=None,
+    ) -> None:
+        # 每個 Sheets API 呼叫都記到 metrics（次數 / 延遲），並經過共用的配額 / 重試 / 合併（sheets_client）
+        if self.ws_records is not None:
+            self.ws_records = wrap_worksheet(self.ws_records, "records")
+        self.ws_groups = wrap_worksheet(self.ws_groups, "groups")
+        self.ws_wallet = wrap_worksheet(self.ws_wallet, "wallet")
+
+        if groups_ttl is None:
+            groups_ttl = float(os.getenv("LEDGER_GROUPS_TTL", "300"))
+        self.groups_ttl = groups_ttl
+        self._groups_lock = threading.Lock()
+        self._groups: dict[str, dict] = {}  # group_id -> {"enabled": bool, "row": int | None}
+        self._groups_loaded_at: float | None = None
+
+        if records_sync_interval is None:
+            records_sync_interval = float(os.getenv("LEDGER_RECORDS_SYNC_INTERVAL", "30"))
+        self.records_sync_interval = records_sync_interval
+        self._records_lock = threading.RLock()
+        self.records_sheet = records_sheet
+        self.partition_by_month = bool(partition_by_month)
+        # 分區 key（YYYY-MM；不分區時是 None）-> RecordsPartition，用到才載入
+        self._partitions: dict[str | None, RecordsPartition] = {}
+        if not self.partition_by_month:
+            self._partitions[None] = RecordsPartition(records_sheet, self.ws_records)
+        self._sheet_titles: set[str] = set()
+        self._titles_loaded_at: float | None = None
+
+        if wallet_ttl is None:
+            wallet_ttl = float(os.getenv("LEDGER_WALLET_TTL", "60"))
+        self.wallet_ttl = wallet_ttl
+        self._wallet_lock = threading.RLock()
+        self._wallet: dict[str, dict] = {}  # group_id -> {"row": int | None, "balance": int}
+        self._wallet_inflight: dict[str, int] = {}  # 正在寫 sheet 的 group_id -> 筆數
+        self._wallet_loaded_at: float | None = None
+        self._event_wallet = None
+        if ws_wallet_events is not None:
+            self._event_wallet = EventWallet(ws_wallet_events, ws_wallet=self.ws_wallet)
+            if self._event_wallet.needs_seed():
+                raise RuntimeError(
+                    "wallet_events is empty but the wallet sheet has balances; "
+                    "run `python seed_wallet_events.py` once (with the bot stopped) first"
+                )
+
+        if write_behind is None:
+            write_behind = os.getenv("LEDGER_WRITE_BEHIND", "0") == "1"
+        self._write_behind: RecordWriteBehind | None = None
+        if write_behind:
+            self._write_behind = RecordWriteBehind(
+                self.ws_records,
+                partition_key=self.partition_of,
+                worksheet_for=lambda key: self._writable(key).ws,
+                journal_dir=os.getenv("LEDGER_JOURNAL_DIR", "ledger_journal"),
+                on_flushed=self._on_records_flushed,
+                batch_size=int(os.getenv("LEDGER_WRITE_BEHIND_BATCH", "20")),
+                flush_interval=float(os.getenv("LEDGER_WRITE_BEHIND_INTERVAL", "2")),
+                flush_guard=self._records_lock,
+            )
+
+    def _add_worksheet(self, title: str, header: list[str], header_wait: float = 10.0):
+        """
+        建立分頁並寫入 header；多個 worker 同時開機時，輸的那個（already exists）改拿別人建好的那張，
+        並等它的 header 寫好（最多 header_wait 秒），才不會把資料寫到第一列
+        """
+        try:
+            ws = self.sh.add_worksheet(title=title, rows=1000, cols=len(header))
+        except gspread.exceptions.APIError as e:
+            if "already exists" not in str(e):
+                raise
+            ws = self.sh.worksheet(title)
+            deadline = time.monotonic() + header_wait
+            while not ws.row_values(1) and time.monotonic() < deadline:
+                time.sleep(0.5)
+            return ws
+        ws.append_row(list(header), value_input_option="USER_ENTERED")
+        print(f"[ledger] created worksheet {title}")
+        return ws
+
     # =========================
     # groups
     # =========================
-    def get_group_enabled(self, group_id: str) -> bool:
-        rows = self.ws_groups.get_all_records()
-        for r in rows:
-            if str(r.get("group_id", "")) == str(group_id):
-                v = r.get("enabled", False)
-                if isinstance(v, bool):
-                    return v
-                return str(v).strip().upper() == "TRUE"
-        return False
+    @staticmethod
+    def _parse_enabled(v) -> bool:
+        if isinstance(v, bool):
+            return v
+        return str(v).strip().upper() == "TRUE"
 
-    def enable_group(self, group_id: str, actor_user_id: str) -> None:
+    def refresh_groups(self) -> None:
+        """
+        重讀整張 groups 表，重建記憶體快取
+        """
         rows = self.ws_groups.get_all_records()
-        now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-
+        groups: dict[str, dict] = {}
         for idx, r in enumerate(rows, start=2):  # header 在第1列
-            if str(r.get("group_id", "")) == str(group_id):
-                # 單格更新用 update_acell 最穩
-                self.ws_groups.update_acell(f"B{idx}", "TRUE")
-                self.ws_groups.update_acell(f"D{idx}", actor_user_id)
-                return
+            gid = str(r.get("group_id", ""))
+            if gid and gid not in groups:
+                groups[gid] = {"enabled": self._parse_enabled(r.get("enabled", False)), "row": idx}
+
+        with self._groups_lock:
+            self._groups = groups
+            self._groups_loaded_at = time.monotonic()
+
+    def _groups_fresh(self) -> bool:
+        if self._groups_loaded_at is None:
+            return False
+        if self.groups_ttl <= 0:
+            return True
+        return time.monotonic() - self._groups_loaded_at < self.groups_ttl
 
-        self.ws_groups.append_row(
+    def get_group_enabled(self, group_id: str) -> bool:
+        fresh = self._groups_fresh()
+        metrics.cache_hit("groups", fresh)
+        if not fresh:
+            self.refresh_groups()
+        g = self._groups.get(str(group_id))
+        return bool(g and g["enabled"])
+
+    def peek_group_enabled(self, group_id: str) -> bool | None:
+        if not self._groups_fresh():
+            return None
+        g = self._groups.get(str(group_id))
+        return bool(g and g["enabled"])
+
+    def enable_group(self, group_id: str, actor_user_id: str) -> None:
+        if not self._groups_fresh():
+            self.refresh_groups()
+
+        now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        gid = str(group_id)
+        g = self._groups.get(gid)
+
+        if g and g["row"] is None:
+            # 本 process 新增但不知道列號 -> 重讀一次
+            self.refresh_groups()
+            g = self._groups.get(gid)
+
+        if g:
+            idx = g["row"]
+            # 單格更新用 update_acell 最穩
+            self.ws_groups.update_acell(f"B{idx}", "TRUE")
+            self.ws_groups.update_acell(f"D{idx}", actor_user_id)
+            with self._groups_lock:
+                self._groups[gid] = {"enabled": True, "row": idx}
+            return
+
+        resp = self.ws_groups.append_row(
             [group_id, "TRUE", now, actor_user_id, ""],
             value_input_option="USER_ENTERED",
         )
+        rows = updated_rows(resp)
+        with self._groups_lock:
+            self._groups[gid] = {"enabled": True, "row": rows[0] if rows else None}
 
     # =========================
     # records
     # =========================
+    def _records_ws(self, key: str | None, create: bool = False):
+        """
+        分區對應的 worksheet；不存在時 create=True 就建立（含 header），否則回 None
+        """
+        title = partition_title(self.records_sheet, key)
+        now = time.monotonic()
+        if title not in self._sheet_titles and (
+            self._titles_loaded_at is None or now - self._titles_loaded_at >= self.records_sync_interval
+        ):
+            # 別的 worker 可能已經建好 -> 重讀分頁清單
+            self._sheet_titles = {ws.title for ws in self.sh.worksheets()}
+            self._titles_loaded_at = now
+
+        if title in self._sheet_titles:
+            return self.sh.worksheet(title)
+        if not create:
+            return None
+
+        ws = self._add_worksheet(title, list(RECORD_COLUMNS) + [ENTRY_ID_COLUMN])
+        self._sheet_titles.add(title)
+        return ws
+
+    def _partition(self, key: str | None, create: bool = False) -> RecordsPartition | None:
+        p = self._partitions.get(key)
+        if p is not None:
+            # 已載入的不用拿鎖（flush 退避時拿著 _records_lock，查詢不要被它卡住）
+            return p
+        with self._records_lock:
+            p = self._partitions.get(key)
+            if p is not None or key is None:
+                return p
+            ws = self._records_ws(key, create=create)
+            if ws is None:
+                return None
+            p = RecordsPartition(
+                partition_title(self.records_sheet, key),
+                wrap_worksheet(ws, "records"),
+            )
+            self._partitions[key] = p
+            return p
+
+    def _writable(self, key: str | None) -> RecordsPartition:
+        """
+        要寫入的分區（不存在就建立），第一次寫之前確認 header 有 entry_id 欄
+        """
+        p = self._partition(key, create=True)
+        if not p.entry_header_ok:
+            ensure_entry_id_header(p.ws)
+            p.entry_header_ok = True
+        return p
+
+    def partition_of(self, row: list) -> str | None:
+        """
+        一列 record 屬於哪個分區（YYYY-MM）；不分區時回 None
+        """
+        return partition_key(row[0]) if self.partition_by_month else None
+
+    def _partitions_for(self, start_iso: str, end_iso: str) -> list[RecordsPartition]:
+        """
+        查詢區間 -> 要讀的分區（由舊到新）；沒分區時就是整張 records
+        """
+        if not self.partition_by_month:
+            return [self._partitions[None]]
+        out = []
+        for key in months_in_range(start_iso, end_iso):
+            p = self._partition(key)
+            if p is not None:
+                out.append(p)
+        return out
+
+    def _sync_partition(self, p: RecordsPartition, force: bool = False) -> int:
+        """
+        讀 sheet（含配額退避）時不拿 _records_lock，只有收進 index 時才拿：
+          - 別人正在同步這個分區 -> 直接用現在的 index
+          - write-behind flush 拿著 _records_lock（append 跟 index 更新要一起，可能在 429 退避）
+            -> 這次讀到的先不收，synced_at 不動，下次查詢再同步
+          - 還沒同步過（或 force）時照樣等，不會回空的結果
+        """
+        if (
+            not force
+            and p.synced_at is not None
+            and time.monotonic() - p.synced_at < self.records_sync_interval
+        ):
+            metrics.cache_hit("records_index", True)
+            return 0
+
+        wait = force or p.synced_at is None
+        if not p.sync_lock.acquire(blocking=wait):
+            metrics.cache_hit("records_index", True)
+            return 0
+        try:
+            if not force and p.synced_at is not None and wait:
+                # 等的時候別人已經做完第一次同步
+                return 0
+
+            metrics.cache_hit("records_index", False)
+            idx = p.index
+            if idx.header is None:
+                idx.header = [str(h).strip() for h in p.ws.row_values(1)] or list(RECORD_COLUMNS)
+
+            # 只抓 index 用得到的欄位（不抓 raw_text / user_id / currency）
+            start = idx.synced_rows + 1
+            ranges, widths, names = _column_ranges(idx.header, INDEX_COLUMNS, start)
+            blocks = p.ws.batch_get(ranges)
+            # 各範圍尾端的空列 / 空格 API 不回傳 -> 補齊後拼回同一列
+            n = max((len(b) for b in blocks), default=0)
+            padded = []
+            for b, w in zip(blocks, widths):
+                col = [r if len(r) == w else list(r[:w]) + [""] * (w - len(r)) for r in b]
+                col.extend([[""] * w] * (n - len(col)))
+                padded.append(col)
+            if len(padded) == 1:
+                values = padded[0]
+            else:
+                values = [list(chain.from_iterable(parts)) for parts in zip(*padded)]
+
+            if not self._records_lock.acquire(blocking=wait):
+                return 0
+            try:
+                added = idx.ingest(start, values, columns=names)
+            finally:
+                self._records_lock.release()
+            p.synced_at = time.monotonic()
+            return added
+        finally:
+            p.sync_lock.release()
+
+    def sync_records(self, force: bool = False) -> int:
+        """
+        增量同步已載入的分區：只抓 index 已知最後一列之後的列，回傳新加入筆數
+        第一次呼叫等於整張讀一次（暖機）
+        """
+        return sum(self._sync_partition(p, force) for p in list(self._partitions.values()))
+
     def add_record(
         self,
         group_id: str,
@@ -113,10 +512,125 @@ class LedgerRepo:
         if ts is None:
             ts = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
 
-        self.ws_records.append_row(
-            [ts, int(amount), category, item, currency, user_id, raw_text, group_id],
-            value_input_option="USER_ENTERED",
-        )
+        row = [ts, int(amount), category, item, currency, user_id, raw_text, group_id, new_entry_id()]
+        if self._write_behind:
+            self._write_behind.append(row)
+            return
+
+        self.append_records([row])
+
+    def add_expenses(
+        self,
+        group_id: str,
+        user_id: str,
+        entries: list[dict],
+        currency: str = "TWD",
+        ts: str | None = None,
+    ) -> int:
+        """
+        多筆記帳：records 一次 append_rows（分區模式下每個月一次），儲存金合計扣一次
+        快取熱的時候整批三個 Sheets call（append_rows、讀餘額格、batch_update）
+        """
+        if ts is None:
+            ts = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+        rows = [
+            [ts, int(e["amount"]), e["category"], e["item"], currency, user_id, e.get("raw_text", ""), group_id,
+             new_entry_id()]
+            for e in entries
+        ]
+        if self._write_behind:
+            self._write_behind.extend(rows)
+        elif rows:
+            self.append_records(rows)
+        return self.deduct(group_id, sum(r[1] for r in rows), user_id)
+
+    def append_records(self, rows: list[list]) -> None:
+        """
+        多筆直接寫進 sheet（欄位順序同 RECORD_COLUMNS，後面可以再接 entry_id）；分區模式下每個月一次 append_rows
+        """
+        for key, run in partition_runs(rows, self.partition_of):
+            p = self._writable(key)
+            if len(run) == 1:
+                resp = p.ws.append_row(run[0], value_input_option="USER_ENTERED")
+            else:
+                resp = p.ws.append_rows(run, value_input_option="USER_ENTERED")
+            self._on_records_flushed(run, resp, key)
+
+    def drop_written(self, rows: list[list]) -> list[list]:
+        """
+        拿掉 entry_id 已經在 sheet 上的列（重送之前檢查，每個分區讀一次 entry_id 欄）
+        """
+        out: list[list] = []
+        for key, run in partition_runs(rows, self.partition_of):
+            existing = read_entry_ids(self._writable(key).ws)
+            out.extend(r for r in run if entry_id_of(r) not in existing)
+        return out
+
+    def _on_records_flushed(self, rows: list[list], resp, key: str | None = None) -> None:
+        # 直接餵進 index；拿不到列號就等下次增量同步
+        p = self._partitions.get(key)
+        if p is None:
+            return
+        written = updated_rows(resp)
+        if written:
+            p.index.ingest(written[0], rows)
+        else:
+            p.synced_at = None
+
+    def flush_records(self) -> int:
+        """
+        write-behind 模式下立即把 pending 寫進 sheet，回傳筆數
+        """
+        return self._write_behind.flush() if self._write_behind else 0
+
+    def close(self) -> None:
+        if self._write_behind:
+            self._write_behind.close()
+
+    def rebuild_rollups(self) -> None:
+        """
+        丟掉已載入分區的 index（含 rollup），整張重讀重建
+        """
+        for p in list(self._partitions.values()):
+            # 換成空 index 時 synced_at 一起清掉：這段期間的查詢會等重讀完，不會回空的結果
+            with p.sync_lock:
+                p.index = RecordsIndex()
+                p.synced_at = None
+            self._sync_partition(p, force=True)
+
+    def _pending_records(self, group_id: str, start_iso: str, end_iso: str) -> list[dict]:
+        # 呼叫端要持有 self._write_behind.lock
+        out = []
+        for v in self._write_behind.pending():
+            r = row_to_record(RECORD_COLUMNS, v)
+            if str(r["group_id"]) == str(group_id) and start_iso <= str(r["ts"]) < end_iso:
+                out.append(r)
+        return out
+
+    def _sync_range(self, start_iso: str, end_iso: str) -> list[RecordsPartition]:
+        parts = self._partitions_for(start_iso, end_iso)
+        for p in parts:
+            self._sync_partition(p)
+        return parts
+
+    @staticmethod
+    def _query_index(
+        parts: list[RecordsPartition],
+        group_id: str,
+        start_iso: str,
+        end_iso: str,
+        category: str | None,
+        limit: int | None,
+    ) -> list[dict]:
+        # 分區由新到舊走，湊滿 limit 就停（None = 全部）
+        out: list[dict] = []
+        for p in reversed(parts):
+            left = None if limit is None else limit - len(out)
+            out.extend(p.index.query(group_id, start_iso, end_iso, category=category, limit=left))
+            if limit is not None and len(out) >= limit:
+                break
+        return out
 
     def query_records(
         self,
@@ -124,25 +638,74 @@ class LedgerRepo:
         start_iso: str,
         end_iso: str,
         category: str | None = None,
-        limit: int = 50,
+        limit: int | None = 50,
     ) -> list[dict]:
-        rows = self.ws_records.get_all_records()
-        out = []
-        for r in rows:
-            if str(r.get("group_id", "")) != str(group_id):
-                continue
-
-            ts = str(r.get("ts", ""))
-            if not (start_iso <= ts < end_iso):
-                continue
-
-            if category and str(r.get("category", "")) != category:
-                continue
-
-            out.append(r)
-
-        out.sort(key=lambda x: str(x.get("ts", "")), reverse=True)
-        return out[:limit]
+        """
+        新的在前，最多 limit 筆（None = 全部）；record 只有 ts / amount / category / item / group_id
+        """
+        parts = self._sync_range(start_iso, end_iso)
+        if not self._write_behind:
+            return self._query_index(parts, group_id, start_iso, end_iso, category, limit)
+
+        # pending 跟 index 要在同一把鎖內讀，flush 不會剛好夾在中間
+        with self._write_behind.lock:
+            rows = self._query_index(parts, group_id, start_iso, end_iso, category, limit)
+            extra = [
+                r for r in self._pending_records(group_id, start_iso, end_iso)
+                if not category or str(r.get("category", "")) == category
+            ]
+        if not extra:
+            return rows
+        return sorted(rows + extra, key=lambda x: str(x.get("ts", "")), reverse=True)[:limit]
+
+    def iter_records(self, group_id: str, start_iso: str, end_iso: str, page_rows: int | None = None) -> Iterator[dict]:
+        """
+        匯出用：不經過 index，分區由舊到新、每次讀 page_rows 列（env EXPORT_PAGE_ROWS，預設 1000）
+        全部欄位，篩出該群組、區間內的列邊讀邊 yield，記憶體只放一頁；順序 = 寫入順序
+        ts 跟 index 一樣換成秒數再比（FORMATTED_VALUE 讀回來可能是 2026/2/1 9:05:00）
+        有 write-behind 時先 flush，pending 的列也會在 sheet 上
+        """
+        if page_rows is None:
+            page_rows = int(os.getenv("EXPORT_PAGE_ROWS", "1000"))
+        page_rows = max(1, int(page_rows))
+        if self._write_behind:
+            self.flush_records()
+
+        gid = str(group_id)
+        lo, hi = ts_to_epoch(start_iso), ts_to_epoch(end_iso)
+        for p in self._partitions_for(start_iso, end_iso):
+            header = p.index.header or [str(h).strip() for h in p.ws.row_values(1)] or list(RECORD_COLUMNS)
+            last_col = col_letter(len(header))
+            row = 2
+            while True:
+                values = p.ws.get(f"A{row}:{last_col}{row + page_rows - 1}")
+                for v in values:
+                    r = row_to_record(header, v)
+                    if str(r.get("group_id", "")) != gid:
+                        continue
+                    ts = ts_to_epoch(r.get("ts", ""))
+                    if ts is not None and lo <= ts < hi:
+                        yield r
+                # get 會去掉尾巴的空列：不滿一頁 = 到底了
+                if len(values) < page_rows:
+                    break
+                row += page_rows
+
+    @staticmethod
+    def _collect(parts: list[RecordsPartition], group_id: str, start_iso: str, end_iso: str) -> dict:
+        """
+        整天的區間用 rollup，不是整天就直接在欄位上累加
+        """
+        by_cat: dict[str, list] = {}
+        for p in parts:
+            got = p.index.rollups.collect(group_id, start_iso, end_iso)
+            if got is None:
+                got = p.index.aggregate(group_id, start_iso, end_iso)
+            for cat, (amt, cnt) in got.items():
+                c = by_cat.setdefault(cat, [0, 0])
+                c[0] += amt
+                c[1] += cnt
+        return by_cat
 
     def summary_by_category(
         self,
@@ -151,118 +714,206 @@ class LedgerRepo:
         end_iso: str,
         category: str | None = None,
     ) -> dict:
-        rows = self.ws_records.get_all_records()
-        total_amount = 0
-        total_count = 0
-        by_cat: dict[str, dict] = {}
+        parts = self._sync_range(start_iso, end_iso)
 
-        for r in rows:
-            if str(r.get("group_id", "")) != str(group_id):
-                continue
+        extra: list[dict] = []
+        if self._write_behind:
+            with self._write_behind.lock:
+                by_cat = self._collect(parts, group_id, start_iso, end_iso)
+                extra = self._pending_records(group_id, start_iso, end_iso)
+        else:
+            by_cat = self._collect(parts, group_id, start_iso, end_iso)
 
-            ts = str(r.get("ts", ""))
-            if not (start_iso <= ts < end_iso):
-                continue
-
-            cat = str(r.get("category", "") or "未分類")
-            if category and cat != category:
-                continue
-
-            amt = int(r.get("amount", 0) or 0)
-
-            total_amount += amt
-            total_count += 1
+        for r in extra:
+            cat = str(r.get("category", "") or UNCATEGORIZED)
+            c = by_cat.setdefault(cat, [0, 0])
+            c[0] += int(r.get("amount", 0) or 0)
+            c[1] += 1
 
-            if cat not in by_cat:
-                by_cat[cat] = {"amount": 0, "count": 0}
-            by_cat[cat]["amount"] += amt
-            by_cat[cat]["count"] += 1
-
-        by_cat = dict(sorted(by_cat.items(), key=lambda kv: kv[1]["amount"], reverse=True))
-
-        return {
-            "total_amount": total_amount,
-            "total_count": total_count,
-            "by_category": by_cat,
-        }
+        return build_summary(by_cat, category)
 
     # =========================
     # wallet (儲存金)
     # =========================
-    def _wallet_find_row(self, group_id: str) -> int | None:
+    @staticmethod
+    def _parse_balance(v) -> int:
+        try:
+            return int(v or 0)
+        except Exception:
+            return 0
+
+    def refresh_wallet(self) -> None:
         """
-        回傳 wallet 表內對應 group_id 的 row index（從 2 開始），找不到回 None
+        重讀整張 wallet，重建 group_id -> row/balance 快取
         用 get_all_values() 避開 header 重複造成 get_all_records() 爆炸
+        讀的期間持有 _wallet_lock；正在寫 sheet 的群組保留快取裡的值（sheet 上可能還是舊的）
         """
-        values = self.ws_wallet.get_all_values()  # 2D list
-        if not values:
-            return None
-
-        # values[0] 是 header
-        for i in range(1, len(values)):
-            row = values[i]
-            if len(row) >= 1 and str(row[0]).strip() == str(group_id):
-                return i + 1  # sheet row index (1-based)
-        return None
+        with self._wallet_lock:
+            values = self.ws_wallet.get_all_values()  # 2D list
+            wallet: dict[str, dict] = {}
+
+            # values[0] 是 header
+            for i in range(1, len(values)):
+                row = values[i]
+                if len(row) >= 1:
+                    gid = str(row[0]).strip()
+                    if gid and gid not in wallet:
+                        bal = self._parse_balance(row[1] if len(row) >= 2 else 0)
+                        wallet[gid] = {"row": i + 1, "balance": bal}  # sheet row index (1-based)
+
+            for gid in self._wallet_inflight:
+                if gid in self._wallet:
+                    wallet[gid] = self._wallet[gid]
+
+            self._wallet = wallet
+            self._wallet_loaded_at = time.monotonic()
+
+    def _wallet_entry(self, group_id: str) -> dict | None:
+        stale = self._wallet_loaded_at is None or (
+            self.wallet_ttl > 0 and time.monotonic() - self._wallet_loaded_at >= self.wallet_ttl
+        )
+        metrics.cache_hit("wallet", not stale)
+        if stale:
+            self.refresh_wallet()
+        w = self._wallet.get(str(group_id))
+        if w and w["row"] is None:
+            # 本 process 新增但不知道列號 -> 重讀一次
+            self.refresh_wallet()
+            w = self._wallet.get(str(group_id))
+        return w
 
     def get_balance(self, group_id: str) -> int:
-        row_idx = self._wallet_find_row(group_id)
-        if row_idx is None:
-            return 0
+        if self._event_wallet is not None:
+            return self._event_wallet.get_balance(group_id)
+        w = self._wallet_entry(group_id)
+        return w["balance"] if w else 0
 
-        v = self.ws_wallet.acell(f"B{row_idx}").value
-        try:
-            return int(v or 0)
-        except Exception:
-            return 0
-
-    def deposit(self, group_id: str, amount: int, actor_user_id: str) -> int:
+    def _wallet_apply(self, group_id: str, delta: int, actor_user_id: str, absolute: bool = False) -> int:
         """
-        存入金額，回傳存入後餘額
+        餘額 += delta（absolute=True 時直接設成 delta），回傳新餘額
+        已有列：快取只拿來找列號，寫之前先讀一次 B 格的現值（別的 worker 或手動改過的值不會被蓋掉），
+        再 B:D 一次 batch_update；沒有列：append 一列
+
+        寫 sheet 時不持有全域鎖，不同群組可以同時寫；
+        同一個群組的讀-改-寫要靠呼叫端依序執行（create_ledger_repo 會包 KeyedProxy 依 group_id 排隊）
         """
         now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-        row_idx = self._wallet_find_row(group_id)
+        gid = str(group_id)
 
-        if row_idx is None:
-            new_balance = int(amount)
-            self.ws_wallet.append_row(
-                [group_id, new_balance, now, actor_user_id],
+        with self._wallet_lock:
+            w = self._wallet_entry(gid)
+            self._wallet_inflight[gid] = self._wallet_inflight.get(gid, 0) + 1
+
+        try:
+            if w is None:
+                new_balance = int(delta)
+                resp = self.ws_wallet.append_row(
+                    [group_id, new_balance, now, actor_user_id],
+                    value_input_option="USER_ENTERED",
+                )
+                rows = updated_rows(resp)
+                with self._wallet_lock:
+                    self._wallet[gid] = {"row": rows[0] if rows else None, "balance": new_balance}
+                return new_balance
+
+            row_idx = w["row"]
+            if absolute:
+                new_balance = int(delta)
+            else:
+                new_balance = self._parse_balance(self.ws_wallet.acell(f"B{row_idx}").value) + int(delta)
+            self.ws_wallet.batch_update(
+                [{"range": f"B{row_idx}:D{row_idx}", "values": [[str(new_balance), now, actor_user_id]]}],
                 value_input_option="USER_ENTERED",
             )
+            with self._wallet_lock:
+                # 寫的期間快取可能被 refresh 換掉 -> 更新現在那一份
+                cur = self._wallet.get(gid)
+                if cur is None:
+                    self._wallet[gid] = {"row": row_idx, "balance": new_balance}
+                else:
+                    cur["balance"] = new_balance
             return new_balance
+        finally:
+            with self._wallet_lock:
+                n = self._wallet_inflight.get(gid, 1) - 1
+                if n > 0:
+                    self._wallet_inflight[gid] = n
+                else:
+                    self._wallet_inflight.pop(gid, None)
 
-        cur = self.get_balance(group_id)
-        new_balance = cur + int(amount)
-
-        # 單格更新用 update_acell（避免 update() 400 "B2"）
-        self.ws_wallet.update_acell(f"B{row_idx}", str(new_balance))
-        self.ws_wallet.update_acell(f"C{row_idx}", now)
-        self.ws_wallet.update_acell(f"D{row_idx}", actor_user_id)
-        return new_balance
+    def deposit(self, group_id: str, amount: int, actor_user_id: str) -> int:
+        """
+        存入金額，回傳存入後餘額
+        """
+        if self._event_wallet is not None:
+            return self._event_wallet.deposit(group_id, amount, actor_user_id)
+        return self._wallet_apply(group_id, int(amount), actor_user_id)
 
     def deduct(self, group_id: str, amount: int, actor_user_id: str) -> int:
         """
         扣款（記帳時用），回傳扣款後餘額
         若 wallet 沒有該 group_id，視為 0 再扣（可能變負數）
         """
-        now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-        row_idx = self._wallet_find_row(group_id)
+        if self._event_wallet is not None:
+            return self._event_wallet.deduct(group_id, amount, actor_user_id)
+        return self._wallet_apply(group_id, -int(amount), actor_user_id)
 
-        if row_idx is None:
-            new_balance = 0 - int(amount)
-            self.ws_wallet.append_row(
-                [group_id, new_balance, now, actor_user_id],
-                value_input_option="USER_ENTERED",
-            )
-            return new_balance
+    def set_balance(self, group_id: str, balance: int, actor_user_id: str) -> int:
+        """
+        直接覆寫餘額（SQLite 鏡像回 Sheets 時用）
+        """
+        if self._event_wallet is not None:
+            return self._event_wallet.set_balance(group_id, balance, actor_user_id)
+        return self._wallet_apply(group_id, int(balance), actor_user_id, absolute=True)
 
-        cur = self.get_balance(group_id)
-        new_balance = cur - int(amount)
+    def balance_at(self, group_id: str, ts: str) -> int:
+        """
+        ts（UTC，"YYYY-MM-DD HH:MM:SS"）之前的餘額，只有事件式儲存金才查得到
+        """
+        if self._event_wallet is None:
+            raise RuntimeError("balance_at requires LEDGER_WALLET_MODE=events")
+        return self._event_wallet.balance_at(group_id, ts)
 
-        self.ws_wallet.update_acell(f"B{row_idx}", str(new_balance))
-        self.ws_wallet.update_acell(f"C{row_idx}", now)
-        self.ws_wallet.update_acell(f"D{row_idx}", actor_user_id)
-        return new_balance
+    def rebuild_wallet(self) -> None:
+        """
+        丟掉餘額快取重讀（事件式：從 wallet_events 重播）
+        """
+        if self._event_wallet is not None:
+            self._event_wallet.rebuild()
+        else:
+            self.refresh_wallet()
+
+    # =========================
+    # 匯出整本帳（SQLite 第一次啟動時匯入用）
+    # =========================
+    def export_state(self) -> dict:
+        """
+        {"groups": [groups 表的每一列], "wallet": {group_id: 餘額}, "records": [record dict, ...]}
+        records 是所有分頁（分區模式下每個 records_YYYY-MM）整張讀，順序 = 寫入順序
+        """
+        if self._write_behind:
+            self.flush_records()
+
+        groups = [r for r in self.ws_groups.get_all_records() if str(r.get("group_id", "")).strip()]
+        gids = {str(r["group_id"]).strip() for r in groups}
+        gids.update(str(v[0]).strip() for v in self.ws_wallet.get_all_values()[1:] if v and str(v[0]).strip())
+        wallet = {gid: self.get_balance(gid) for gid in sorted(gids)}
+
+        if self.partition_by_month:
+            prefix = partition_title(self.records_sheet, "")
+            titles = sorted(ws.title for ws in self.sh.worksheets() if ws.title.startswith(prefix))
+            sheets = [self.sh.worksheet(t) for t in titles]
+        else:
+            sheets = [self._partitions[None].ws]
+
+        records = []
+        for ws in sheets:
+            values = ws.get_all_values()
+            if not values:
+                continue
+            header = [str(h).strip() for h in values[0]]
+            records.extend(row_to_record(header, v) for v in values[1:] if any(str(c).strip() for c in v))
+        return {"groups": groups, "wallet": wallet, "records": records}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,9 @@
+import sys
+
+
+def worker_exit(server, worker):
+    # WEBHOOK_ASYNC 模式：worker 結束前把 queue 內的 event 處理完
+    app_module = sys.modules.get("app")
+    dispatcher = getattr(app_module, "dispatcher", None)
+    if dispatcher:
+        dispatcher.shutdown()
@@ -0,0 +1,166 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class KeyedQueueFull(RuntimeError):
+    pass
+
+
+class _KeyState:
+    __slots__ = ("queue", "running", "last_used")
+
+    def __init__(self):
+        self.queue: deque = deque()
+        self.running = False
+        self.last_used = time.monotonic()
+
+
+class KeyedExecutor:
+    """
+    同一個 key 的工作依序執行、不同 key 在共用的 thread pool 上平行：
+      - 每個 key 一條 queue，同時最多一個 worker 在消化它（不用全域鎖）
+      - 每條 queue 最多 max_pending 個，滿了 submit 丟 KeyedQueueFull
+      - 一個 key 連續跑 fair_batch 個就把 worker 讓出來，熱門群組不會卡住其他群組
+      - 閒置超過 idle_ttl 秒的 key 會被清掉
+      - 在某個 key 的工作裡再對同一個 key 呼叫 run() 會直接執行（避免自己等自己）
+      - fork-safe：pid 變了就重建 pool
+    """
+
+    def __init__(
+        self,
+        workers: int | None = None,
+        max_pending: int | None = None,
+        idle_ttl: float | None = None,
+        fair_batch: int = 16,
+    ):
+        if workers is None:
+            workers = int(os.getenv("LEDGER_SERIAL_WORKERS", "8"))
+        if max_pending is None:
+            max_pending = int(os.getenv("LEDGER_SERIAL_MAX_PENDING", "50"))
+        if idle_ttl is None:
+            idle_ttl = float(os.getenv("LEDGER_SERIAL_IDLE_TTL", "300"))
+
+        self.workers = max(1, int(workers))
+        self.max_pending = max(1, int(max_pending))
+        self.idle_ttl = idle_ttl
+        self.fair_batch = max(1, int(fair_batch))
+
+        self._lock = threading.Lock()
+        self._keys: dict[str, _KeyState] = {}
+        self._swept_at = time.monotonic()
+        self._local = threading.local()
+        self._pool: ThreadPoolExecutor | None = None
+        self._pid: int | None = None
+
+    def _ensure_pool(self) -> ThreadPoolExecutor:
+        # 呼叫端要持有 self._lock
+        if self._pid != os.getpid():
+            # fork 過來的 key 狀態（running=True）已經沒有 thread 在跑了
+            self._keys = {}
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="keyed")
+            self._pid = os.getpid()
+        return self._pool
+
+    def _evict_idle(self, now: float) -> None:
+        # 呼叫端要持有 self._lock
+        if now - self._swept_at < min(self.idle_ttl, 60.0):
+            return
+        self._swept_at = now
+        for key in [k for k, st in self._keys.items()
+                    if not st.running and not st.queue and now - st.last_used >= self.idle_ttl]:
+            del self._keys[key]
+
+    def submit(self, key: str, fn, *args, **kwargs) -> Future:
+        fut: Future = Future()
+        now = time.monotonic()
+        with self._lock:
+            pool = self._ensure_pool()
+            self._evict_idle(now)
+            st = self._keys.get(key)
+            if st is None:
+                st = self._keys[key] = _KeyState()
+            if len(st.queue) >= self.max_pending:
+                raise KeyedQueueFull(f"too many pending tasks for {key}")
+            st.queue.append((fut, fn, args, kwargs))
+            st.last_used = now
+            start = not st.running
+            st.running = True
+        if start:
+            pool.submit(self._drain, key, st)
+        return fut
+
+    def run(self, key: str, fn, *args, **kwargs):
+        """
+        submit 並等結果
+        """
+        if getattr(self._local, "key", None) == key:
+            return fn(*args, **kwargs)
+        return self.submit(key, fn, *args, **kwargs).result()
+
+    def _drain(self, key: str, st: _KeyState) -> None:
+        self._local.key = key
+        try:
+            for _ in range(self.fair_batch):
+                with self._lock:
+                    if not st.queue:
+                        st.running = False
+                        st.last_used = time.monotonic()
+                        return
+                    fut, fn, args, kwargs = st.queue.popleft()
+                if not fut.set_running_or_notify_cancel():
+                    continue
+                try:
+                    fut.set_result(fn(*args, **kwargs))
+                except BaseException as e:
+                    fut.set_exception(e)
+        finally:
+            self._local.key = None
+
+        # 跑滿一批還有剩 -> 排到 pool 最後面，讓其他 key 先跑
+        with self._lock:
+            if not st.queue:
+                st.running = False
+                return
+            pool = self._pool
+        pool.submit(self._drain, key, st)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "keys": len(self._keys),
+                "running": sum(1 for st in self._keys.values() if st.running),
+                "queued": sum(len(st.queue) for st in self._keys.values()),
+                "workers": self.workers,
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            pool, self._pool, self._pid = self._pool, None, None
+        if pool is not None:
+            pool.shutdown(wait=wait)
+
+
+class KeyedProxy:
+    """
+    target 的 methods 依 key_arg（預設 group_id）丟進 KeyedExecutor 依序執行，其他屬性直接轉給 target
+    """
+
+    def __init__(self, target, executor: KeyedExecutor, methods, key_arg: str = "group_id"):
+        self._target = target
+        self._executor = executor
+        self._methods = frozenset(methods)
+        self._key_arg = key_arg
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name not in self._methods or not callable(attr):
+            return attr
+
+        def wrapper(*args, **kwargs):
+            key = kwargs.get(self._key_arg, args[0] if args else None)
+            return self._executor.run(str(key), attr, *args, **kwargs)
+
+        return wrapper
@@ -4,12 +4,58 @@ import pytz
 
 TAIPEI_TZ = pytz.timezone("Asia/Taipei")
 
+# 一則訊息最多記幾行（多的回報在 errors）
+MAX_BULK_LINES = 50
+
+# 多行記帳要第一行寫「記帳」，避免聊天內容剛好有一行像「X 123 Y」就被記下來
+BULK_TRIGGER = "記帳"
+
+_ADD_LINE = re.compile(r"^(\S+)\s+(\d+)\s+(.+)$")
+
+
+def parse_bulk_lines(text: str) -> dict:
+    """
+    多行記帳：第一行「記帳」，之後每行「類別 金額 商品」
+    回傳 {"entries": [{"line", "category", "amount", "item", "raw_text"}], "errors": [{"line", "text", "reason"}]}
+    line 是使用者貼上的原始行號（從 1 開始，空白行、「記帳」那行都算）
+    有任何 errors 時整批都不該記（由呼叫端決定）
+    """
+    entries, errors = [], []
+    triggered = False
+    for n, raw in enumerate((text or "").splitlines(), start=1):
+        ln = raw.strip()
+        if not ln:
+            continue
+        if not triggered and ln == BULK_TRIGGER:
+            triggered = True
+            continue
+        if len(entries) + len(errors) >= MAX_BULK_LINES:
+            errors.append({"line": n, "text": ln, "reason": f"超過 {MAX_BULK_LINES} 行"})
+            continue
+        m = _ADD_LINE.match(ln)
+        if not m:
+            errors.append({"line": n, "text": ln, "reason": "格式應為：類別 金額 商品"})
+            continue
+        entries.append({
+            "line": n,
+            "category": m.group(1).strip(),
+            "amount": int(m.group(2)),
+            "item": m.group(3).strip(),
+            "raw_text": ln,
+        })
+    return {"entries": entries, "errors": errors}
+
+
 def parse_ledger_command(text: str):
     """
     記帳（新版）：
       - 類別 金額 商品(可含空白)
         e.g. 餐飲 120 午餐
              交通 250 uber 回家
+      - 多行：第一行「記帳」，之後一行一筆 -> add_many（有任何一行格式不對就整批不記，列在 errors）
+        e.g. 記帳
+             餐飲 120 午餐
+             交通 30 公車
 
     查詢：
       - 查今天 / 查昨天 / 查本月
@@ -21,18 +67,31 @@ def parse_ledger_command(text: str):
       - 彙整 今天 / 彙整 昨天 / 彙整 本月
       - 彙整 2026-02-01
       - （可選）彙整 本月 餐飲  → 只彙整某類別（回傳總額+筆數）
+      - 重建彙整 → 從 records 重算每日/每月彙總
+
+    匯出：
+      - 匯出 / 匯出 本月 / 匯出 2026-02 / 匯出 2026-02-01 → 回一個 CSV 下載連結
 
     說明：
       - 指令 / help / ?
     """
     t = (text or "").strip()
 
+    # 多行記帳（第一行要是「記帳」）
+    if "\n" in t:
+        if t.splitlines()[0].strip() == BULK_TRIGGER:
+            return {"type": "add_many", **parse_bulk_lines(t)}
+        return {"type": "unknown"}
+
     # 指令說明
     if t in ("指令", "help", "HELP", "?"):
         return {"type": "help"}
         
     if t in ("查餘額", "餘額", "查看餘額"):
         return {"type": "balance"}
+    if t == "重建彙整":
+        return {"type": "rebuild_rollups"}
+
     # 彙整：彙整 今天/昨天/本月 (+ 類別可選)
     m = re.match(r"^彙整\s*(今天|昨天|本月)(?:\s+(\S+))?$", t)
     if m:
@@ -54,13 +113,18 @@ def parse_ledger_command(text: str):
         return {"type": "query", "range": m.group(1), "category": m.group(2)}
 
     # 記帳：類別 金額 商品(可含空白)
-    m = re.match(r"^(\S+)\s+(\d+)\s+(.+)$", t)
+    m = _ADD_LINE.match(t)
     if m:
         category = m.group(1).strip()
         amount = int(m.group(2))
         item = m.group(3).strip()
         return {"type": "add", "item": item, "amount": amount, "category": category}
 
+    # 匯出：匯出 (今天/昨天/本月/YYYY-MM-DD/YYYY-MM)，省略 = 本月
+    m = re.match(r"^匯出(?:\s*(今天|昨天|本月|\d{4}-\d{2}-\d{2}|\d{4}-\d{2}))?$", t)
+    if m:
+        return {"type": "export", "range": m.group(1) or "本月"}
+
     # 存入：存入 金額
     m = re.match(r"^存入\s+(\d+)$", t)
     if m:
@@ -89,6 +153,11 @@ def resolve_ledger_range(range_key: str):
             end = start.replace(month=start.month + 1)
         return start, end
 
+    if re.match(r"^\d{4}-\d{2}$", range_key):
+        start = TAIPEI_TZ.localize(datetime.strptime(range_key, "%Y-%m"))
+        nxt = (start.replace(tzinfo=None) + timedelta(days=32)).replace(day=1)
+        return start, TAIPEI_TZ.localize(nxt)
+
     if re.match(r"^\d{4}-\d{2}-\d{2}$", range_key):
         dt = datetime.fromisoformat(range_key)
         start = TAIPEI_TZ.localize(dt)
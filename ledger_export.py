@@ -0,0 +1,119 @@
+import base64
+import csv
+import hashlib
+import hmac
+import io
+import json
+import os
+import time
+import urllib.parse
+from typing import Iterable, Iterator
+
+import metrics
+
+
+EXPORT_COLUMNS = ["ts", "amount", "category", "item", "currency", "user_id", "raw_text"]
+
+# 文字開頭是這些的格子，Excel / Sheets 打開會當公式跑（CSV injection）
+_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+# =========================
+# 下載連結（簽章 token）
+# =========================
+def _secret() -> bytes:
+    return (os.getenv("EXPORT_LINK_SECRET") or os.getenv("LINE_CHANNEL_SECRET") or "").encode("utf-8")
+
+
+def _b64(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def _unb64(s: str) -> bytes:
+    return base64.urlsafe_b64decode(s + "=" * (-len(s) % 4))
+
+
+def make_export_token(group_id: str, start_iso: str, end_iso: str, ttl: float | None = None) -> str:
+    """
+    group_id + 區間 + 到期時間，HMAC-SHA256 簽章（key = env EXPORT_LINK_SECRET，沒設就用 LINE_CHANNEL_SECRET）
+    有效 ttl 秒（env EXPORT_LINK_TTL，預設 3600）
+    """
+    if ttl is None:
+        ttl = float(os.getenv("EXPORT_LINK_TTL", "3600"))
+    payload = {"g": str(group_id), "s": start_iso, "e": end_iso, "x": int(time.time() + ttl)}
+    body = _b64(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+    sig = _b64(hmac.new(_secret(), body.encode("ascii"), hashlib.sha256).digest())
+    return f"{body}.{sig}"
+
+
+def read_export_token(token: str) -> dict | None:
+    """
+    驗簽章 + 沒過期 -> {"group_id", "start", "end"}；其他情況回 None
+    """
+    secret = _secret()
+    if not secret or not token or token.count(".") != 1:
+        return None
+    body, sig = token.split(".")
+    expected = _b64(hmac.new(secret, body.encode("ascii"), hashlib.sha256).digest())
+    if not hmac.compare_digest(sig, expected):
+        return None
+    try:
+        payload = json.loads(_unb64(body))
+    except ValueError:
+        return None
+    if int(payload.get("x", 0)) < time.time():
+        return None
+    return {"group_id": payload["g"], "start": payload["s"], "end": payload["e"]}
+
+
+def export_url(token: str) -> str | None:
+    """
+    對外的下載網址；base 用 env PUBLIC_BASE_URL（Render 上會自動有 RENDER_EXTERNAL_URL），都沒有回 None
+    """
+    base = os.getenv("PUBLIC_BASE_URL") or os.getenv("RENDER_EXTERNAL_URL")
+    if not base:
+        return None
+    return f"{base.rstrip('/')}/export.csv?{urllib.parse.urlencode({'token': token})}"
+
+
+# =========================
+# CSV 串流
+# =========================
+def _cell(v):
+    """
+    使用者打的文字（item / raw_text …）開頭像公式就加 ' 當純文字；數字照原樣
+    """
+    if isinstance(v, str) and v.startswith(_FORMULA_PREFIXES):
+        return "'" + v
+    return v
+
+
+def csv_chunks(records: Iterable[dict], flush_bytes: int | None = None) -> Iterator[bytes]:
+    """
+    record -> CSV（UTF-8 + BOM，Excel 才認得中文）：
+      - 表頭在讀任何資料之前就先送出，client 馬上拿到第一個 byte
+      - 之後每累積 flush_bytes（env EXPORT_FLUSH_BYTES，預設 64KB）送一段，記憶體只放一段
+      - 像公式的文字格前面加 '（見 _cell）
+    """
+    if flush_bytes is None:
+        flush_bytes = int(os.getenv("EXPORT_FLUSH_BYTES", "65536"))
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_COLUMNS)
+    yield ("\ufeff" + buf.getvalue()).encode("utf-8")
+    buf.seek(0)
+    buf.truncate()
+
+    rows = 0
+    try:
+        for r in records:
+            writer.writerow([_cell(r.get(k, "")) for k in EXPORT_COLUMNS])
+            rows += 1
+            if buf.tell() >= flush_bytes:
+                yield buf.getvalue().encode("utf-8")
+                buf.seek(0)
+                buf.truncate()
+        if buf.tell():
+            yield buf.getvalue().encode("utf-8")
+    finally:
+        metrics.EXPORT_ROWS.inc(rows)
@@ -0,0 +1,289 @@
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Iterator
+
+import metrics
+from keyed_executor import KeyedExecutor, KeyedProxy
+
+
+class LedgerStore(ABC):
+    """
+    記帳儲存介面，app.py 只透過這些方法存取：
+      - groups : get_group_enabled / enable_group / peek_group_enabled
+      - records: add_record / add_expenses / query_records / iter_records / summary_by_category / rebuild_rollups
+      - wallet : get_balance / deposit / deduct
+    實作：
+      - gsheets_repo.LedgerRepo      -> Google Sheets
+      - sqlite_repo.SQLiteLedgerRepo -> 本地 SQLite（可選擇背景鏡像到 Sheets）
+    """
+
+    # =========================
+    # groups
+    # =========================
+    @abstractmethod
+    def get_group_enabled(self, group_id: str) -> bool: ...
+
+    @abstractmethod
+    def enable_group(self, group_id: str, actor_user_id: str) -> None: ...
+
+    def peek_group_enabled(self, group_id: str) -> bool | None:
+        """
+        只看快取、不做遠端 I/O（給 /callback 的 prefilter 用）；不確定就回 None
+        """
+        return None
+
+    # =========================
+    # records
+    # =========================
+    @abstractmethod
+    def add_record(
+        self,
+        group_id: str,
+        user_id: str,
+        raw_text: str,
+        item: str,
+        amount: int,
+        category: str,
+        currency: str = "TWD",
+        ts: str | None = None,
+    ) -> None: ...
+
+    @abstractmethod
+    def query_records(
+        self,
+        group_id: str,
+        start_iso: str,
+        end_iso: str,
+        category: str | None = None,
+        limit: int | None = 50,
+    ) -> list[dict]:
+        """
+        回傳 start_iso <= ts < end_iso 的 record dict（新的在前），最多 limit 筆；limit=None 全部
+        """
+
+    def iter_records(self, group_id: str, start_iso: str, end_iso: str) -> Iterator[dict]:
+        """
+        匯出用：一筆一筆 yield start_iso <= ts < end_iso 的完整 record（舊的在前）
+        預設整段查出來再倒過來；backend 應該改成分頁讀，記憶體不隨筆數長
+        """
+        yield from reversed(self.query_records(group_id, start_iso, end_iso, limit=None))
+
+    @abstractmethod
+    def summary_by_category(
+        self,
+        group_id: str,
+        start_iso: str,
+        end_iso: str,
+        category: str | None = None,
+    ) -> dict:
+        """
+        回傳 {"total_amount", "total_count", "by_category": {cat: {"amount", "count"}}}
+        by_category 依金額由大到小
+        """
+
+    @abstractmethod
+    def rebuild_rollups(self) -> None:
+        """
+        從 records 重算每日 / 每月彙總
+        """
+
+    # =========================
+    # wallet (儲存金)
+    # =========================
+    @abstractmethod
+    def get_balance(self, group_id: str) -> int: ...
+
+    @abstractmethod
+    def deposit(self, group_id: str, amount: int, actor_user_id: str) -> int: ...
+
+    @abstractmethod
+    def deduct(self, group_id: str, amount: int, actor_user_id: str) -> int: ...
+
+    def add_expense(
+        self,
+        group_id: str,
+        user_id: str,
+        raw_text: str,
+        item: str,
+        amount: int,
+        category: str,
+        currency: str = "TWD",
+        ts: str | None = None,
+    ) -> int:
+        """
+        記一筆帳 + 扣儲存金，回傳扣款後餘額
+        """
+        self.add_record(
+            group_id=group_id,
+            user_id=user_id,
+            raw_text=raw_text,
+            item=item,
+            amount=amount,
+            category=category,
+            currency=currency,
+            ts=ts,
+        )
+        return self.deduct(group_id=group_id, amount=amount, actor_user_id=user_id)
+
+    def add_expenses(
+        self,
+        group_id: str,
+        user_id: str,
+        entries: list[dict],
+        currency: str = "TWD",
+        ts: str | None = None,
+    ) -> int:
+        """
+        多筆記帳（entries: {"category", "amount", "item", "raw_text"}）+ 合計扣一次儲存金，回傳扣款後餘額
+        預設一筆一筆 add_record；backend 可以改成一次寫入
+        """
+        for e in entries:
+            self.add_record(
+                group_id=group_id,
+                user_id=user_id,
+                raw_text=e.get("raw_text", ""),
+                item=e["item"],
+                amount=e["amount"],
+                category=e["category"],
+                currency=currency,
+                ts=ts,
+            )
+        total = sum(int(e["amount"]) for e in entries)
+        return self.deduct(group_id=group_id, amount=total, actor_user_id=user_id)
+
+    def close(self) -> None:
+        pass
+
+
+# 會改資料的方法：同一個 group_id 依序執行，不同群組平行（LEDGER_GROUP_SERIAL=0 關掉）
+LEDGER_MUTATIONS = (
+    "enable_group", "add_record", "add_expense", "add_expenses", "deposit", "deduct", "set_balance",
+)
+group_executor = KeyedExecutor()
+
+
+def _wrap(repo: LedgerStore):
+    if os.getenv("LEDGER_GROUP_SERIAL", "1") == "1":
+        repo = KeyedProxy(repo, group_executor, LEDGER_MUTATIONS)
+    return metrics.InstrumentedProxy(repo, metrics.LEDGER_SECONDS)
+
+
+def create_ledger_repo() -> LedgerStore | None:
+    """
+    依 env 選 backend：
+      - LEDGER_BACKEND=sheets（預設）：需要 LEDGER_SPREADSHEET_ID，沒有就回 None（不開記帳）
+      - LEDGER_BACKEND=sqlite：LEDGER_SQLITE_PATH（預設 ledger.db）
+          LEDGER_SQLITE_MIRROR=1 且有 LEDGER_SPREADSHEET_ID -> 寫入背景鏡像到 Sheets
+    回傳的 repo 有包 metrics（每個方法的延遲），寫入依 group_id 排隊（見 LEDGER_MUTATIONS）
+    """
+    backend = os.getenv("LEDGER_BACKEND", "sheets").strip().lower()
+    spreadsheet_id = os.getenv("LEDGER_SPREADSHEET_ID")
+
+    if backend == "sqlite":
+        from sqlite_repo import SQLiteLedgerRepo, SheetsMirror
+
+        mirror = None
+        if os.getenv("LEDGER_SQLITE_MIRROR", "0") == "1" and spreadsheet_id:
+            mirror = SheetsMirror(spreadsheet_id)
+        repo = SQLiteLedgerRepo(os.getenv("LEDGER_SQLITE_PATH", "ledger.db"), mirror=mirror)
+        return _wrap(repo)
+
+    if backend == "sheets":
+        if not spreadsheet_id:
+            return None
+        from gsheets_repo import LedgerRepo
+
+        repo = LedgerRepo(spreadsheet_id=spreadsheet_id)
+        return _wrap(repo)
+
+    raise RuntimeError(f"Unknown LEDGER_BACKEND: {backend}")
+
+
+class LedgerRepoHolder:
+    """
+    repo 在背景 thread 建立，不擋 worker 開機：
+      - start()：開始初始化（已在跑 / 已完成就不動）；fork 後 pid 變了會在新 process 重建
+      - get(timeout)：ready 就回 repo，否則最多等 timeout 秒，還沒好回 None
+      - 失敗後 retry_interval 秒內不重試，之後下一次 get() 再試
+      - status()：給 /health 的 readiness 資訊
+    """
+
+    def __init__(self, factory=create_ledger_repo, retry_interval: float = 30.0):
+        self.factory = factory
+        self.retry_interval = retry_interval
+        self._lock = threading.Lock()
+        self._done = threading.Event()  # 這一輪初始化結束（成功或失敗）
+        self._repo: LedgerStore | None = None
+        self._pid: int | None = None
+        self.state = "pending"  # pending / initializing / ready / failed / disabled
+        self.error: str | None = None
+        self.init_seconds: float | None = None
+        self._failed_at: float | None = None
+
+    def start(self) -> None:
+        with self._lock:
+            if self._pid != os.getpid():
+                # 新 process：不沿用父 process 的連線
+                self._repo = None
+                self.state = "pending"
+                self._pid = os.getpid()
+
+            if self.state in ("initializing", "ready", "disabled"):
+                return
+            if self.state == "failed" and time.monotonic() - self._failed_at < self.retry_interval:
+                return
+
+            self.state = "initializing"
+            self._done.clear()
+            threading.Thread(target=self._init, name="ledger-init", daemon=True).start()
+
+    def _init(self) -> None:
+        t0 = time.monotonic()
+        try:
+            repo = self.factory()
+        except Exception as e:
+            print(f"[ledger] init error: {e}")
+            with self._lock:
+                self.state = "failed"
+                self.error = str(e)
+                self._failed_at = time.monotonic()
+                self._done.set()
+            return
+
+        with self._lock:
+            self._repo = repo
+            self.state = "ready" if repo is not None else "disabled"
+            self.error = None
+            self.init_seconds = round(time.monotonic() - t0, 3)
+            self._done.set()
+
+    def set(self, repo: LedgerStore | None) -> None:
+        """
+        直接指定 repo（benchmark / 測試用）
+        """
+        with self._lock:
+            self._repo = repo
+            self._pid = os.getpid()
+            self.state = "ready" if repo is not None else "disabled"
+            self._done.set()
+
+    def get(self, timeout: float = 0) -> LedgerStore | None:
+        if self.state != "ready" or self._pid != os.getpid():
+            self.start()
+            if timeout > 0:
+                self._done.wait(timeout)
+        return self._repo if self.state == "ready" else None
+
+    def status(self) -> dict:
+        return {
+            "state": self.state,
+            "backend": os.getenv("LEDGER_BACKEND", "sheets"),
+            "init_seconds": self.init_seconds,
+            "error": self.error,
+        }
+
+    def close(self) -> None:
+        if self._repo is not None and self._pid == os.getpid():
+            self._repo.close()
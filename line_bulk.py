@@ -0,0 +1,122 @@
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from linebot.v3.messaging import ApiException, BroadcastRequest, MulticastRequest
+
+import metrics
+from rate_limit import TokenBucket, backoff_delay
+
+
+# LINE multicast 一次最多 500 個 user id
+MULTICAST_LIMIT = 500
+
+
+def _chunks(items: list, size: int) -> list[list]:
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+class BulkSender:
+    """
+    大量推播：
+      - multicast()：收件人去重後切成每塊 MULTICAST_LIMIT 人，workers 條 thread 同時送
+      - 所有呼叫共用一個 TokenBucket（env LINE_BULK_RATE 次/秒，預設 50）
+      - 429 / 5xx 重試：有 Retry-After 照它，沒有就指數退避 + jitter，最多 max_retries 次
+      - 每塊帶 X-Line-Retry-Key，重試時 LINE 回 409 代表上一次其實已送達，算成功
+      - 回傳每一塊的結果，不會因為某一塊失敗就中斷其他塊
+    """
+
+    def __init__(
+        self,
+        line_client,
+        rate: float | None = None,
+        workers: int | None = None,
+        max_retries: int | None = None,
+        backoff: float = 1.0,
+    ):
+        if rate is None:
+            rate = float(os.getenv("LINE_BULK_RATE", "50"))
+        if workers is None:
+            workers = int(os.getenv("LINE_BULK_WORKERS", "4"))
+        if max_retries is None:
+            max_retries = int(os.getenv("LINE_BULK_MAX_RETRIES", "5"))
+
+        self.line_client = line_client
+        self.bucket = TokenBucket(rate)
+        self.workers = max(1, int(workers))
+        self.max_retries = max(0, int(max_retries))
+        self.backoff = backoff
+
+    # =========================
+    # 重試
+    # =========================
+    def _delay(self, e: ApiException, attempt: int) -> float:
+        retry_after = e.headers.get("Retry-After") if e.headers else None
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        return backoff_delay(self.backoff, attempt)
+
+    def _call(self, send) -> dict:
+        """
+        send(retry_key) 實際送出；回傳 {"status", "attempts", "error"}
+        """
+        retry_key = str(uuid.uuid4())
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            attempt += 1
+            try:
+                send(retry_key)
+                return {"status": "ok", "attempts": attempt, "error": None}
+            except ApiException as e:
+                if e.status == 409 and attempt > 1:
+                    # 同一個 retry key 已經被接受過
+                    return {"status": "ok", "attempts": attempt, "error": None}
+                retryable = e.status == 429 or (e.status or 0) >= 500
+                if not retryable or attempt > self.max_retries:
+                    return {"status": "failed", "attempts": attempt, "error": f"{e.status} {e.reason}"}
+                metrics.LINE_BULK_RETRIES.inc(status=str(e.status))
+                time.sleep(self._delay(e, attempt - 1))
+            except Exception as e:
+                return {"status": "failed", "attempts": attempt, "error": str(e)}
+
+    # =========================
+    # 對外
+    # =========================
+    def multicast(self, user_ids: list[str], messages: list, notification_disabled: bool = False) -> dict:
+        recipients = list(dict.fromkeys(u for u in user_ids if u))
+        chunks = _chunks(recipients, MULTICAST_LIMIT)
+
+        def send_chunk(index: int, to: list[str]) -> dict:
+            api = self.line_client.api
+            req = MulticastRequest(to=to, messages=messages, notification_disabled=notification_disabled)
+            out = self._call(lambda key: api.multicast(req, x_line_retry_key=key))
+            metrics.LINE_BULK_CHUNKS.inc(status=out["status"])
+            return {"index": index, "size": len(to), **out}
+
+        started = time.perf_counter()
+        if len(chunks) <= 1:
+            results = [send_chunk(i, c) for i, c in enumerate(chunks)]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(chunks)), thread_name_prefix="line-bulk") as ex:
+                results = list(ex.map(send_chunk, range(len(chunks)), chunks))
+
+        sent = sum(r["size"] for r in results if r["status"] == "ok")
+        return {
+            "recipients": len(recipients),
+            "sent": sent,
+            "failed": len(recipients) - sent,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+            "chunks": results,
+        }
+
+    def broadcast(self, messages: list, notification_disabled: bool = False) -> dict:
+        api = self.line_client.api
+        req = BroadcastRequest(messages=messages, notification_disabled=notification_disabled)
+        out = self._call(lambda key: api.broadcast(req, x_line_retry_key=key))
+        metrics.LINE_BULK_CHUNKS.inc(status=out["status"])
+        return out
@@ -0,0 +1,131 @@
+import asyncio
+import copy
+import os
+import socket
+import threading
+
+from linebot.v3.messaging import ApiClient, AsyncApiClient, AsyncMessagingApi, MessagingApi
+
+import metrics
+
+
+class PooledMessagingClient:
+    """
+    整個 process 共用一個 ApiClient / MessagingApi：
+      - urllib3 連線池 + TLS session 重複使用，不再每個 event 重新握手
+      - pool_maxsize：同一 host 可同時保留的連線數（env LINE_POOL_MAXSIZE）
+      - keepalive：開 TCP keep-alive，閒置連線不容易被中間設備砍掉（env LINE_TCP_KEEPALIVE）
+      - fork-safe：pid 變了（gunicorn fork 出 worker）就重建，不共用父 process 的 socket
+      - api 回傳的物件有包 metrics：每個 API 呼叫的延遲、reply 離 event 發生多久
+    """
+
+    def __init__(self, configuration, pool_maxsize: int | None = None, keepalive: bool | None = None):
+        if pool_maxsize is None:
+            pool_maxsize = int(os.getenv("LINE_POOL_MAXSIZE", "10"))
+        if keepalive is None:
+            keepalive = os.getenv("LINE_TCP_KEEPALIVE", "1") == "1"
+
+        configuration.connection_pool_maxsize = pool_maxsize
+        if keepalive:
+            configuration.socket_options = [
+                (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+                (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+            ]
+
+        self.configuration = configuration
+        self._lock = threading.Lock()
+        self._pid: int | None = None
+        self._api_client: ApiClient | None = None
+        self._api: MessagingApi | None = None
+        self._created = 0
+
+    @property
+    def api(self) -> MessagingApi:
+        # 回傳的是包了 metrics 的 MessagingApi
+        if self._pid == os.getpid() and self._api is not None:
+            return self._api
+
+        with self._lock:
+            if self._pid != os.getpid() or self._api is None:
+                # fork 後的舊 client 不 close（socket 屬於父 process），直接丟掉
+                self._api_client = ApiClient(self.configuration)
+                self._api = metrics.InstrumentedProxy(
+                    MessagingApi(self._api_client),
+                    metrics.LINE_API_SECONDS,
+                    on_call=metrics.observe_reply,
+                )
+                self._pid = os.getpid()
+                self._created += 1
+            return self._api
+
+    def close(self) -> None:
+        with self._lock:
+            if self._api_client is not None and self._pid == os.getpid():
+                self._api_client.close()
+            self._api_client = None
+            self._api = None
+            self._pid = None
+
+    def stats(self) -> dict:
+        """
+        連線池狀態：每個 host 的連線數 / 請求數 / 閒置連線數
+        """
+        out = {
+            "pool_maxsize": self.configuration.connection_pool_maxsize,
+            "clients_created": self._created,
+            "hosts": {},
+        }
+        api_client = self._api_client
+        if api_client is None or self._pid != os.getpid():
+            return out
+
+        pools = api_client.rest_client.pool_manager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            out["hosts"][f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                "connections": pool.num_connections,
+                "requests": pool.num_requests,
+                "idle": pool.pool.qsize() if pool.pool is not None else 0,
+            }
+        return out
+
+
+class AsyncMessagingClient:
+    """
+    asgi.py 用的 AsyncApiClient / AsyncMessagingApi（aiohttp）：
+      - aiohttp session 綁在 event loop 上，第一次在 loop 裡用到才建立，loop 換了就重建
+      - 同一 host 同時最多 pool_maxsize 條連線（env LINE_ASYNC_POOL_MAXSIZE，預設 100）
+      - api 跟 PooledMessagingClient 一樣有包 metrics
+    """
+
+    def __init__(self, configuration, pool_maxsize: int | None = None):
+        if pool_maxsize is None:
+            pool_maxsize = int(os.getenv("LINE_ASYNC_POOL_MAXSIZE", "100"))
+        # 不改到 sync client 共用的 configuration
+        self.configuration = copy.deepcopy(configuration)
+        self.configuration.connection_pool_maxsize = pool_maxsize
+        self._loop = None
+        self._api_client: AsyncApiClient | None = None
+        self._api: AsyncMessagingApi | None = None
+
+    @property
+    def api(self) -> AsyncMessagingApi:
+        loop = asyncio.get_running_loop()
+        if self._api is None or self._loop is not loop:
+            self._api_client = AsyncApiClient(self.configuration)
+            self._api = metrics.AsyncInstrumentedProxy(
+                AsyncMessagingApi(self._api_client),
+                metrics.LINE_API_SECONDS,
+                on_call=metrics.observe_reply,
+            )
+            self._loop = loop
+        return self._api
+
+    async def close(self) -> None:
+        if self._api_client is not None and self._loop is asyncio.get_running_loop():
+            await self._api_client.close()
+        self._api_client = None
+        self._api = None
+        self._loop = None
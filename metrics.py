@@ -0,0 +1,288 @@
+"""
+輕量 Prometheus text 指標（不另外裝 prometheus_client）：
+  - Counter / Histogram 都是 dict + 一把鎖，observe 只做 bisect + 加法，可以常駐開著
+  - register_collector() 登記 render 時才計算的 gauge（queue 深度、連線池...）
+  - render() 輸出 /metrics 用的 text exposition format
+"""
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry: list = []
+_collectors: list = []
+
+# 目前處理中的 event 的 LINE timestamp（毫秒），回覆時用來算離 reply token 期限多遠
+current_event_ts: contextvars.ContextVar[int | None] = contextvars.ContextVar("current_event_ts", default=None)
+
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt_value(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    if float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: dict[tuple, float] = {}
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        return self._values.get(key, 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, v in items:
+            lines.append(f"{self.name}{_fmt_labels(self.labelnames, key)} {_fmt_value(v)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # key -> [每個 bucket 的（非累積）次數..., +Inf 次數, sum]
+        self._values: dict[tuple, list] = {}
+        _registry.append(self)
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            v = self._values.get(key)
+            if v is None:
+                v = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            v[i] += 1
+            v[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def count(self, **labels) -> int:
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        v = self._values.get(key)
+        return sum(v[:-1]) if v else 0
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        for key, v in items:
+            acc = 0
+            for b, n in zip(self.buckets + (float("inf"),), v[:-1]):
+                acc += n
+                le = f'le="{_fmt_value(b)}"'
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, le)} {acc}")
+            labels = _fmt_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_fmt_value(v[-1])}")
+            lines.append(f"{self.name}_count{labels} {acc}")
+        return lines
+
+
+def register_collector(fn) -> None:
+    """
+    fn() -> list[(name, type, help, {labels tuple: value}, labelnames)]
+    render 時才呼叫，給 queue 深度、連線池這種「現在值」用
+    """
+    _collectors.append(fn)
+
+
+def render() -> str:
+    lines: list[str] = []
+    for m in _registry:
+        lines.extend(m.render())
+    for fn in _collectors:
+        try:
+            families = fn()
+        except Exception as e:
+            lines.append(f"# collector error: {_escape(e)}")
+            continue
+        for name, mtype, help, values, labelnames in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {mtype}")
+            for key, v in values.items():
+                lines.append(f"{name}{_fmt_labels(tuple(labelnames), tuple(key))} {_fmt_value(v)}")
+    return "\n".join(lines) + "\n"
+
+
+class InstrumentedProxy:
+    """
+    包住任一物件，呼叫公開方法時記到 histogram（label: method + 固定 labels）
+    on_call(name, seconds) 可再掛額外處理
+    """
+
+    def __init__(self, target, histogram: Histogram, on_call=None, **labels):
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_histogram", histogram)
+        object.__setattr__(self, "_on_call", on_call)
+        object.__setattr__(self, "_labels", labels)
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+
+        hist, on_call, labels = self._histogram, self._on_call, self._labels
+
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return attr(*args, **kwargs)
+            finally:
+                dt = time.perf_counter() - t0
+                hist.observe(dt, method=name, **labels)
+                if on_call:
+                    on_call(name, dt)
+
+        return wrapper
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+
+
+class AsyncInstrumentedProxy(InstrumentedProxy):
+    """
+    跟 InstrumentedProxy 一樣，但包的是 async 方法（await 完才記時間）
+    """
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+
+        hist, on_call, labels = self._histogram, self._on_call, self._labels
+
+        async def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return await attr(*args, **kwargs)
+            finally:
+                dt = time.perf_counter() - t0
+                hist.observe(dt, method=name, **labels)
+                if on_call:
+                    on_call(name, dt)
+
+        return wrapper
+
+
+# =========================
+# 共用指標
+# =========================
+WEBHOOK_STAGE_SECONDS = Histogram(
+    "linebot_webhook_stage_seconds", "Time spent per /callback stage", ("stage",)
+)
+COMMAND_SECONDS = Histogram(
+    "linebot_command_seconds", "Message handling latency by command type", ("type",)
+)
+LEDGER_SECONDS = Histogram(
+    "linebot_ledger_method_seconds", "LedgerStore method latency", ("method",)
+)
+SHEETS_SECONDS = Histogram(
+    "linebot_sheets_call_seconds", "Google Sheets API call latency", ("sheet", "method")
+)
+LINE_API_SECONDS = Histogram(
+    "linebot_line_api_seconds", "LINE Messaging API call latency", ("method",)
+)
+REPLY_DELAY_SECONDS = Histogram(
+    "linebot_reply_delay_seconds",
+    "Time from LINE event timestamp to reply_message completion",
+    buckets=(0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 45.0, 60.0),
+)
+REPLY_DEADLINE_MISSED = Counter(
+    "linebot_reply_deadline_missed_total", "Replies sent after the reply token deadline"
+)
+CACHE_REQUESTS = Counter(
+    "linebot_cache_requests_total", "Cache lookups by cache and result", ("cache", "result")
+)
+LINE_BULK_CHUNKS = Counter(
+    "linebot_line_bulk_chunks_total", "Multicast / broadcast calls by final status", ("status",)
+)
+LINE_BULK_RETRIES = Counter(
+    "linebot_line_bulk_retries_total", "Multicast / broadcast retries by HTTP status", ("status",)
+)
+SHEETS_QUOTA_REQUESTS = Counter(
+    "linebot_sheets_quota_requests_total", "Sheets API requests charged against the read / write quota", ("kind",)
+)
+SHEETS_THROTTLED_SECONDS = Counter(
+    "linebot_sheets_throttled_seconds_total", "Time spent waiting for Sheets quota tokens", ("kind",)
+)
+SHEETS_RETRIES = Counter(
+    "linebot_sheets_retries_total", "Sheets API retries by HTTP status", ("status",)
+)
+SHEETS_COALESCED = Counter(
+    "linebot_sheets_coalesced_total", "Sheets reads served by an identical in-flight request", ("method",)
+)
+WEBHOOK_PREFILTERED = Counter(
+    "linebot_webhook_prefiltered_total", "Webhook events dropped before model parsing", ("reason",)
+)
+WEBHOOK_DUPLICATES = Counter(
+    "linebot_webhook_duplicates_total", "Webhook events skipped as already seen", ("redelivery",)
+)
+EXPORT_ROWS = Counter(
+    "linebot_export_rows_total", "Ledger records streamed out as CSV"
+)
+FX_REFRESH = Counter(
+    "linebot_fx_refresh_total", "Exchange-rate table refreshes by result", ("result",)
+)
+FX_REFRESH_SECONDS = Histogram(
+    "linebot_fx_refresh_seconds", "Time to fetch and parse the exchange-rate table"
+)
+
+# LINE reply token 一分鐘內有效
+REPLY_TOKEN_DEADLINE = 60.0
+
+
+def cache_hit(cache: str, hit: bool) -> None:
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+
+def observe_reply(method: str, seconds: float) -> None:
+    """
+    給 LINE API proxy 的 on_call：reply_message 完成時算離 event 發生多久
+    """
+    if method != "reply_message":
+        return
+    ts = current_event_ts.get()
+    if ts is None:
+        return
+    delay = time.time() - ts / 1000
+    REPLY_DELAY_SECONDS.observe(delay)
+    if delay > REPLY_TOKEN_DEADLINE:
+        REPLY_DEADLINE_MISSED.inc()
@@ -0,0 +1,51 @@
+"""
+records 依月份分區（records_2026-02、records_2026-03 ...）：
+  - partition_key(ts)：一筆 record 落在哪個月
+  - months_in_range(start_iso, end_iso)：[start, end) 會碰到的月份（由舊到新）
+  - partition_runs(rows, key)：依分區切成連續的幾段，每段一次 append_rows
+"""
+from datetime import date
+
+
+def partition_key(ts: str) -> str:
+    """
+    "2026-02-03 12:00:00" -> "2026-02"
+    """
+    return str(ts)[:7]
+
+
+def partition_title(prefix: str, key: str) -> str:
+    return f"{prefix}_{key}"
+
+
+def months_in_range(start_iso: str, end_iso: str) -> list[str]:
+    """
+    end 是該月 1 號 00:00:00 時不含該月
+    e.g. 2026-01-15 ~ 2026-03-01 -> [2026-01, 2026-02]
+    """
+    start = date.fromisoformat(str(start_iso)[:10]).replace(day=1)
+    end_day = date.fromisoformat(str(end_iso)[:10])
+    end_exclusive = end_day.day == 1 and str(end_iso)[10:].strip() in ("", "00:00:00")
+
+    out = []
+    cur = start
+    while cur <= end_day:
+        if end_exclusive and cur == end_day:
+            break
+        out.append(cur.strftime("%Y-%m"))
+        cur = cur.replace(year=cur.year + 1, month=1) if cur.month == 12 else cur.replace(month=cur.month + 1)
+    return out
+
+
+def partition_runs(rows: list[list], key) -> list[tuple[str, list[list]]]:
+    """
+    依 key(row) 切成連續的幾段 [(key, rows), ...]，保留原本順序
+    """
+    runs: list[tuple[str, list[list]]] = []
+    for r in rows:
+        k = key(r)
+        if runs and runs[-1][0] == k:
+            runs[-1][1].append(r)
+        else:
+            runs.append((k, [r]))
+    return runs
@@ -0,0 +1,86 @@
+import os
+import secrets
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+
+
+class QueryCursor:
+    """
+    一次查詢的完整結果（已篩選、新的在前），翻頁直接從這裡切
+    rows 只留回覆用得到的欄位：(ts, category, amount, item)
+    """
+
+    __slots__ = ("cursor_id", "group_id", "start_iso", "end_iso", "category", "rows", "total_amount", "created_at")
+
+    def __init__(self, cursor_id: str, group_id: str, start_iso: str, end_iso: str, category: str | None, records: list[dict]):
+        self.cursor_id = cursor_id
+        self.group_id = str(group_id)
+        self.start_iso = start_iso
+        self.end_iso = end_iso
+        self.category = category
+        self.rows = [
+            (str(r.get("ts", "")), str(r.get("category", "")), int(r.get("amount", 0) or 0), str(r.get("item", "")))
+            for r in records
+        ]
+        self.total_amount = sum(r[2] for r in self.rows)
+        self.created_at = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def page(self, offset: int, size: int) -> list[tuple]:
+        return self.rows[offset:offset + size]
+
+    def postback_data(self, page: int) -> str:
+        """
+        「下一頁」的 postback data：只帶 cursor id 跟頁碼（從 0 算），區間 / 類別留在 server
+        （LINE postback data 上限 300 字元）
+        """
+        return urllib.parse.urlencode({"a": "page", "c": self.cursor_id, "p": page})
+
+
+class CursorCache:
+    """
+    查詢結果的 server-side cursor：
+      - TTL（env QUERY_CURSOR_TTL 秒，預設 600）過了就當不存在
+      - 最多 max_size 個（env QUERY_CURSOR_MAX，預設 200），超過丟最久沒用的（LRU）
+      - cursor 綁 group_id，別的群組拿同一個 id 查不到
+      - 只在本 process 記憶體；過期 / 在別的 worker 建的就拿不到，請使用者重新查詢
+      - 一頁就放得下的結果不用建 cursor（呼叫端判斷）
+    """
+
+    def __init__(self, ttl: float | None = None, max_size: int | None = None):
+        if ttl is None:
+            ttl = float(os.getenv("QUERY_CURSOR_TTL", "600"))
+        if max_size is None:
+            max_size = int(os.getenv("QUERY_CURSOR_MAX", "200"))
+        self.ttl = ttl
+        self.max_size = max(1, int(max_size))
+        self._lock = threading.Lock()
+        self._cursors: OrderedDict[str, QueryCursor] = OrderedDict()
+
+    def create(self, group_id: str, start_iso: str, end_iso: str, category: str | None, records: list[dict]) -> QueryCursor:
+        cursor = QueryCursor(secrets.token_urlsafe(8), group_id, start_iso, end_iso, category, records)
+        with self._lock:
+            self._cursors[cursor.cursor_id] = cursor
+            while len(self._cursors) > self.max_size:
+                self._cursors.popitem(last=False)
+        return cursor
+
+    def get(self, cursor_id: str, group_id: str) -> QueryCursor | None:
+        with self._lock:
+            cursor = self._cursors.get(cursor_id)
+            if cursor is None:
+                return None
+            if time.monotonic() - cursor.created_at >= self.ttl:
+                del self._cursors[cursor_id]
+                return None
+            if cursor.group_id != str(group_id):
+                return None
+            self._cursors.move_to_end(cursor_id)
+            return cursor
+
+    def __len__(self) -> int:
+        return len(self._cursors)
@@ -0,0 +1,37 @@
+import random
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    rate 個/秒補充、最多存 burst 個；acquire() 拿不到就睡到有為止（多 thread 共用），回傳等了幾秒
+    """
+
+    def __init__(self, rate: float, burst: int | None = None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1, int(rate)))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+def backoff_delay(base: float, attempt: int, cap: float = 60.0) -> float:
+    """
+    指數退避 + jitter：base * 2^attempt 再加 0~base 的亂數，最多 cap 秒
+    """
+    return min(cap, base * (2 ** attempt)) + random.uniform(0, base)
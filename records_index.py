@@ -0,0 +1,270 @@
+import bisect
+import re
+import sys
+import threading
+import time
+import uuid
+from array import array
+from datetime import datetime
+
+from rollups import UNCATEGORIZED, RollupTable
+from sheets_util import to_int
+
+
+RECORD_COLUMNS = ["ts", "amount", "category", "item", "currency", "user_id", "raw_text", "group_id"]
+
+# RECORD_COLUMNS 後面一欄：bot 寫入時產生的唯一 id，重送（journal replay / 鏡像重試）時用來去重
+ENTRY_ID_COLUMN = "entry_id"
+
+# 查詢 / 彙整只需要這幾欄；同步時只抓這幾欄的範圍
+INDEX_COLUMNS = ["ts", "amount", "category", "item", "group_id"]
+
+_EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+# Sheets 用 FORMATTED_VALUE 讀回來可能是 2026/2/1 9:05:00
+_LOOSE_TS = re.compile(r"^(\d{4})[-/](\d{1,2})[-/](\d{1,2})(?:[ T](\d{1,2}):(\d{2})(?::(\d{2}))?)?")
+
+
+def new_entry_id() -> str:
+    return uuid.uuid4().hex
+
+
+def ts_to_epoch(ts) -> int | None:
+    """
+    "2026-02-01 09:05:00" -> 秒數（當 UTC 算，只拿來排序 / 比大小）；讀不懂回 None
+    """
+    s = str(ts).strip()
+    try:
+        dt = datetime.fromisoformat(s)
+    except ValueError:
+        m = _LOOSE_TS.match(s)
+        if not m:
+            return None
+        try:
+            dt = datetime(*(int(g or 0) for g in m.groups()))
+        except ValueError:
+            return None
+    return (dt.toordinal() - _EPOCH_ORDINAL) * 86400 + dt.hour * 3600 + dt.minute * 60 + dt.second
+
+
+def epoch_to_ts(epoch: int) -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(epoch))
+
+
+def row_to_record(header: list[str], values: list) -> dict:
+    """
+    sheet 的一列 (list) 轉成跟 get_all_records() 一樣的 dict
+    amount 轉 int，其他保留字串
+    """
+    r = {k: (values[i] if i < len(values) else "") for i, k in enumerate(header) if k}
+    if "amount" in r:
+        r["amount"] = to_int(r["amount"])
+    return r
+
+
+class _GroupColumns:
+    """
+    一個群組的 records，依 ts 排序的欄式存放：
+      ts / amount / category 代碼是 array('q')，item 是 intern 過的字串 list
+    """
+
+    __slots__ = ("ts", "amount", "cat", "item")
+
+    def __init__(self):
+        self.ts = array("q")
+        self.amount = array("q")
+        self.cat = array("q")
+        self.item: list[str] = []
+
+    def insert(self, ts: int, amount: int, cat: int, item: str) -> None:
+        i = bisect.bisect_right(self.ts, ts)
+        if i == len(self.ts):
+            self.ts.append(ts)
+            self.amount.append(amount)
+            self.cat.append(cat)
+            self.item.append(item)
+        else:
+            self.ts.insert(i, ts)
+            self.amount.insert(i, amount)
+            self.cat.insert(i, cat)
+            self.item.insert(i, item)
+
+    def bounds(self, start: int, end: int) -> tuple[int, int]:
+        return bisect.bisect_left(self.ts, start), bisect.bisect_left(self.ts, end)
+
+
+class RecordsIndex:
+    """
+    records 的記憶體索引（只留查詢用得到的欄位）：
+      - 依 group_id 分桶，每桶是 _GroupColumns（ts 轉成 epoch 秒排序）-> 區間查詢用 bisect
+      - category 存成代碼（同一個 index 共用一張表），彙整時直接在 array 上累加
+      - 用 sheet 列號去重：synced_rows 以前的都算看過，之後的另外記在 _ahead
+        （add_record 先寫進來的列，增量同步時不會重複加入）
+      - synced_rows：已從 sheet 讀過的最後一列（含 header），下次只抓之後的列
+      - rollups：加入時順便更新每日 / 每月 per-category 彙總
+      - ts 讀不懂的列不收（查詢區間本來就比對不到）
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._groups: dict[str, _GroupColumns] = {}
+        self._cat_names: list[str] = []
+        self._cat_codes: dict[str, int] = {}
+        self._ahead: set[int] = set()
+        self.header: list[str] | None = None
+        self.synced_rows = 1
+        self.rollups = RollupTable()
+
+    def __len__(self) -> int:
+        return sum(len(g.ts) for g in self._groups.values())
+
+    def _cat_code(self, category: str) -> int:
+        code = self._cat_codes.get(category)
+        if code is None:
+            code = len(self._cat_names)
+            self._cat_names.append(category)
+            self._cat_codes[category] = code
+        return code
+
+    def _advance(self, upto: int) -> None:
+        # 呼叫端要持有 self._lock
+        if upto > self.synced_rows:
+            self.synced_rows = upto
+        while self.synced_rows + 1 in self._ahead:
+            self.synced_rows += 1
+        if self._ahead:
+            self._ahead = {r for r in self._ahead if r > self.synced_rows}
+
+    def add(self, record: dict, sheet_row: int | None = None) -> bool:
+        """
+        加入一筆 record；sheet_row 已看過則略過，回傳是否有加入
+        """
+        return self._add(
+            record.get("ts", ""), record.get("amount", 0), record.get("category", ""),
+            record.get("item", ""), record.get("group_id", ""), sheet_row,
+        )
+
+    def _add(self, ts_raw, amount_raw, cat_raw, item_raw, gid_raw, sheet_row: int | None) -> bool:
+        with self._lock:
+            if sheet_row is not None:
+                if sheet_row <= self.synced_rows or sheet_row in self._ahead:
+                    return False
+                if sheet_row == self.synced_rows + 1:
+                    self._advance(sheet_row)
+                else:
+                    self._ahead.add(sheet_row)
+
+            ts_str = str(ts_raw).strip()
+            ts = ts_to_epoch(ts_str)
+            if ts is None:
+                return False
+            if ts_str[4:5] != "-" or ts_str[7:8] != "-":
+                # rollup 用正規化過的 ts，2026/2/1 這種格式也會落在對的日 / 月
+                ts_str = epoch_to_ts(ts)
+
+            gid = sys.intern(str(gid_raw))
+            cat = sys.intern(str(cat_raw or ""))
+            amount = to_int(amount_raw)
+            g = self._groups.get(gid)
+            if g is None:
+                g = self._groups[gid] = _GroupColumns()
+            g.insert(ts, amount, self._cat_code(cat), sys.intern(str(item_raw)))
+            self.rollups.add(gid, ts_str, cat, amount)
+            return True
+
+    def ingest(self, start_row: int, values: list[list], columns: list[str] | None = None) -> int:
+        """
+        從 sheet 讀回的一段列（第一列的列號為 start_row，欄位依 columns，預設 RECORD_COLUMNS），
+        回傳新加入筆數
+        """
+        columns = columns or RECORD_COLUMNS
+        pos = [columns.index(c) if c in columns else None for c in ("ts", "amount", "category", "item", "group_id")]
+        added = 0
+        with self._lock:
+            for offset, v in enumerate(values):
+                if not any(str(c).strip() for c in v):
+                    continue
+                n = len(v)
+                fields = [v[i] if i is not None and i < n else "" for i in pos]
+                if self._add(*fields, start_row + offset):
+                    added += 1
+            # 跟已同步的範圍接得上才往前推，避免跳過別人中間插入的列
+            if start_row <= self.synced_rows + 1:
+                self._advance(start_row + len(values) - 1)
+        return added
+
+    # =========================
+    # 查詢
+    # =========================
+    def _record(self, gid: str, g: _GroupColumns, i: int) -> dict:
+        return {
+            "ts": epoch_to_ts(g.ts[i]),
+            "amount": g.amount[i],
+            "category": self._cat_names[g.cat[i]],
+            "item": g.item[i],
+            "group_id": gid,
+        }
+
+    def query(
+        self,
+        group_id: str,
+        start_iso: str,
+        end_iso: str,
+        category: str | None = None,
+        limit: int | None = None,
+    ) -> list[dict]:
+        """
+        start_iso <= ts < end_iso 的 record，新的在前，最多 limit 筆；只為回傳的筆建 dict
+        """
+        gid = str(group_id)
+        with self._lock:
+            g = self._groups.get(gid)
+            if g is None:
+                return []
+            lo, hi = g.bounds(ts_to_epoch(start_iso) or 0, ts_to_epoch(end_iso) or 0)
+
+            want = None
+            if category:
+                want = self._cat_codes.get(category)
+                if want is None:
+                    return []
+
+            out = []
+            cats = g.cat
+            for i in range(hi - 1, lo - 1, -1):
+                if want is not None and cats[i] != want:
+                    continue
+                out.append(self._record(gid, g, i))
+                if limit is not None and len(out) >= limit:
+                    break
+            return out
+
+    def range(self, group_id: str, start_iso: str, end_iso: str) -> list[dict]:
+        """
+        回傳 start_iso <= ts < end_iso 的 record（ts 由舊到新）
+        """
+        return self.query(group_id, start_iso, end_iso)[::-1]
+
+    def aggregate(self, group_id: str, start_iso: str, end_iso: str) -> dict[str, list]:
+        """
+        區間內各類別合計 {category: [amount, count]}，直接在欄位 array 上累加
+        """
+        gid = str(group_id)
+        with self._lock:
+            g = self._groups.get(gid)
+            if g is None:
+                return {}
+            lo, hi = g.bounds(ts_to_epoch(start_iso) or 0, ts_to_epoch(end_iso) or 0)
+            n = len(self._cat_names)
+            amounts = [0] * n
+            counts = [0] * n
+            for amt, c in zip(g.amount[lo:hi], g.cat[lo:hi]):
+                amounts[c] += amt
+                counts[c] += 1
+
+            by_cat: dict[str, list] = {}
+            for code, cnt in enumerate(counts):
+                if cnt:
+                    cell = by_cat.setdefault(self._cat_names[code] or UNCATEGORIZED, [0, 0])
+                    cell[0] += amounts[code]
+                    cell[1] += cnt
+            return by_cat
@@ -0,0 +1,111 @@
+import threading
+from datetime import date, timedelta
+
+
+UNCATEGORIZED = "未分類"
+
+
+def _next_month(d: date) -> date:
+    if d.month == 12:
+        return d.replace(year=d.year + 1, month=1, day=1)
+    return d.replace(month=d.month + 1, day=1)
+
+
+def split_range(start_iso: str, end_iso: str) -> tuple[list[str], list[str]] | None:
+    """
+    把 [start_iso, end_iso) 拆成最少的 (日, 月) cell：
+      - 整個月的部分用月 cell（YYYY-MM），其餘用日 cell（YYYY-MM-DD）
+      - 起訖不是 00:00:00 整點（不是整天）就回 None，呼叫端改走原始資料
+    e.g. 2026-01-30 ~ 2026-03-02 -> days [2026-01-30, 2026-01-31, 2026-03-01], months [2026-02]
+    """
+    if start_iso[10:].strip() not in ("", "00:00:00") or end_iso[10:].strip() not in ("", "00:00:00"):
+        return None
+    try:
+        cur = date.fromisoformat(start_iso[:10])
+        end = date.fromisoformat(end_iso[:10])
+    except ValueError:
+        return None
+
+    days: list[str] = []
+    months: list[str] = []
+    while cur < end:
+        nm = _next_month(cur)
+        if cur.day == 1 and nm <= end:
+            months.append(cur.strftime("%Y-%m"))
+            cur = nm
+        else:
+            days.append(cur.isoformat())
+            cur += timedelta(days=1)
+    return days, months
+
+
+def build_summary(by_cat: dict[str, list], category: str | None = None) -> dict:
+    """
+    {cat: [amount, count]} -> summary_by_category 的回傳格式
+    """
+    out = {}
+    total_amount = 0
+    total_count = 0
+    for cat, (amt, cnt) in by_cat.items():
+        if category and cat != category:
+            continue
+        if cnt == 0:
+            continue
+        out[cat] = {"amount": amt, "count": cnt}
+        total_amount += amt
+        total_count += cnt
+
+    return {
+        "total_amount": total_amount,
+        "total_count": total_count,
+        "by_category": dict(sorted(out.items(), key=lambda kv: kv[1]["amount"], reverse=True)),
+    }
+
+
+class RollupTable:
+    """
+    記憶體裡的每日 / 每月 per-category 彙總：
+      - days  : (group_id, YYYY-MM-DD) -> {category: [amount, count]}
+      - months: (group_id, YYYY-MM)    -> {category: [amount, count]}
+    add() 增量更新；collect() 用 split_range 拼幾個 cell 出來
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.days: dict[tuple[str, str], dict[str, list]] = {}
+        self.months: dict[tuple[str, str], dict[str, list]] = {}
+
+    def clear(self) -> None:
+        with self._lock:
+            self.days.clear()
+            self.months.clear()
+
+    def add(self, group_id: str, ts: str, category: str, amount: int) -> None:
+        gid = str(group_id)
+        cat = str(category or "") or UNCATEGORIZED
+        ts = str(ts)
+        with self._lock:
+            for table, key in ((self.days, ts[:10]), (self.months, ts[:7])):
+                cell = table.setdefault((gid, key), {}).setdefault(cat, [0, 0])
+                cell[0] += int(amount)
+                cell[1] += 1
+
+    def collect(self, group_id: str, start_iso: str, end_iso: str) -> dict[str, list] | None:
+        """
+        合併區間內的 cell -> {category: [amount, count]}；區間不是整天時回 None
+        """
+        parts = split_range(start_iso, end_iso)
+        if parts is None:
+            return None
+        days, months = parts
+
+        gid = str(group_id)
+        merged: dict[str, list] = {}
+        with self._lock:
+            for table, keys in ((self.days, days), (self.months, months)):
+                for k in keys:
+                    for cat, (amt, cnt) in table.get((gid, k), {}).items():
+                        m = merged.setdefault(cat, [0, 0])
+                        m[0] += amt
+                        m[1] += cnt
+        return merged
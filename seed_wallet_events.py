@@ -0,0 +1,56 @@
+"""
+LEDGER_WALLET_MODE=events 第一次啟用前跑一次：把 wallet 分頁每個群組的餘額寫成 wallet_events 的 set 事件
+
+  - wallet_events 分頁不存在就建立（含 header）
+  - wallet_events 已經有資料就不動（重跑不會重複）
+  - 跑的時候 bot 要停著：「是不是空的」跟 append 之間沒有跨 process 的鎖
+
+用法：
+  LEDGER_SPREADSHEET_ID=... python seed_wallet_events.py
+"""
+import argparse
+import os
+import sys
+
+from gspread.exceptions import WorksheetNotFound
+
+from wallet_events import WALLET_EVENT_COLUMNS, EventWallet
+
+
+def seed(sh, wallet: str = "wallet", events: str = "wallet_events") -> int:
+    """
+    回傳寫入的 set 筆數
+    """
+    try:
+        ws_events = sh.worksheet(events)
+    except WorksheetNotFound:
+        ws_events = sh.add_worksheet(title=events, rows=1000, cols=len(WALLET_EVENT_COLUMNS))
+        ws_events.append_row(WALLET_EVENT_COLUMNS, value_input_option="USER_ENTERED")
+    return EventWallet(ws_events, ws_wallet=sh.worksheet(wallet)).seed_from_wallet()
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="seed wallet_events from the wallet worksheet")
+    ap.add_argument("--wallet", default="wallet")
+    ap.add_argument("--events", default="wallet_events")
+    args = ap.parse_args(argv)
+
+    spreadsheet_id = os.getenv("LEDGER_SPREADSHEET_ID")
+    if not spreadsheet_id:
+        print("Missing env: LEDGER_SPREADSHEET_ID")
+        return 2
+
+    import gspread
+    from google.oauth2.service_account import Credentials
+    from gsheets_repo import GS_SCOPES, ensure_service_account_file
+
+    creds = Credentials.from_service_account_file(ensure_service_account_file(), scopes=GS_SCOPES)
+    sh = gspread.authorize(creds).open_by_key(spreadsheet_id)
+
+    n = seed(sh, wallet=args.wallet, events=args.events)
+    print(f"[wallet] done: {n} balance(s) seeded" if n else "[wallet] nothing to seed (wallet_events not empty)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
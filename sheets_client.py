@@ -0,0 +1,204 @@
+import os
+import threading
+import time
+
+from gspread.exceptions import APIError
+
+import metrics
+from rate_limit import TokenBucket, backoff_delay
+
+
+# 只讀的 gspread 方法：吃 read quota，而且同樣參數同時呼叫會合併成一次
+READ_METHODS = frozenset({
+    "get", "batch_get", "get_all_values", "get_all_records", "get_values",
+    "row_values", "col_values", "acell", "cell", "worksheets", "worksheet",
+})
+
+
+def _status(e: APIError) -> int:
+    code = getattr(e, "code", None)
+    if code is None:
+        code = getattr(getattr(e, "response", None), "status_code", 0)
+    try:
+        return int(code)
+    except (TypeError, ValueError):
+        return 0
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+
+
+class SheetsQuota:
+    """
+    所有 worksheet / spreadsheet 共用的 Sheets API 配額：
+      - 讀、寫各一個 TokenBucket，依每分鐘配額補充
+        （env SHEETS_READ_PER_MIN / SHEETS_WRITE_PER_MIN，預設 60；多個 worker 要自己除）
+        burst 預設 10（env SHEETS_BURST），避免一開機就把一分鐘的額度花完
+      - 指數退避 + jitter 重試，最多 max_retries 次（env SHEETS_MAX_RETRIES，預設 5）：
+          讀：429 / 5xx；寫：只有 429（request 沒被處理）。5xx 時 server 可能已經寫進去了，
+          append_row(s) 重送會重複記帳，交給呼叫端（write-behind / 鏡像用 entry_id 比對）處理
+      - singleflight：同一個物件、同一個讀取方法、同樣參數，同時只送一個 request，其他人等結果
+        （拿到的是同一份 list，呼叫端不要改它）
+      - fork-safe：pid 變了就重建 bucket 跟 in-flight 表
+    """
+
+    def __init__(
+        self,
+        read_per_min: float | None = None,
+        write_per_min: float | None = None,
+        burst: int | None = None,
+        max_retries: int | None = None,
+        backoff: float = 1.0,
+    ):
+        if read_per_min is None:
+            read_per_min = float(os.getenv("SHEETS_READ_PER_MIN", "60"))
+        if write_per_min is None:
+            write_per_min = float(os.getenv("SHEETS_WRITE_PER_MIN", "60"))
+        if burst is None:
+            burst = int(os.getenv("SHEETS_BURST", "10"))
+        if max_retries is None:
+            max_retries = int(os.getenv("SHEETS_MAX_RETRIES", "5"))
+
+        self.read_per_min = float(read_per_min)
+        self.write_per_min = float(write_per_min)
+        self.burst = max(1, int(burst))
+        self.max_retries = max(0, int(max_retries))
+        self.backoff = backoff
+        self._pid: int | None = None
+        self._ensure()
+
+    def _ensure(self) -> None:
+        if self._pid == os.getpid():
+            return
+        self._buckets = {
+            "read": TokenBucket(self.read_per_min / 60.0, self.burst),
+            "write": TokenBucket(self.write_per_min / 60.0, self.burst),
+        }
+        self._lock = threading.Lock()
+        self._inflight: dict[tuple, _Flight] = {}
+        self._pid = os.getpid()
+
+    def call(self, kind: str, fn, *args, **kwargs):
+        """
+        排隊拿 token 後呼叫 fn；可以重試的錯誤（見 _retryable）退避後重試，其他直接丟出
+        """
+        self._ensure()
+        bucket = self._buckets[kind]
+        attempt = 0
+        while True:
+            waited = bucket.acquire()
+            if waited:
+                metrics.SHEETS_THROTTLED_SECONDS.inc(waited, kind=kind)
+            metrics.SHEETS_QUOTA_REQUESTS.inc(kind=kind)
+            try:
+                return fn(*args, **kwargs)
+            except APIError as e:
+                status = _status(e)
+                if not self._retryable(kind, status) or attempt >= self.max_retries:
+                    raise
+                metrics.SHEETS_RETRIES.inc(status=str(status))
+                time.sleep(backoff_delay(self.backoff, attempt))
+                attempt += 1
+
+    @staticmethod
+    def _retryable(kind: str, status: int) -> bool:
+        if status == 429:
+            return True
+        return kind == "read" and status >= 500
+
+    def coalesce(self, key: tuple, fn):
+        """
+        同一個 key 正在跑就等它的結果，不另外送
+        """
+        self._ensure()
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+
+        if not leader:
+            metrics.SHEETS_COALESCED.inc(method=key[1])
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+
+
+sheets_quota = SheetsQuota()
+
+
+class QuotaProxy:
+    """
+    包住 gspread 的 Worksheet / Spreadsheet（或介面相容的假物件）：公開方法都經過 SheetsQuota，
+    讀取方法另外做 singleflight；其他屬性直接轉給 target
+    """
+
+    def __init__(self, target, quota: SheetsQuota = sheets_quota):
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_quota", quota)
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+
+        quota = self._quota
+        if name not in READ_METHODS:
+            def write(*args, **kwargs):
+                return quota.call("write", attr, *args, **kwargs)
+
+            return write
+
+        target_id = id(self._target)
+
+        def read(*args, **kwargs):
+            try:
+                key = (target_id, name, args, tuple(sorted(kwargs.items())))
+                hash(key)
+            except TypeError:
+                # 參數不能 hash（例如 list）-> 轉成 repr 當 key
+                key = (target_id, name, repr(args), repr(sorted(kwargs.items())))
+            return quota.coalesce(key, lambda: quota.call("read", attr, *args, **kwargs))
+
+        return read
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+
+
+def wrap_worksheet(ws, sheet: str):
+    """
+    worksheet 的標準包法：內層記延遲（每次實際 API 呼叫），外層管配額 / 重試 / 合併
+    env SHEETS_QUOTA=0 只記延遲
+    """
+    ws = metrics.InstrumentedProxy(ws, metrics.SHEETS_SECONDS, sheet=sheet)
+    if os.getenv("SHEETS_QUOTA", "1") == "1":
+        ws = QuotaProxy(ws)
+    return ws
+
+
+def wrap_spreadsheet(sh):
+    """
+    spreadsheet 層的呼叫（worksheets / worksheet / add_worksheet）也算配額
+    """
+    if sh is None or os.getenv("SHEETS_QUOTA", "1") != "1":
+        return sh
+    return QuotaProxy(sh)
@@ -0,0 +1,33 @@
+import re
+
+import gspread
+
+
+def col_letter(col: int) -> str:
+    """
+    1 -> A、27 -> AA
+    """
+    return re.sub(r"\d+$", "", gspread.utils.rowcol_to_a1(1, col))
+
+
+def updated_rows(resp) -> tuple[int, int] | None:
+    """
+    從 append_row / append_rows 的回應取出寫入的列範圍 (起, 迄)
+    e.g. {"updates": {"updatedRange": "records!A12:H14"}} -> (12, 14)
+    """
+    rng = ((resp or {}).get("updates") or {}).get("updatedRange", "")
+    m = re.search(r"![A-Z]+(\d+)(?::[A-Z]+(\d+))?$", rng)
+    if not m:
+        return None
+    start = int(m.group(1))
+    return start, int(m.group(2) or start)
+
+
+def to_int(v) -> int:
+    """
+    格子的值 -> int（"1,200" / "" / 讀不懂的都處理掉，讀不懂當 0）
+    """
+    try:
+        return int(str(v).replace(",", "").strip() or 0)
+    except ValueError:
+        return 0
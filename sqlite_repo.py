@@ -0,0 +1,576 @@
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterator
+
+from ledger_store import LedgerStore
+from records_index import RECORD_COLUMNS
+from sheets_util import to_int
+from rollups import UNCATEGORIZED, build_summary, split_range
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    id        INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts        TEXT    NOT NULL,
+    amount    INTEGER NOT NULL,
+    category  TEXT    NOT NULL DEFAULT '',
+    item      TEXT    NOT NULL DEFAULT '',
+    currency  TEXT    NOT NULL DEFAULT 'TWD',
+    user_id   TEXT    NOT NULL DEFAULT '',
+    raw_text  TEXT    NOT NULL DEFAULT '',
+    group_id  TEXT    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_records_group_ts ON records (group_id, ts);
+CREATE INDEX IF NOT EXISTS idx_records_group_cat_ts ON records (group_id, category, ts);
+
+CREATE TABLE IF NOT EXISTS rollup_daily (
+    group_id  TEXT    NOT NULL,
+    day       TEXT    NOT NULL,
+    category  TEXT    NOT NULL,
+    amount    INTEGER NOT NULL DEFAULT 0,
+    count     INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (group_id, day, category)
+);
+
+CREATE TABLE IF NOT EXISTS rollup_monthly (
+    group_id  TEXT    NOT NULL,
+    month     TEXT    NOT NULL,
+    category  TEXT    NOT NULL,
+    amount    INTEGER NOT NULL DEFAULT 0,
+    count     INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (group_id, month, category)
+);
+
+CREATE TABLE IF NOT EXISTS groups (
+    group_id   TEXT PRIMARY KEY,
+    enabled    INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT    NOT NULL DEFAULT '',
+    created_by TEXT    NOT NULL DEFAULT '',
+    note       TEXT    NOT NULL DEFAULT ''
+);
+
+CREATE TABLE IF NOT EXISTS wallet (
+    group_id   TEXT PRIMARY KEY,
+    balance    INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT    NOT NULL DEFAULT '',
+    updated_by TEXT    NOT NULL DEFAULT ''
+);
+
+-- 要鏡像到 Sheets 的變更，跟變更本身在同一個交易內寫入；鏡像成功才刪
+CREATE TABLE IF NOT EXISTS mirror_outbox (
+    id      INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind    TEXT    NOT NULL,
+    payload TEXT    NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL DEFAULT ''
+);
+"""
+
+
+class SQLiteLedgerRepo(LedgerStore):
+    """
+    本地 SQLite 版 LedgerStore：
+      - records 有 (group_id, ts) 與 (group_id, category, ts) 索引，查詢不用全表掃
+      - rollup_daily / rollup_monthly 跟 records 在同一個交易內更新，整天區間的彙整只讀幾個 cell
+      - wallet 用 UPDATE balance = balance + ? 在交易內完成，多個 gunicorn worker 也不會蓋掉彼此
+      - WAL 模式；每個 thread 一條連線，fork 之後重開
+      - mirror（SheetsMirror）有設定時：
+          - 每筆變更在同一個交易內寫進 mirror_outbox，commit 後通知背景 thread 鏡像到 Sheets
+          - db 是空的就先從 Sheets 匯入 groups / wallet / records，匯入失敗就不啟動（不會拿空帳本去蓋 Sheets）
+    """
+
+    def __init__(self, path: str = "ledger.db", mirror=None):
+        self.path = path
+        self.mirror = mirror
+        self._local = threading.local()
+
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+
+        # 舊的 db 還沒有 rollup -> 建一次
+        has_rollup = conn.execute("SELECT 1 FROM rollup_monthly LIMIT 1").fetchone()
+        has_records = conn.execute("SELECT 1 FROM records LIMIT 1").fetchone()
+        if has_records and not has_rollup:
+            self.rebuild_rollups()
+
+        if mirror:
+            if self._is_empty(conn):
+                self.import_state(mirror.sheets().export_state())
+            mirror.bind(self)
+
+    # =========================
+    # connection
+    # =========================
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _tx(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def close(self) -> None:
+        # mirror 最後一次 flush 還要讀 outbox，先關
+        if self.mirror:
+            self.mirror.close()
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            conn.close()
+            self._local.conn = None
+
+    # =========================
+    # 從 Sheets 匯入 / 鏡像 outbox
+    # =========================
+    @staticmethod
+    def _is_empty(conn: sqlite3.Connection) -> bool:
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'sheets_imported'").fetchone():
+            return False
+        return not any(
+            conn.execute(f"SELECT 1 FROM {t} LIMIT 1").fetchone() for t in ("records", "groups", "wallet")
+        )
+
+    def import_state(self, state: dict) -> int:
+        """
+        LedgerRepo.export_state() 的結果寫進空的 db（一個交易），回傳匯入的 records 筆數
+        多個 worker 同時啟動時只有第一個會匯入；匯入的資料本來就在 Sheets 上，不進 outbox
+        """
+        now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        with self._tx() as conn:
+            if not self._is_empty(conn):
+                return 0
+            for g in state.get("groups", []):
+                enabled = str(g.get("enabled", "")).strip().upper() == "TRUE" or g.get("enabled") is True
+                conn.execute(
+                    "INSERT OR IGNORE INTO groups (group_id, enabled, created_at, created_by, note) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (str(g["group_id"]).strip(), int(enabled), str(g.get("created_at", "")),
+                     str(g.get("created_by", "")), str(g.get("note", ""))),
+                )
+            for gid, balance in state.get("wallet", {}).items():
+                conn.execute(
+                    "INSERT OR IGNORE INTO wallet (group_id, balance, updated_at, updated_by) VALUES (?, ?, ?, '')",
+                    (str(gid), int(balance), now),
+                )
+            n = 0
+            for r in state.get("records", []):
+                if not str(r.get("group_id", "")).strip() or not str(r.get("ts", "")).strip():
+                    continue
+                row = [str(r.get(k, "")) for k in RECORD_COLUMNS]
+                row[1] = to_int(r.get("amount", 0))
+                self._insert_record(conn, row)
+                n += 1
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('sheets_imported', ?)", (now,))
+        print(f"[sqlite] imported {n} record(s) from Sheets")
+        return n
+
+    def _outbox(self, conn: sqlite3.Connection, kind: str, payload) -> None:
+        # 呼叫端要在交易內
+        if self.mirror:
+            conn.execute(
+                "INSERT INTO mirror_outbox (kind, payload) VALUES (?, ?)",
+                (kind, json.dumps(payload, ensure_ascii=False)),
+            )
+
+    def _notify_mirror(self) -> None:
+        if self.mirror:
+            self.mirror.notify()
+
+    def outbox_batch(self, limit: int) -> list[tuple[int, str, object]]:
+        """
+        最舊的 limit 筆 [(id, kind, payload)]
+        """
+        rows = self._conn().execute(
+            "SELECT id, kind, payload FROM mirror_outbox ORDER BY id LIMIT ?", (int(limit),)
+        ).fetchall()
+        return [(r["id"], r["kind"], json.loads(r["payload"])) for r in rows]
+
+    def outbox_done(self, ids: list[int]) -> None:
+        if ids:
+            with self._tx() as conn:
+                conn.executemany("DELETE FROM mirror_outbox WHERE id = ?", [(i,) for i in ids])
+
+    def outbox_last_id(self) -> int:
+        row = self._conn().execute("SELECT MAX(id) AS id FROM mirror_outbox").fetchone()
+        return int(row["id"] or 0)
+
+    # =========================
+    # groups
+    # =========================
+    def get_group_enabled(self, group_id: str) -> bool:
+        row = self._conn().execute(
+            "SELECT enabled FROM groups WHERE group_id = ?", (str(group_id),)
+        ).fetchone()
+        return bool(row and row["enabled"])
+
+    def peek_group_enabled(self, group_id: str) -> bool | None:
+        # 本地查詢夠便宜，直接查
+        return self.get_group_enabled(group_id)
+
+    def enable_group(self, group_id: str, actor_user_id: str) -> None:
+        now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        with self._tx() as conn:
+            conn.execute(
+                "INSERT INTO groups (group_id, enabled, created_at, created_by) VALUES (?, 1, ?, ?) "
+                "ON CONFLICT(group_id) DO UPDATE SET enabled = 1, created_by = excluded.created_by",
+                (str(group_id), now, actor_user_id),
+            )
+            self._outbox(conn, "group", {"group_id": str(group_id), "actor": actor_user_id})
+        self._notify_mirror()
+
+    # =========================
+    # records
+    # =========================
+    def add_record(
+        self,
+        group_id: str,
+        user_id: str,
+        raw_text: str,
+        item: str,
+        amount: int,
+        category: str,
+        currency: str = "TWD",
+        ts: str | None = None,
+    ) -> None:
+        if ts is None:
+            ts = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+        row = [ts, int(amount), category, item, currency, user_id, raw_text, group_id]
+        with self._tx() as conn:
+            self._add_row(conn, row)
+        self._notify_mirror()
+
+    def _add_row(self, conn: sqlite3.Connection, row: list) -> None:
+        # 呼叫端要在交易內；entry_id 用 records.id，鏡像重送時才認得出已經寫過的列
+        rowid = self._insert_record(conn, row)
+        self._outbox(conn, "record", row + [f"sqlite-{rowid}"])
+
+    @staticmethod
+    def _insert_record(conn: sqlite3.Connection, row: list) -> int:
+        # 呼叫端要在交易內；row 欄位順序同 RECORD_COLUMNS；回傳 records.id
+        ts, amount, category, group_id = row[0], int(row[1]), row[2], str(row[7])
+        cur = conn.execute(
+            f"INSERT INTO records ({', '.join(RECORD_COLUMNS)}) VALUES ({', '.join('?' * len(row))})",
+            row,
+        )
+        cat = category or UNCATEGORIZED
+        for table, col, key in (("rollup_daily", "day", ts[:10]), ("rollup_monthly", "month", ts[:7])):
+            conn.execute(
+                f"INSERT INTO {table} (group_id, {col}, category, amount, count) VALUES (?, ?, ?, ?, 1) "
+                f"ON CONFLICT(group_id, {col}, category) DO UPDATE SET "
+                "amount = amount + excluded.amount, count = count + 1",
+                (group_id, key, cat, amount),
+            )
+        return cur.lastrowid
+
+    def add_expenses(
+        self,
+        group_id: str,
+        user_id: str,
+        entries: list[dict],
+        currency: str = "TWD",
+        ts: str | None = None,
+    ) -> int:
+        """
+        多筆記帳 + 合計扣款在同一個交易內
+        """
+        if ts is None:
+            ts = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+
+        rows = [
+            [ts, int(e["amount"]), e["category"], e["item"], currency, user_id, e.get("raw_text", ""), group_id]
+            for e in entries
+        ]
+        with self._tx() as conn:
+            for row in rows:
+                self._add_row(conn, row)
+            new_balance = self._wallet_update(conn, group_id, -sum(r[1] for r in rows), user_id, now)
+        self._notify_mirror()
+        return new_balance
+
+    def rebuild_rollups(self) -> None:
+        cat = f"CASE WHEN category = '' THEN '{UNCATEGORIZED}' ELSE category END"
+        with self._tx() as conn:
+            conn.execute("DELETE FROM rollup_daily")
+            conn.execute("DELETE FROM rollup_monthly")
+            for table, col, n in (("rollup_daily", "day", 10), ("rollup_monthly", "month", 7)):
+                conn.execute(
+                    f"INSERT INTO {table} (group_id, {col}, category, amount, count) "
+                    f"SELECT group_id, substr(ts, 1, {n}), {cat}, SUM(amount), COUNT(*) "
+                    f"FROM records GROUP BY group_id, substr(ts, 1, {n}), {cat}"
+                )
+
+    def query_records(
+        self,
+        group_id: str,
+        start_iso: str,
+        end_iso: str,
+        category: str | None = None,
+        limit: int | None = 50,
+    ) -> list[dict]:
+        sql = f"SELECT {', '.join(RECORD_COLUMNS)} FROM records WHERE group_id = ? AND ts >= ? AND ts < ?"
+        args: list = [str(group_id), start_iso, end_iso]
+        if category:
+            sql += " AND category = ?"
+            args.append(category)
+        sql += " ORDER BY ts DESC, id DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            args.append(int(limit))
+        return [dict(r) for r in self._conn().execute(sql, args)]
+
+    def iter_records(self, group_id: str, start_iso: str, end_iso: str, page_size: int | None = None) -> Iterator[dict]:
+        """
+        keyset 分頁：每次用 (ts, id) 接著上一頁往後查 page_size 筆（env EXPORT_PAGE_ROWS，預設 1000），
+        不開長時間的 cursor，也不用 OFFSET
+        """
+        if page_size is None:
+            page_size = int(os.getenv("EXPORT_PAGE_ROWS", "1000"))
+        sql = (
+            f"SELECT id, {', '.join(RECORD_COLUMNS)} FROM records "
+            "WHERE group_id = ? AND ts < ? AND (ts > ? OR (ts = ? AND id > ?)) "
+            "ORDER BY ts, id LIMIT ?"
+        )
+        last_ts, last_id = start_iso, 0
+        # 第一頁 ts >= start_iso（用 ts = start_iso AND id > 0 接上）
+        while True:
+            rows = self._conn().execute(
+                sql, (str(group_id), end_iso, last_ts, last_ts, last_id, int(page_size))
+            ).fetchall()
+            for r in rows:
+                rec = dict(r)
+                rec.pop("id")
+                yield rec
+            if len(rows) < page_size:
+                return
+            last_ts, last_id = rows[-1]["ts"], rows[-1]["id"]
+
+    def summary_by_category(
+        self,
+        group_id: str,
+        start_iso: str,
+        end_iso: str,
+        category: str | None = None,
+    ) -> dict:
+        parts = split_range(start_iso, end_iso)
+        conn = self._conn()
+        by_cat: dict[str, list] = {}
+
+        if parts is not None:
+            # 整天區間 -> 拼 rollup cell
+            days, months = parts
+            queries = [("rollup_daily", "day", days), ("rollup_monthly", "month", months)]
+            for table, col, keys in queries:
+                if not keys:
+                    continue
+                sql = (
+                    f"SELECT category, SUM(amount) AS amount, SUM(count) AS count FROM {table} "
+                    f"WHERE group_id = ? AND {col} IN ({', '.join('?' * len(keys))}) GROUP BY category"
+                )
+                for r in conn.execute(sql, [str(group_id), *keys]):
+                    c = by_cat.setdefault(r["category"], [0, 0])
+                    c[0] += r["amount"]
+                    c[1] += r["count"]
+        else:
+            sql = (
+                f"SELECT CASE WHEN category = '' THEN '{UNCATEGORIZED}' ELSE category END AS cat, "
+                "SUM(amount) AS amount, COUNT(*) AS count "
+                "FROM records WHERE group_id = ? AND ts >= ? AND ts < ? GROUP BY cat"
+            )
+            for r in conn.execute(sql, [str(group_id), start_iso, end_iso]):
+                by_cat[r["cat"]] = [r["amount"], r["count"]]
+
+        return build_summary(by_cat, category)
+
+    # =========================
+    # wallet (儲存金)
+    # =========================
+    def get_balance(self, group_id: str) -> int:
+        row = self._conn().execute(
+            "SELECT balance FROM wallet WHERE group_id = ?", (str(group_id),)
+        ).fetchone()
+        return int(row["balance"]) if row else 0
+
+    def _wallet_update(self, conn: sqlite3.Connection, group_id: str, delta: int, actor_user_id: str, now: str) -> int:
+        # 呼叫端要在交易內；鏡像用增減量，Sheets 上手動改過的餘額不會被蓋掉
+        if delta:
+            self._outbox(conn, "wallet", {"group_id": str(group_id), "delta": int(delta), "actor": actor_user_id})
+        conn.execute(
+            "INSERT INTO wallet (group_id, balance, updated_at, updated_by) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(group_id) DO UPDATE SET balance = balance + excluded.balance, "
+            "updated_at = excluded.updated_at, updated_by = excluded.updated_by",
+            (str(group_id), int(delta), now, actor_user_id),
+        )
+        return int(
+            conn.execute("SELECT balance FROM wallet WHERE group_id = ?", (str(group_id),)).fetchone()["balance"]
+        )
+
+    def _wallet_apply(self, group_id: str, delta: int, actor_user_id: str) -> int:
+        now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        with self._tx() as conn:
+            new_balance = self._wallet_update(conn, group_id, delta, actor_user_id, now)
+        self._notify_mirror()
+        return new_balance
+
+    def deposit(self, group_id: str, amount: int, actor_user_id: str) -> int:
+        """
+        存入金額，回傳存入後餘額
+        """
+        return self._wallet_apply(group_id, int(amount), actor_user_id)
+
+    def deduct(self, group_id: str, amount: int, actor_user_id: str) -> int:
+        """
+        扣款（記帳時用），回傳扣款後餘額
+        若 wallet 沒有該 group_id，視為 0 再扣（可能變負數）
+        """
+        return self._wallet_apply(group_id, -int(amount), actor_user_id)
+
+
+class SheetsMirror:
+    """
+    SQLite 寫入的背景鏡像（給人用試算表瀏覽）：
+      - 來源是 SQLite 的 mirror_outbox（bind() 之後），依 id 順序套用，套用成功才刪，重啟不會掉
+      - 連續的 records 一次 append_rows；wallet 套增減量（deposit），不直接覆寫餘額
+      - records 寫之前一律先比對 entry_id（不管是自己還是別的 worker，crash 前可能已經寫上去了）
+      - 多個 worker 共用一個 db：flush 時持有 <db>.mirror.lock 的 flock，同一時間只有一個在搬
+      - 寫失敗就留在 outbox，interval 秒後重試
+      - LedgerRepo 在第一次要用時才建立（db 是空的時候 SQLiteLedgerRepo 啟動就會用到，拿來匯入）
+    """
+
+    def __init__(self, spreadsheet_id: str | None, interval: float = 5.0, batch_size: int = 500, repo=None):
+        self.spreadsheet_id = spreadsheet_id
+        self.interval = interval
+        self.batch_size = max(1, int(batch_size))
+        self._repo = repo
+        self._store = None
+        self._cond = threading.Condition()
+        self._dirty = False
+        self._closed = False
+        self._flush_lock = threading.Lock()
+        self._lock_file = None
+        self._thread = None
+
+    def sheets(self):
+        if self._repo is None:
+            from gsheets_repo import LedgerRepo
+
+            self._repo = LedgerRepo(spreadsheet_id=self.spreadsheet_id, write_behind=False)
+        return self._repo
+
+    def bind(self, store: SQLiteLedgerRepo) -> None:
+        """
+        接上 SQLiteLedgerRepo 的 outbox 並啟動背景 thread
+        """
+        self._store = store
+        self._lock_file = open(f"{store.path}.mirror.lock", "a+")
+        # 上次沒搬完的馬上搬
+        self._dirty = store.outbox_last_id() > 0
+        self._thread = threading.Thread(target=self._run, name="sheets-mirror", daemon=True)
+        self._thread.start()
+
+    def notify(self) -> None:
+        with self._cond:
+            self._dirty = True
+            self._cond.notify()
+
+    def flush(self) -> int:
+        """
+        outbox 全部搬到 Sheets，回傳套用的筆數；失敗時已套用的部分已經刪掉，剩下的留著往外丟錯
+        """
+        if self._store is None:
+            return 0
+        with self._flush_lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                done = 0
+                while True:
+                    batch = self._store.outbox_batch(self.batch_size)
+                    if not batch:
+                        return done
+                    done += self._apply(batch)
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _apply(self, batch: list[tuple[int, str, object]]) -> int:
+        repo = self.sheets()
+        done = 0
+        i = 0
+        while i < len(batch):
+            oid, kind, payload = batch[i]
+            if kind == "record":
+                j = i
+                while j < len(batch) and batch[j][1] == "record":
+                    j += 1
+                ids = [b[0] for b in batch[i:j]]
+                rows = [b[2] for b in batch[i:j]]
+                # 別的 worker 可能 append_rows 成功後、outbox_done 之前掛掉 -> 每次都先比對 entry_id
+                rows = repo.drop_written(rows)
+                if rows:
+                    repo.append_records(rows)
+                self._store.outbox_done(ids)
+                done += j - i
+                i = j
+                continue
+
+            if kind == "wallet":
+                repo.deposit(payload["group_id"], int(payload["delta"]), payload["actor"])
+            elif kind == "group":
+                repo.enable_group(payload["group_id"], payload["actor"])
+            else:
+                print(f"[mirror] unknown outbox kind: {kind}")
+            self._store.outbox_done([oid])
+            done += 1
+            i += 1
+        return done
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._closed and not self._dirty:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                self._dirty = False
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[mirror] flush error: {e}")
+                with self._cond:
+                    self._dirty = True
+            # 等一下再搬，讓變更累積成一批；close() 會叫醒
+            with self._cond:
+                if not self._closed:
+                    self._cond.wait(self.interval)
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(self.interval + 5)
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"[mirror] final flush error: {e}")
@@ -0,0 +1,40 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+# app.py 在 import 時就要有這些；測試不連 Google / LINE / 匯率網站
+os.environ.setdefault("LINE_CHANNEL_SECRET", "test-secret")
+os.environ.setdefault("LINE_CHANNEL_ACCESS_TOKEN", "test-token")
+os.environ["LEDGER_EAGER_INIT"] = "0"
+os.environ["SHEETS_QUOTA"] = "0"
+os.environ.pop("LEDGER_SPREADSHEET_ID", None)
+
+from fake_gspread import CallStats, FakeSpreadsheet, FakeWorksheet  # noqa: E402
+from records_index import RECORD_COLUMNS  # noqa: E402
+
+
+@pytest.fixture
+def stats():
+    return CallStats()
+
+
+@pytest.fixture
+def sheets(stats):
+    """
+    records / groups / wallet 三張假的 worksheet（只有 header）
+    """
+    return {
+        "records": FakeWorksheet("records", [list(RECORD_COLUMNS)], stats),
+        "groups": FakeWorksheet("groups", [["group_id", "enabled", "created_at", "created_by", "note"]], stats),
+        "wallet": FakeWorksheet("wallet", [["group_id", "balance", "updated_at", "updated_by"]], stats),
+    }
+
+
+@pytest.fixture
+def spreadsheet(stats, sheets):
+    return FakeSpreadsheet(stats, worksheets=list(sheets.values()))
@@ -0,0 +1,58 @@
+import pytest
+from gspread.exceptions import APIError
+
+from archive_records import split_records
+
+
+def _fill(sheets):
+    sheets["records"].rows.extend([
+        ["2026-01-31 23:00:00", "10", "餐飲", "a", "TWD", "u", "", "G1"],
+        ["2026/2/1 9:05:00", "20", "餐飲", "b", "TWD", "u", "", "G1"],
+        ["2026-02-15 12:00:00", "30", "餐飲", "c", "TWD", "u", "", "G1"],
+        ["", "", "", "", "", "", "", ""],
+        ["昨天", "40", "餐飲", "d", "TWD", "u", "", "G1"],
+    ])
+
+
+def test_split_by_month_accepts_formatted_ts(spreadsheet, sheets):
+    _fill(sheets)
+    result = split_records(spreadsheet)
+    assert result["partitions"] == {"2026-01": 1, "2026-02": 2}
+    assert result["bad_rows"] == [6]
+    assert [r[3] for r in spreadsheet.worksheet("records_2026-02").rows[1:]] == ["b", "c"]
+
+
+def test_rerun_skips_existing(spreadsheet, sheets):
+    _fill(sheets)
+    split_records(spreadsheet)
+    again = split_records(spreadsheet)
+    assert again["partitions"] == {"2026-01": 0, "2026-02": 0}
+    assert again["skipped_existing"] == 3
+
+
+def test_dry_run_creates_nothing(spreadsheet, sheets):
+    _fill(sheets)
+    result = split_records(spreadsheet, dry_run=True)
+    assert result["partitions"] == {"2026-01": 1, "2026-02": 2}
+    assert {ws.title for ws in spreadsheet.worksheets()} == {"records", "groups", "wallet"}
+
+
+def test_lookup_errors_are_not_swallowed(spreadsheet, sheets):
+    class _Resp:
+        text = "boom"
+
+        def json(self):
+            return {"error": {"code": 503, "message": "backend error"}}
+
+    _fill(sheets)
+    lookup = spreadsheet.worksheet
+
+    def flaky(title):
+        if title.startswith("records_"):
+            raise APIError(_Resp())
+        return lookup(title)
+
+    spreadsheet.worksheet = flaky
+    with pytest.raises(APIError):
+        split_records(spreadsheet)
+    assert {ws.title for ws in spreadsheet.worksheets()} == {"records", "groups", "wallet"}
@@ -0,0 +1,91 @@
+import asyncio
+import threading
+
+import pytest
+
+import app as bot
+import asgi
+from gsheets_repo import LedgerRepo
+from ledger_export import make_export_token
+
+
+def _call(method, path, query=b"", body=b"", headers=()):
+    sent = []
+    chunks = [body]
+
+    async def receive():
+        return {"type": "http.request", "body": chunks.pop(0) if chunks else b"", "more_body": False}
+
+    async def send(msg):
+        sent.append(msg)
+
+    scope = {
+        "type": "http", "method": method, "path": path, "query_string": query,
+        "headers": [(k.encode(), v.encode()) for k, v in headers],
+    }
+    asyncio.run(asgi.app(scope, receive, send))
+    return sent
+
+
+def _status(sent):
+    return sent[0]["status"]
+
+
+def _body_parts(sent):
+    return [m["body"] for m in sent[1:] if m.get("body")]
+
+
+@pytest.fixture
+def export_repo(sheets, monkeypatch):
+    monkeypatch.setenv("EXPORT_FLUSH_BYTES", "1")
+    sheets["records"].rows.extend(
+        [f"2026-02-0{i} 10:00:00", str(i), "餐飲", f"item{i}", "TWD", "u", "", "G1"] for i in range(1, 4)
+    )
+    bot.ledger.set(LedgerRepo.from_worksheets(sheets["records"], sheets["groups"], sheets["wallet"]))
+    yield make_export_token("G1", "2026-02-01 00:00:00", "2026-03-01 00:00:00")
+    bot.ledger.set(None)
+
+
+def test_callback_invalid_utf8_is_400():
+    sent = _call("POST", "/callback", body=b"\xff\xfe{", headers=[("x-line-signature", "x")])
+    assert _status(sent) == 400
+
+
+def test_callback_bad_signature_is_400():
+    sent = _call("POST", "/callback", body=b'{"events": []}', headers=[("x-line-signature", "bad")])
+    assert _status(sent) == 400
+
+
+def test_webhook_events_runs_off_the_loop(monkeypatch):
+    seen = []
+
+    def fake(body, signature):
+        seen.append(threading.current_thread().name)
+        return []
+
+    monkeypatch.setattr(bot, "webhook_events", fake)
+    assert _status(_call("POST", "/callback", body=b"{}")) == 200
+    assert seen and seen[0].startswith("asgi-blocking")
+
+
+def test_wsgi_bridge_streams(export_repo):
+    sent = _call("GET", "/export.csv", query=f"token={export_repo}".encode())
+    assert _status(sent) == 200
+    headers = dict(sent[0]["headers"])
+    assert headers[b"content-type"].startswith(b"text/csv")
+    parts = _body_parts(sent)
+    # 每一列各自一段送出，不是整段收起來再送
+    assert len(parts) >= 4
+    assert b"item3" in b"".join(parts)
+    assert sent[-1] == {"type": "http.response.body", "body": b""}
+
+
+def test_wsgi_bridge_head_has_no_body(export_repo):
+    sent = _call("HEAD", "/export.csv", query=f"token={export_repo}".encode())
+    assert _status(sent) == 200
+    assert _body_parts(sent) == []
+
+
+def test_wsgi_bridge_passes_status_and_query(export_repo):
+    assert _status(_call("GET", "/export.csv", query=b"token=nope")) == 403
+    assert _status(_call("GET", "/export.csv")) == 401
@@ -0,0 +1,70 @@
+from types import SimpleNamespace
+
+import pytest
+
+import app
+from gsheets_repo import LedgerRepo
+from ledger import MAX_BULK_LINES, parse_bulk_lines, parse_ledger_command
+
+
+def test_bulk_needs_trigger_line():
+    assert parse_ledger_command("餐飲 120 午餐\n交通 30 公車")["type"] == "unknown"
+    assert parse_ledger_command("大家好\n餐飲 120 午餐")["type"] == "unknown"
+    cmd = parse_ledger_command("記帳\n餐飲 120 午餐\n交通 30 uber 回家")
+    assert cmd["type"] == "add_many"
+    assert [(e["category"], e["amount"], e["item"]) for e in cmd["entries"]] == [
+        ("餐飲", 120, "午餐"), ("交通", 30, "uber 回家"),
+    ]
+    assert cmd["errors"] == []
+
+
+def test_line_numbers_count_raw_lines():
+    cmd = parse_bulk_lines("記帳\n\n餐飲 120 午餐\n  \n交通 三十 公車\n日用 50 衛生紙")
+    assert [e["line"] for e in cmd["entries"]] == [3, 6]
+    assert cmd["errors"] == [{"line": 5, "text": "交通 三十 公車", "reason": "格式應為：類別 金額 商品"}]
+
+
+def test_too_many_lines():
+    text = "記帳\n" + "\n".join(f"餐飲 {i} x" for i in range(1, MAX_BULK_LINES + 2))
+    cmd = parse_bulk_lines(text)
+    assert len(cmd["entries"]) == MAX_BULK_LINES
+    assert [err["line"] for err in cmd["errors"]] == [MAX_BULK_LINES + 2]
+
+
+# =========================
+# 回覆（整批記或整批不記）
+# =========================
+def _event(text):
+    return SimpleNamespace(
+        reply_token="r",
+        message=SimpleNamespace(text=text),
+        source=SimpleNamespace(type="group", group_id="G1", user_id="u"),
+    )
+
+
+@pytest.fixture
+def repo(sheets):
+    sheets["groups"].rows.append(["G1", "TRUE", "", "u", ""])
+    r = LedgerRepo.from_worksheets(sheets["records"], sheets["groups"], sheets["wallet"])
+    app.ledger.set(r)
+    yield r
+    app.ledger.set(None)
+
+
+def test_bulk_records_every_line(repo, sheets):
+    r = repo.deposit("G1", 1000, "u")
+    msgs = app._reply_messages(_event("記帳\n餐飲 120 午餐\n交通 30 公車"), {"type": "echo"})
+    text = msgs[0].text
+    assert text.startswith("已記錄 2 筆，合計 150 元")
+    assert text.endswith(f"剩餘儲存金：{r - 150} 元")
+    assert len(sheets["records"].rows) == 3
+
+
+def test_bulk_with_bad_line_records_nothing(repo, sheets):
+    msgs = app._reply_messages(_event("記帳\n餐飲 120 午餐\n\n交通 三十 公車"), {"type": "echo"})
+    assert msgs[0].text.splitlines() == [
+        "格式有誤，這次全部未記錄（共 1 行），請修正後整批重貼：",
+        "- 第 4 行「交通 三十 公車」：格式應為：類別 金額 商品",
+    ]
+    assert len(sheets["records"].rows) == 1
+
@@ -0,0 +1,140 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+from linebot.v3.messaging import ApiException
+
+import app
+import line_bulk
+import rate_limit
+from line_bulk import MULTICAST_LIMIT, BulkSender
+from rate_limit import TokenBucket, backoff_delay
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, s):
+        self.slept.append(s)
+        self.now += s
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = FakeClock()
+    monkeypatch.setattr(rate_limit, "time", c)
+    monkeypatch.setattr(line_bulk, "time", SimpleNamespace(sleep=c.sleep, perf_counter=time.perf_counter))
+    return c
+
+
+# =========================
+# TokenBucket
+# =========================
+def test_bucket_burst_then_waits(clock):
+    bucket = TokenBucket(rate=2, burst=3)
+    assert [bucket.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.acquire() == pytest.approx(0.5)
+    assert bucket.acquire() == pytest.approx(0.5)
+
+
+def test_bucket_refills_up_to_burst(clock):
+    bucket = TokenBucket(rate=1, burst=2)
+    bucket.acquire()
+    bucket.acquire()
+    clock.now += 60
+    # 閒置再久也只存 burst 個
+    assert [bucket.acquire() for _ in range(2)] == [0.0, 0.0]
+    assert bucket.acquire() == pytest.approx(1.0)
+
+
+def test_backoff_delay_is_capped():
+    assert 4.0 <= backoff_delay(1.0, 2) <= 5.0
+    assert backoff_delay(1.0, 30, cap=60.0) <= 61.0
+
+
+# =========================
+# BulkSender
+# =========================
+def _api_error(status, retry_after=None):
+    e = ApiException(status=status, reason="err")
+    e.headers = {"Retry-After": retry_after} if retry_after else {}
+    return e
+
+
+class FakeApi:
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.calls = []
+
+    def multicast(self, req, x_line_retry_key=None):
+        self.calls.append((list(req.to), x_line_retry_key))
+        if self.errors:
+            raise self.errors.pop(0)
+
+
+def _sender(api, **kw):
+    return BulkSender(SimpleNamespace(api=api), rate=1e6, workers=2, backoff=0, **kw)
+
+
+def test_multicast_dedups_and_chunks(clock):
+    api = FakeApi()
+    ids = [f"U{i}" for i in range(MULTICAST_LIMIT * 2 + 1)] + ["U0", ""]
+    result = _sender(api).multicast(ids, [app.TextMessage(text="hi")])
+    assert result["recipients"] == MULTICAST_LIMIT * 2 + 1
+    assert result["sent"] == result["recipients"] and result["failed"] == 0
+    assert sorted(len(to) for to, _ in api.calls) == [1, MULTICAST_LIMIT, MULTICAST_LIMIT]
+
+
+def test_retry_after_then_409_counts_as_sent(clock):
+    api = FakeApi([_api_error(429, "3"), _api_error(409)])
+    result = _sender(api).multicast(["U1"], [app.TextMessage(text="hi")])
+    assert result["sent"] == 1
+    assert result["chunks"][0]["attempts"] == 2
+    assert 3.0 in clock.slept
+    # 重試用同一個 retry key
+    assert api.calls[0][1] == api.calls[1][1]
+
+
+def test_client_error_not_retried(clock):
+    api = FakeApi([_api_error(400)])
+    result = _sender(api).multicast(["U1"], [app.TextMessage(text="hi")])
+    assert result["failed"] == 1 and len(api.calls) == 1
+
+
+def test_gives_up_after_max_retries(clock):
+    api = FakeApi([_api_error(500)] * 5)
+    result = _sender(api, max_retries=2).multicast(["U1"], [app.TextMessage(text="hi")])
+    assert result["chunks"][0]["status"] == "failed"
+    assert len(api.calls) == 3
+
+
+# =========================
+# /send_bulk
+# =========================
+@pytest.fixture
+def client():
+    return app.app.test_client()
+
+
+def test_send_bulk_closed_without_token(client, monkeypatch):
+    monkeypatch.setattr(app, "BULK_SEND_TOKEN", None)
+    assert client.post("/send_bulk", json={"message": "hi"}).status_code == 401
+
+
+def test_send_bulk_requires_bearer(client, monkeypatch):
+    monkeypatch.setattr(app, "BULK_SEND_TOKEN", "s3cret")
+    sent = []
+    monkeypatch.setattr(
+        app.bulk_sender, "multicast",
+        lambda ids, msgs, notification_disabled=False: sent.append(ids) or {"sent": len(ids), "failed": 0},
+    )
+    assert client.post("/send_bulk", json={"message": "hi", "user_ids": ["U1"]}).status_code == 401
+    resp = client.post(
+        "/send_bulk", json={"message": "hi", "user_ids": ["U1"]}, headers={"Authorization": "Bearer s3cret"},
+    )
+    assert resp.status_code == 200 and sent == [["U1"]]
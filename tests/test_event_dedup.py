@@ -0,0 +1,94 @@
+from types import SimpleNamespace
+
+import pytest
+
+import app
+import event_dedup
+from event_dedup import MemoryDedupStore, SQLiteDedupStore, create_dedup_store, event_key, is_redelivery
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = FakeClock()
+    monkeypatch.setattr(event_dedup, "time", SimpleNamespace(monotonic=c, time=c))
+    return c
+
+
+def _event(key, redelivery=False):
+    return SimpleNamespace(webhook_event_id=key, delivery_context=SimpleNamespace(is_redelivery=redelivery))
+
+
+def test_event_key_and_redelivery():
+    assert event_key(_event("E1")) == "E1"
+    assert event_key(_event("")) is None
+    assert event_key(SimpleNamespace()) is None
+    assert is_redelivery(_event("E1", redelivery=True))
+    assert not is_redelivery(SimpleNamespace())
+
+
+def test_memory_ttl(clock):
+    store = MemoryDedupStore(ttl=10)
+    assert not store.seen_before("a")
+    assert store.seen_before("a")
+    clock.now += 11
+    assert not store.seen_before("a")
+
+
+def test_memory_evicts_oldest_when_full(clock):
+    store = MemoryDedupStore(ttl=600, max_size=2)
+    for key in ("a", "b", "c"):
+        assert not store.seen_before(key)
+        clock.now += 1
+    assert len(store) == 2
+    assert store.seen_before("c")
+    assert not store.seen_before("a")
+
+
+def test_sqlite_shared_between_stores(tmp_path, clock):
+    path = str(tmp_path / "dedup.db")
+    first, second = SQLiteDedupStore(path, ttl=10), SQLiteDedupStore(path, ttl=10)
+    assert not first.seen_before("a")
+    assert second.seen_before("a")
+    clock.now += 11
+    assert not second.seen_before("a")
+    assert first.seen_before("a")
+
+
+def test_sqlite_purges_expired(tmp_path, clock):
+    store = SQLiteDedupStore(str(tmp_path / "dedup.db"), ttl=10, purge_every=2)
+    store.seen_before("a")
+    clock.now += 11
+    store.seen_before("b")
+    rows = store._conn().execute("SELECT event_id FROM webhook_events").fetchall()
+    assert rows == [("b",)]
+
+
+@pytest.mark.parametrize(
+    "mode, cls",
+    [("memory", MemoryDedupStore), ("sqlite", SQLiteDedupStore), ("off", type(None))],
+)
+def test_create_dedup_store(monkeypatch, tmp_path, mode, cls):
+    monkeypatch.setenv("WEBHOOK_DEDUP", mode)
+    monkeypatch.setenv("WEBHOOK_DEDUP_PATH", str(tmp_path / "dedup.db"))
+    assert isinstance(create_dedup_store(), cls)
+
+
+def test_create_dedup_store_unknown(monkeypatch):
+    monkeypatch.setenv("WEBHOOK_DEDUP", "redis")
+    with pytest.raises(RuntimeError):
+        create_dedup_store()
+
+
+def test_app_skips_duplicates(monkeypatch):
+    monkeypatch.setattr(app, "dedup", MemoryDedupStore())
+    assert not app._is_duplicate(_event("E1"))
+    assert app._is_duplicate(_event("E1", redelivery=True))
+    assert not app._is_duplicate(_event(None))
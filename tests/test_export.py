@@ -0,0 +1,119 @@
+import csv
+import io
+from types import SimpleNamespace
+
+import pytest
+
+import app
+from gsheets_repo import LedgerRepo
+from ledger import parse_ledger_command, resolve_ledger_range
+from ledger_export import csv_chunks, make_export_token, read_export_token
+
+
+def _event(text, group_id="G1"):
+    return SimpleNamespace(
+        reply_token="r",
+        message=SimpleNamespace(text=text),
+        source=SimpleNamespace(type="group", group_id=group_id, user_id="u"),
+    )
+
+
+@pytest.fixture
+def repo(sheets):
+    sheets["groups"].rows.append(["G1", "TRUE", "", "u", ""])
+    r = LedgerRepo.from_worksheets(sheets["records"], sheets["groups"], sheets["wallet"])
+    app.ledger.set(r)
+    yield r
+    app.ledger.set(None)
+
+
+# =========================
+# token
+# =========================
+def test_token_round_trip():
+    token = make_export_token("G1", "2026-02-01 00:00:00", "2026-03-01 00:00:00")
+    assert read_export_token(token) == {"group_id": "G1", "start": "2026-02-01 00:00:00", "end": "2026-03-01 00:00:00"}
+
+
+def test_expired_token_rejected():
+    token = make_export_token("G1", "2026-02-01 00:00:00", "2026-03-01 00:00:00", ttl=-1)
+    assert read_export_token(token) is None
+
+
+def test_tampered_token_rejected():
+    token = make_export_token("G1", "2026-02-01 00:00:00", "2026-03-01 00:00:00")
+    other = make_export_token("G2", "2026-02-01 00:00:00", "2026-03-01 00:00:00")
+    body, sig = token.split(".")
+    assert read_export_token(f"{other.split('.')[0]}.{sig}") is None
+    assert read_export_token(body) is None
+    assert read_export_token("") is None
+
+
+def test_token_needs_secret(monkeypatch):
+    token = make_export_token("G1", "2026-02-01 00:00:00", "2026-03-01 00:00:00")
+    monkeypatch.delenv("EXPORT_LINK_SECRET", raising=False)
+    monkeypatch.setenv("LINE_CHANNEL_SECRET", "")
+    assert read_export_token(token) is None
+
+
+# =========================
+# 區間
+# =========================
+def test_month_range():
+    start, end = resolve_ledger_range("2026-12")
+    assert (start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")) == ("2026-12-01", "2027-01-01")
+    start, end = resolve_ledger_range("2026-02")
+    assert (end - start).days == 28
+
+
+@pytest.mark.parametrize("key", ["2026-13", "2026-02-30", "明天"])
+def test_bad_range_raises(key):
+    with pytest.raises(ValueError):
+        resolve_ledger_range(key)
+
+
+@pytest.mark.parametrize("text", ["匯出 2026-13", "匯出 2026-02-30"])
+def test_export_bad_date_replies(repo, text, monkeypatch):
+    monkeypatch.setenv("PUBLIC_BASE_URL", "https://bot.example")
+    assert parse_ledger_command(text)["type"] == "export"
+    msgs = app._reply_messages(_event(text), {"type": "echo"})
+    assert msgs[0].text.startswith("匯出失敗：")
+
+
+def test_export_replies_link(repo, monkeypatch):
+    monkeypatch.setenv("PUBLIC_BASE_URL", "https://bot.example")
+    msgs = app._reply_messages(_event("匯出 2026-02"), {"type": "echo"})
+    assert "https://bot.example/export.csv?token=" in msgs[0].text
+
+
+# =========================
+# 讀 + CSV
+# =========================
+def test_iter_records_accepts_formatted_ts(repo, sheets):
+    sheets["records"].rows.extend([
+        ["2026/2/1 9:05:00", "100", "餐飲", "早餐", "TWD", "u", "", "G1"],
+        ["2026-02-15 12:00:00", "200", "餐飲", "午餐", "TWD", "u", "", "G1"],
+        ["2026/3/1 0:00:00", "300", "餐飲", "三月", "TWD", "u", "", "G1"],
+        ["2026/2/2 9:05:00", "400", "餐飲", "別群", "TWD", "u", "", "G2"],
+    ])
+    got = list(repo.iter_records("G1", "2026-02-01 00:00:00", "2026-03-01 00:00:00", page_rows=2))
+    assert [r["item"] for r in got] == ["早餐", "午餐"]
+
+
+def test_csv_chunks_streams_header_first():
+    chunks = csv_chunks(iter([{"ts": "t", "amount": 1, "item": "a"}] * 3), flush_bytes=1)
+    first = next(chunks)
+    assert first.startswith("\ufeff".encode("utf-8")) and b"amount" in first
+    rows = list(csv.reader(io.StringIO(b"".join([first, *chunks]).decode("utf-8-sig"))))
+    assert len(rows) == 4 and rows[1][:2] == ["t", "1"]
+
+
+def test_csv_chunks_neutralizes_formulas():
+    records = [{"ts": "t", "amount": -5, "item": '=HYPERLINK("http://x")', "raw_text": "+1", "user_id": "@u", "category": "-"}]
+    rows = list(csv.reader(io.StringIO(b"".join(csv_chunks(records)).decode("utf-8-sig"))))
+    assert rows[1] == ["t", "-5", "'-", "'=HYPERLINK(\"http://x\")", "", "'@u", "'+1"]
+
+
+def test_iter_records_empty_sheet_reads_once(repo, sheets, stats):
+    assert list(repo.iter_records("G1", "2026-02-01 00:00:00", "2026-03-01 00:00:00", page_rows=2)) == []
+    assert stats.snapshot()["records.get"] == 1
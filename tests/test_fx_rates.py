@@ -0,0 +1,93 @@
+import os
+import threading
+import time
+
+import pytest
+
+from fx_rates import FxService, RateTable, fx_reply, parse_fx_command
+
+
+@pytest.fixture
+def table():
+    return RateTable(
+        {"USD": (31.5, 32.1, 31.8, 31.9), "THB": (0.85, 1.0, None, None)},
+        {"USD": "美金", "THB": "泰幣"},
+        quoted_at="2026/02/01 16:00",
+    )
+
+
+def test_resolve_codes_and_names(table):
+    assert table.resolve("usd") == "USD"
+    assert table.resolve("美金") == "USD"
+    assert table.resolve("美元") == "USD"
+    assert table.resolve("泰幣") == "THB"
+    assert table.resolve("台幣") == "TWD"
+    assert table.resolve("XYZ") is None
+
+
+def test_alias_missing_from_table(table):
+    assert table.resolve("日幣") is None
+    assert fx_reply(table, parse_fx_command("匯率 日幣")) == "查無幣別：日幣"
+    assert fx_reply(table, parse_fx_command("匯率 日幣 USD 100")) == "查無幣別：日幣"
+
+
+def test_parse_fx_command():
+    assert parse_fx_command("匯率") == {"type": "overview"}
+    assert parse_fx_command("匯率 USD") == {"type": "rate", "currencies": ["USD"]}
+    assert parse_fx_command("匯率 USD 1,000") == {"type": "convert", "currencies": ["USD"], "amount": 1000.0}
+    assert parse_fx_command("匯率 USD/JPY") == {"type": "convert", "currencies": ["USD", "JPY"], "amount": 1.0}
+    assert parse_fx_command("匯率 A B C")["type"] == "error"
+
+
+def test_convert_falls_back_to_cash(table):
+    # THB 沒有即期，用現金價
+    assert table.convert(100, "THB", "TWD") == pytest.approx(85.0)
+    assert table.convert(100, "USD", "THB") == pytest.approx(100 * 31.8 / 1.0)
+    assert "≈" in fx_reply(table, parse_fx_command("匯率 USD 100"))
+
+
+# =========================
+# 背景更新
+# =========================
+class FakeSource:
+    def __init__(self, table):
+        self.table = table
+        self.release = threading.Event()
+        self.calls = 0
+
+    def fetch(self):
+        self.calls += 1
+        self.release.wait(5)
+        return self.table
+
+
+def test_service_starts_on_first_get(table):
+    src = FakeSource(table)
+    svc = FxService(source=src, ttl=3600)
+    assert svc._pid is None and src.calls == 0
+    # 還沒抓到：不等，回 None 並叫醒背景 thread
+    assert svc.get() is None
+    src.release.set()
+    for _ in range(500):
+        if svc.get() is not None:
+            break
+        time.sleep(0.01)
+    assert svc.get() is table
+    assert src.calls == 1
+
+
+def test_app_import_does_not_start_fx():
+    import app
+
+    assert app.fx_service._pid is None
+
+
+def test_stale_table_served_while_refreshing(table):
+    svc = FxService(source=FakeSource(table), ttl=10, max_stale=100)
+    svc._pid = os.getpid()  # 不開背景 thread
+    table.fetched_at = time.time() - 50
+    svc.set(table)
+    assert svc.get() is table
+    assert svc._wake.is_set()
+    table.fetched_at = time.time() - 200
+    assert svc.get() is None
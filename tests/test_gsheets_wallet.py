@@ -0,0 +1,46 @@
+from gsheets_repo import LedgerRepo
+
+
+def _repo(sheets, **kw):
+    return LedgerRepo.from_worksheets(sheets["records"], sheets["groups"], sheets["wallet"], wallet_ttl=60, **kw)
+
+
+def test_deposit_reads_current_cell(sheets):
+    sheets["wallet"].rows.append(["G1", "500", "", ""])
+    repo = _repo(sheets)
+    assert repo.get_balance("G1") == 500
+
+    # 快取還沒過期，但 sheet 上的值被手動改了
+    sheets["wallet"].rows[1][1] = "1000"
+    assert repo.deposit("G1", 100, "u") == 1100
+    assert sheets["wallet"].rows[1][1] == "1100"
+
+
+def test_two_workers_do_not_lose_updates(sheets):
+    sheets["wallet"].rows.append(["G1", "0", "", ""])
+    a, b = _repo(sheets), _repo(sheets)
+    a.get_balance("G1")
+    b.get_balance("G1")
+    a.deposit("G1", 100, "u")
+    b.deduct("G1", 30, "u")
+    assert sheets["wallet"].rows[1][1] == "70"
+
+
+def test_new_group_appends_row(sheets):
+    repo = _repo(sheets)
+    assert repo.deduct("G2", 40, "u") == -40
+    assert sheets["wallet"].rows[1][:2] == ["G2", "-40"]
+
+
+def test_add_expenses_is_one_append_and_one_wallet_write(sheets, stats):
+    sheets["wallet"].rows.append(["G1", "1000", "", ""])
+    repo = _repo(sheets)
+    # 第一次寫會補 entry_id header；之後才是熱的
+    repo.add_expenses("G1", "u", [{"amount": 0, "category": "其他", "item": "暖機"}], ts="2026-02-01 00:00:00")
+    before = stats.snapshot()
+    entries = [{"amount": 100, "category": "餐飲", "item": "午餐"}, {"amount": 50, "category": "交通", "item": "公車"}]
+    assert repo.add_expenses("G1", "u", entries, ts="2026-02-01 12:00:00") == 850
+    after = stats.snapshot()
+    calls = {k: after[k] - before.get(k, 0) for k in after if after[k] != before.get(k, 0)}
+    assert calls == {"records.append_rows": 1, "wallet.acell": 1, "wallet.batch_update": 1}
+    assert [r[3] for r in sheets["records"].rows[2:]] == ["午餐", "公車"]
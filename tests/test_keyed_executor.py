@@ -0,0 +1,105 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import keyed_executor
+from keyed_executor import KeyedExecutor, KeyedProxy, KeyedQueueFull
+
+
+@pytest.fixture
+def executor():
+    ex = KeyedExecutor(workers=4, max_pending=3, idle_ttl=300, fair_batch=2)
+    yield ex
+    ex.shutdown()
+
+
+def test_same_key_runs_in_order(executor):
+    out = []
+    futs = [executor.submit("G1", out.append, i) for i in range(3)]
+    for f in futs:
+        f.result(timeout=5)
+    assert out == [0, 1, 2]
+
+
+def test_keys_run_concurrently(executor):
+    gate = threading.Event()
+    blocked = executor.submit("G1", gate.wait, 5)
+    # G1 卡住時 G2 照樣跑得完
+    assert executor.submit("G2", lambda: "ok").result(timeout=5) == "ok"
+    assert not blocked.done()
+    gate.set()
+    assert blocked.result(timeout=5) is True
+
+
+def test_full_queue_raises(executor):
+    gate = threading.Event()
+    started = threading.Event()
+    executor.submit("G1", lambda: started.set() or gate.wait(5))
+    started.wait(5)
+    for _ in range(3):
+        executor.submit("G1", lambda: None)
+    with pytest.raises(KeyedQueueFull):
+        executor.submit("G1", lambda: None)
+    assert executor.stats()["queued"] == 3
+    gate.set()
+
+
+def test_exceptions_reach_the_caller(executor):
+    with pytest.raises(ZeroDivisionError):
+        executor.run("G1", lambda: 1 / 0)
+    # 失敗不影響同一個 key 之後的工作
+    assert executor.run("G1", lambda: 2) == 2
+
+
+def test_reentrant_run_executes_inline(executor):
+    assert executor.run("G1", lambda: executor.run("G1", lambda: "inner")) == "inner"
+
+
+def test_busy_key_yields_to_others():
+    ex = KeyedExecutor(workers=1, max_pending=10, fair_batch=2)
+    order = []
+    gate = threading.Event()
+    ex.submit("G1", gate.wait, 5)
+    futs = [ex.submit("G1", order.append, f"a{i}") for i in range(3)]
+    futs.append(ex.submit("G2", order.append, "b"))
+    gate.set()
+    for f in futs:
+        f.result(timeout=5)
+    ex.shutdown()
+    # 一批 2 個（gate + a0）後讓出 worker
+    assert order.index("b") < order.index("a2")
+
+
+def test_idle_keys_evicted(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(keyed_executor, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    ex = KeyedExecutor(workers=1, idle_ttl=10)
+    ex.run("G1", lambda: None)
+    assert ex.stats()["keys"] == 1
+    now[0] += 61
+    ex.run("G2", lambda: None)
+    assert ex.stats()["keys"] == 1
+    ex.shutdown()
+
+
+class Repo:
+    def __init__(self):
+        self.threads = []
+
+    def add_record(self, group_id, amount):
+        self.threads.append(threading.current_thread().name)
+        return (group_id, amount)
+
+    def query_records(self, group_id):
+        return threading.current_thread().name
+
+
+def test_proxy_routes_only_listed_methods(executor):
+    repo = Repo()
+    proxy = KeyedProxy(repo, executor, ["add_record"])
+    assert proxy.add_record("G1", 10) == ("G1", 10)
+    assert proxy.add_record(group_id="G2", amount=5) == ("G2", 5)
+    assert all(name.startswith("keyed") for name in repo.threads)
+    assert proxy.query_records("G1") == threading.current_thread().name
+    assert proxy.threads is repo.threads
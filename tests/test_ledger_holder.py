@@ -0,0 +1,101 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import app
+from ledger_store import LedgerRepoHolder
+
+
+class FakeRepo:
+    closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_get_waits_for_background_init():
+    gate = threading.Event()
+    repo = FakeRepo()
+
+    def factory():
+        gate.wait(5)
+        return repo
+
+    h = LedgerRepoHolder(factory=factory)
+    assert h.get() is None
+    assert h.state == "initializing"
+    gate.set()
+    assert h.get(timeout=5) is repo
+    assert h.status()["state"] == "ready"
+    h.close()
+    assert repo.closed
+
+
+def test_failed_init_retries_after_interval(monkeypatch):
+    calls = []
+
+    def factory():
+        calls.append(1)
+        raise RuntimeError("boom")
+
+    h = LedgerRepoHolder(factory=factory, retry_interval=3600)
+    assert h.get(timeout=5) is None
+    assert (h.state, h.error) == ("failed", "boom")
+    # 還在 retry_interval 內：不再建
+    assert h.get(timeout=0.05) is None
+    assert len(calls) == 1
+
+    h.retry_interval = 0
+    assert h.get(timeout=5) is None
+    assert len(calls) == 2
+
+
+def test_no_backend_is_disabled():
+    h = LedgerRepoHolder(factory=lambda: None)
+    assert h.get(timeout=5) is None
+    assert h.state == "disabled"
+
+
+def test_rebuilds_after_fork(monkeypatch):
+    repos = []
+    h = LedgerRepoHolder(factory=lambda: repos.append(FakeRepo()) or repos[-1])
+    first = h.get(timeout=5)
+    monkeypatch.setattr("ledger_store.os.getpid", lambda pid=h._pid + 1: pid)
+    second = h.get(timeout=5)
+    assert second is not first and len(repos) == 2
+
+
+# =========================
+# 還沒 ready 時的回覆
+# =========================
+def _event(text):
+    return SimpleNamespace(
+        reply_token="r",
+        message=SimpleNamespace(text=text),
+        source=SimpleNamespace(type="group", group_id="G1", user_id="u"),
+    )
+
+
+@pytest.fixture
+def slow_ledger(monkeypatch):
+    gate = threading.Event()
+    holder = LedgerRepoHolder(factory=lambda: gate.wait(5) and None)
+    monkeypatch.setattr(app, "ledger", holder)
+    monkeypatch.setattr(app, "LEDGER_INIT_WAIT", 0.01)
+    yield holder
+    gate.set()
+
+
+@pytest.mark.parametrize("text", ["餐飲 120 午餐", "查本月", "啟用記帳功能"])
+def test_ledger_text_while_initializing(slow_ledger, text):
+    stat = {"type": "echo"}
+    msgs = app._reply_messages(_event(text), stat)
+    assert [m.text for m in msgs] == ["記帳初始化中，請稍後再試"]
+    assert stat["type"] == "not_ready"
+
+
+def test_other_text_skips_wait(slow_ledger):
+    stat = {"type": "echo"}
+    app._reply_messages(_event("今天天氣不錯"), stat)
+    assert stat["type"] != "not_ready"
@@ -0,0 +1,47 @@
+import os
+import threading
+
+from linebot.v3.messaging import Configuration
+
+import line_client
+from line_client import PooledMessagingClient
+
+
+def _client(**kw):
+    return PooledMessagingClient(Configuration(access_token="t"), **kw)
+
+
+def test_one_api_shared_across_threads():
+    c = _client(pool_maxsize=7)
+    apis = []
+    threads = [threading.Thread(target=lambda: apis.append(c.api)) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert all(a is apis[0] for a in apis)
+    assert c.stats()["clients_created"] == 1
+    assert c.stats()["pool_maxsize"] == 7
+    c.close()
+
+
+def test_rebuilt_after_fork(monkeypatch):
+    c = _client()
+    first = c.api
+    child = os.getpid() + 1
+    monkeypatch.setattr(line_client.os, "getpid", lambda: child)
+    assert c.api is not first
+    assert c.stats()["clients_created"] == 2
+
+
+def test_keepalive_socket_options():
+    assert _client(keepalive=True).configuration.socket_options
+    assert not getattr(_client(keepalive=False).configuration, "socket_options", None)
+
+
+def test_close_then_reopen():
+    c = _client()
+    first = c.api
+    c.close()
+    assert c.stats()["hosts"] == {}
+    assert c.api is not first
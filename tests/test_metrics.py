@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+
+import app
+import metrics
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    # 測試建的指標不要混進全域的 /metrics
+    monkeypatch.setattr(metrics, "_registry", [])
+    monkeypatch.setattr(metrics, "_collectors", [])
+
+
+def test_counter_render(registry):
+    c = metrics.Counter("t_total", "help", ("kind",))
+    c.inc(kind="a")
+    c.inc(2.5, kind='b"x')
+    assert c.value(kind="a") == 1
+    assert metrics.render().splitlines() == [
+        "# HELP t_total help",
+        "# TYPE t_total counter",
+        't_total{kind="a"} 1',
+        't_total{kind="b\\"x"} 2.5',
+    ]
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    h = metrics.Histogram("t_seconds", "help", buckets=(0.1, 1.0))
+    for v in (0.05, 0.1, 0.5, 3.0):
+        h.observe(v)
+    lines = h.render()
+    assert 't_seconds_bucket{le="0.1"} 2' in lines
+    assert 't_seconds_bucket{le="1"} 3' in lines
+    assert 't_seconds_bucket{le="+Inf"} 4' in lines
+    assert "t_seconds_count 4" in lines
+    assert h.count() == 4
+
+
+def test_collector_errors_do_not_break_render(registry):
+    metrics.register_collector(lambda: [("t_depth", "gauge", "help", {("q",): 3}, ("name",))])
+    metrics.register_collector(lambda: 1 / 0)
+    out = metrics.render()
+    assert 't_depth{name="q"} 3' in out
+    assert "# collector error: division by zero" in out
+
+
+class Target:
+    def ping(self, x):
+        return x * 2
+
+    async def aping(self, x):
+        return x + 1
+
+
+def test_instrumented_proxies_record_calls(registry):
+    h = metrics.Histogram("t_call_seconds", "help", ("method", "sheet"))
+    seen = []
+    p = metrics.InstrumentedProxy(Target(), h, on_call=lambda name, dt: seen.append(name), sheet="s")
+    assert p.ping(2) == 4
+    assert asyncio.run(metrics.AsyncInstrumentedProxy(Target(), h, sheet="s").aping(1)) == 2
+    assert h.count(method="ping", sheet="s") == 1
+    assert h.count(method="aping", sheet="s") == 1
+    assert seen == ["ping"]
+
+
+def test_metrics_endpoint():
+    resp = app.app.test_client().get("/metrics")
+    assert resp.status_code == 200
+    assert resp.mimetype == "text/plain"
+    assert "# TYPE linebot_webhook_stage_seconds histogram" in resp.get_data(as_text=True)
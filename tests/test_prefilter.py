@@ -0,0 +1,74 @@
+import base64
+import hashlib
+import hmac
+import json
+
+import pytest
+
+import app
+from webhook_worker import EventPrefilter
+
+
+def _msg(text="hi", msg_type="text", source=None):
+    return {
+        "type": "message",
+        "webhookEventId": f"ev-{text}",
+        "message": {"type": msg_type, "id": "1", "text": text, "quoteToken": "q"},
+        "source": source or {"type": "group", "groupId": "G1", "userId": "u"},
+    }
+
+
+def test_unhandled_event_types_dropped():
+    pf = EventPrefilter(app.handler)
+    assert pf.reason(_msg()) is None
+    assert pf.reason({"type": "follow"}) is None
+    assert pf.reason({"type": "join"}) == "no_handler"
+    assert pf.reason(_msg(msg_type="sticker")) == "no_handler"
+
+
+def test_skip_callback_reason():
+    pf = EventPrefilter(app.handler, skip=lambda ev: "nope" if ev["message"]["text"] == "x" else None)
+    assert [e["message"]["text"] for e in pf.filter([_msg("x"), _msg("y")])] == ["y"]
+
+
+class _Repo:
+    def __init__(self, enabled):
+        self.enabled = enabled
+
+    def peek_group_enabled(self, group_id):
+        return self.enabled
+
+
+@pytest.fixture
+def skip_disabled(monkeypatch):
+    monkeypatch.setattr(app, "WEBHOOK_SKIP_DISABLED_GROUPS", True)
+    yield
+    app.ledger.set(None)
+
+
+@pytest.mark.parametrize("enabled, expected", [(False, "group_disabled"), (True, None), (None, None)])
+def test_skip_disabled_groups(skip_disabled, enabled, expected):
+    app.ledger.set(_Repo(enabled))
+    assert app._skip_raw_event(_msg()) == expected
+
+
+def test_enable_trigger_never_skipped(skip_disabled):
+    app.ledger.set(_Repo(False))
+    assert app._skip_raw_event(_msg(app.ENABLE_TRIGGER)) is None
+    assert app._skip_raw_event(_msg(source={"type": "user", "userId": "u"})) is None
+
+
+def _sign(body: str) -> str:
+    secret = app.channel_secret.encode()
+    return base64.b64encode(hmac.new(secret, body.encode(), hashlib.sha256).digest()).decode()
+
+
+def test_webhook_events_verifies_and_parses():
+    body = json.dumps({"destination": "x", "events": [
+        dict(_msg("hello"), timestamp=0, mode="active", replyToken="r",
+             deliveryContext={"isRedelivery": False}),
+        {"type": "join", "timestamp": 0, "mode": "active", "source": {"type": "group", "groupId": "G1"}},
+    ]})
+    assert app.webhook_events(body, "bad") is None
+    events = app.webhook_events(body, _sign(body))
+    assert [e.message.text for e in events] == ["hello"]
@@ -0,0 +1,110 @@
+import urllib.parse
+from types import SimpleNamespace
+
+import pytest
+
+import app
+import query_cursors
+from gsheets_repo import LedgerRepo
+from query_cursors import CursorCache
+
+
+def _records(n):
+    return [{"ts": f"2026-02-01 10:{i:02d}:00", "category": "餐飲", "amount": i, "item": f"x{i}"} for i in range(n)]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(query_cursors, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+def test_cursor_expires_after_ttl(clock):
+    cache = CursorCache(ttl=60, max_size=10)
+    c = cache.create("G1", "s", "e", None, _records(3))
+    assert cache.get(c.cursor_id, "G1") is c
+    clock[0] += 60
+    assert cache.get(c.cursor_id, "G1") is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_evicted(clock):
+    cache = CursorCache(ttl=600, max_size=2)
+    a = cache.create("G1", "s", "e", None, _records(1))
+    b = cache.create("G1", "s", "e", None, _records(1))
+    cache.get(a.cursor_id, "G1")
+    c = cache.create("G1", "s", "e", None, _records(1))
+    assert cache.get(b.cursor_id, "G1") is None
+    assert cache.get(a.cursor_id, "G1") is a
+    assert cache.get(c.cursor_id, "G1") is c
+
+
+def test_cursor_bound_to_group(clock):
+    cache = CursorCache(ttl=600, max_size=10)
+    c = cache.create("G1", "s", "e", None, _records(1))
+    assert cache.get(c.cursor_id, "G2") is None
+    assert cache.get(c.cursor_id, "G1") is c
+
+
+def test_postback_carries_only_cursor_and_page():
+    cat = "很長的類別" * 40
+    c = CursorCache().create("G1", "2026-02-01 00:00:00", "2026-03-01 00:00:00", cat, _records(1))
+    data = c.postback_data(3)
+    assert dict(urllib.parse.parse_qsl(data)) == {"a": "page", "c": c.cursor_id, "p": "3"}
+    assert len(data) < 300
+
+
+# =========================
+# 查詢 / 下一頁
+# =========================
+def _event(text=None, postback=None, group_id="G1"):
+    return SimpleNamespace(
+        reply_token="r",
+        message=SimpleNamespace(text=text),
+        postback=SimpleNamespace(data=postback),
+        source=SimpleNamespace(type="group", group_id=group_id, user_id="u"),
+    )
+
+
+@pytest.fixture
+def repo(sheets, monkeypatch):
+    monkeypatch.setattr(app, "query_cursors", CursorCache(ttl=600, max_size=10))
+    monkeypatch.setattr(app, "QUERY_PAGE_SIZE", 2)
+    sheets["groups"].rows.append(["G1", "TRUE", "", "u", ""])
+    r = LedgerRepo.from_worksheets(sheets["records"], sheets["groups"], sheets["wallet"])
+    app.ledger.set(r)
+    yield r
+    app.ledger.set(None)
+
+
+def _add(repo, n):
+    for i in range(n):
+        repo.add_record("G1", "u", "x", f"x{i}", 10 + i, "餐飲", ts=f"2026-02-01 10:0{i}:00")
+
+
+def test_single_page_needs_no_cursor(repo):
+    _add(repo, 2)
+    msgs = app._reply_messages(_event("查 2026-02-01"), {"type": "echo"})
+    assert msgs[0].text.splitlines()[0] == "共 2 筆，合計 21 元"
+    assert msgs[0].quick_reply is None
+    assert len(app.query_cursors) == 0
+
+
+def test_next_page_from_cursor(repo):
+    _add(repo, 3)
+    msgs = app._reply_messages(_event("查 2026-02-01"), {"type": "echo"})
+    assert msgs[0].text.splitlines()[0] == "共 3 筆，合計 33 元（第 1/2 頁）"
+    data = msgs[0].quick_reply.items[0].action.data
+    assert len(app.query_cursors) == 1
+
+    page = app._reply_postback(_event(postback=data))
+    assert page[0].text.splitlines() == ["第 2/2 頁（共 3 筆）", "- 2026-02-01 10:00:00 餐飲 10 x0"]
+    assert page[0].quick_reply is None
+    # 別的群組拿同一個 postback
+    assert app._reply_postback(_event(postback=data, group_id="G2"))[0].text == "查詢結果已過期，請重新查詢"
+
+
+def test_expired_cursor_asks_to_query_again(repo):
+    msgs = app._reply_postback(_event(postback="a=page&c=missing&p=1"))
+    assert msgs[0].text == "查詢結果已過期，請重新查詢"
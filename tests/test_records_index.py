@@ -0,0 +1,199 @@
+import threading
+
+import pytest
+
+from gsheets_repo import LedgerRepo
+from records_index import RecordsIndex, ts_to_epoch
+
+
+def _rec(ts, amount, category="餐飲", item="x", group_id="G1"):
+    return {"ts": ts, "amount": amount, "category": category, "item": item, "group_id": group_id}
+
+
+@pytest.mark.parametrize("ts", ["2026-02-01 09:05:00", "2026/2/1 9:05:00", "2026-2-1 9:05", "2026-02-01T09:05:00"])
+def test_ts_to_epoch_loose_formats(ts):
+    assert ts_to_epoch(ts) == ts_to_epoch("2026-02-01 09:05:00")
+
+
+@pytest.mark.parametrize("ts", ["", "昨天", "2026-13-01 00:00:00"])
+def test_ts_to_epoch_rejects_garbage(ts):
+    assert ts_to_epoch(ts) is None
+
+
+def test_query_newest_first_with_bounds_and_limit():
+    idx = RecordsIndex()
+    for i, day in enumerate(["2026-01-31", "2026-02-01", "2026-02-14", "2026-03-01"]):
+        idx.add(_rec(f"{day} 00:00:00", 10 * (i + 1), item=day))
+    idx.add(_rec("2026-02-10 12:00:00", 99, category="交通", item="bus"))
+    idx.add(_rec("2026-02-10 12:00:00", 5, group_id="G2"))
+
+    rows = idx.query("G1", "2026-02-01 00:00:00", "2026-03-01 00:00:00")
+    assert [r["item"] for r in rows] == ["2026-02-14", "bus", "2026-02-01"]
+    assert [r["item"] for r in idx.query("G1", "2026-02-01 00:00:00", "2026-03-01 00:00:00", limit=1)] == ["2026-02-14"]
+    assert [r["item"] for r in idx.query("G1", "2026-02-01 00:00:00", "2026-03-01 00:00:00", category="交通")] == ["bus"]
+    assert idx.query("G1", "2026-02-01 00:00:00", "2026-03-01 00:00:00", category="沒有") == []
+    assert idx.query("G9", "2026-02-01 00:00:00", "2026-03-01 00:00:00") == []
+    assert idx.aggregate("G1", "2026-02-01 00:00:00", "2026-03-01 00:00:00") == {"餐飲": [50, 2], "交通": [99, 1]}
+
+
+def test_rows_already_seen_are_not_added_twice():
+    idx = RecordsIndex()
+    # add_record 先寫進來的第 3 列（第 2 列還沒讀到）
+    assert idx.add(_rec("2026-02-02 00:00:00", 20), sheet_row=3)
+    assert idx.synced_rows == 1
+    added = idx.ingest(2, [
+        ["2026-02-01 00:00:00", "10", "餐飲", "a", "TWD", "u", "", "G1"],
+        ["2026-02-02 00:00:00", "20", "餐飲", "b", "TWD", "u", "", "G1"],
+    ])
+    assert added == 1
+    assert idx.synced_rows == 3
+    assert len(idx) == 2
+
+
+def test_repo_syncs_only_new_rows(sheets, stats):
+    ws = sheets["records"]
+    ws.rows.append(["2026-02-01 10:00:00", "10", "餐飲", "a", "TWD", "u", "", "G1"])
+    repo = LedgerRepo.from_worksheets(ws, sheets["groups"], sheets["wallet"], records_sync_interval=0)
+    assert len(repo.query_records("G1", "2026-02-01 00:00:00", "2026-03-01 00:00:00")) == 1
+
+    # 別的 worker 寫的列
+    ws.rows.append(["2026-02-02 10:00:00", "20", "餐飲", "b", "TWD", "u", "", "G1"])
+    rows = repo.query_records("G1", "2026-02-01 00:00:00", "2026-03-01 00:00:00")
+    assert [r["item"] for r in rows] == ["b", "a"]
+    assert repo.summary_by_category("G1", "2026-02-01 00:00:00", "2026-03-01 00:00:00")["total_amount"] == 30
+
+
+def test_own_writes_visible_without_resync(sheets):
+    repo = LedgerRepo.from_worksheets(sheets["records"], sheets["groups"], sheets["wallet"], records_sync_interval=3600)
+    repo.query_records("G1", "2026-02-01 00:00:00", "2026-03-01 00:00:00")
+    repo.add_record("G1", "u", "餐飲 10 a", "a", 10, "餐飲", ts="2026-02-03 10:00:00")
+    assert [r["item"] for r in repo.query_records("G1", "2026-02-01 00:00:00", "2026-03-01 00:00:00")] == ["a"]
+    # 下一次同步不會再收一次
+    repo.sync_records(force=True)
+    assert len(repo.query_records("G1", "2026-02-01 00:00:00", "2026-03-01 00:00:00")) == 1
+
+
+# =========================
+# 欄式 index / 只抓查詢用的欄
+# =========================
+def test_column_ranges_merge_adjacent_columns():
+    from gsheets_repo import _column_ranges
+    from records_index import INDEX_COLUMNS, RECORD_COLUMNS
+
+    assert _column_ranges(RECORD_COLUMNS, INDEX_COLUMNS, 12) == (
+        ["A12:D", "H12:H"], [4, 1], ["ts", "amount", "category", "item", "group_id"],
+    )
+    header = ["group_id", "ts", "user_id", "amount", "category", "item"]
+    assert _column_ranges(header, INDEX_COLUMNS, 2) == (
+        ["A2:B", "D2:F"], [2, 3], ["group_id", "ts", "amount", "category", "item"],
+    )
+
+
+def test_ingest_with_column_subset():
+    idx = RecordsIndex()
+    added = idx.ingest(2, [
+        ["G1", "2026-02-01 10:00:00", "10", "餐飲", "a"],
+        ["", "", "", "", ""],
+        ["G1", "2026-02-02 10:00:00", "20"],
+    ], columns=["group_id", "ts", "amount", "category", "item"])
+    assert added == 2
+    assert idx.synced_rows == 4
+    assert idx.query("G1", "2026-02-01 00:00:00", "2026-03-01 00:00:00") == [
+        {"ts": "2026-02-02 10:00:00", "amount": 20, "category": "", "item": "", "group_id": "G1"},
+        {"ts": "2026-02-01 10:00:00", "amount": 10, "category": "餐飲", "item": "a", "group_id": "G1"},
+    ]
+
+
+def test_aggregate_partial_day():
+    idx = RecordsIndex()
+    for hour, amount in ((8, 10), (12, 20), (20, 40)):
+        idx.add(_rec(f"2026-02-01 {hour:02d}:00:00", amount))
+    idx.add(_rec("2026-02-01 12:30:00", 5, category="交通"))
+    assert idx.aggregate("G1", "2026-02-01 09:00:00", "2026-02-01 21:00:00") == {"餐飲": [60, 2], "交通": [5, 1]}
+
+
+def test_sync_reads_only_index_columns(sheets, stats):
+    ws = sheets["records"]
+    ws.rows.append(["2026-02-01 10:00:00", "10", "餐飲", "a", "TWD", "u", "餐飲 10 a", "G1"])
+    # API 不回傳尾端的空格：這列只有 ts / amount
+    ws.rows.append(["2026-02-02 10:00:00", "20"])
+    ranges = []
+    batch_get = ws.batch_get
+    ws.batch_get = lambda rs, **kw: ranges.append(rs) or batch_get(rs, **kw)
+
+    repo = LedgerRepo.from_worksheets(ws, sheets["groups"], sheets["wallet"], records_sync_interval=0)
+    rows = repo.query_records("G1", "2026-02-01 00:00:00", "2026-03-01 00:00:00")
+    assert [r["item"] for r in rows] == ["a"]
+    assert set(rows[0]) == {"ts", "amount", "category", "item", "group_id"}
+    assert ranges == [["A2:D", "H2:H"]]
+    assert stats.snapshot()["records.get_all_values"] == 0
+
+    ws.rows.append(["2026-02-03 10:00:00", "30", "餐飲", "c", "TWD", "u", "", "G1"])
+    repo.query_records("G1", "2026-02-01 00:00:00", "2026-03-01 00:00:00")
+    assert ranges[-1] == ["A4:D", "H4:H"]
+
+
+# =========================
+# 同步不在 _records_lock 裡讀 sheet
+# =========================
+def test_sync_reads_without_records_lock(sheets):
+    ws = sheets["records"]
+    ws.rows.append(["2026-02-01 10:00:00", "10", "餐飲", "a", "TWD", "u", "", "G1"])
+    repo = LedgerRepo.from_worksheets(ws, sheets["groups"], sheets["wallet"], records_sync_interval=0)
+    lock_free = []
+    batch_get = ws.batch_get
+
+    def checking_batch_get(ranges, **kw):
+        # 讀的時候（可能在退避）別的 thread 要拿得到 _records_lock
+        def probe():
+            got = repo._records_lock.acquire(timeout=1)
+            if got:
+                repo._records_lock.release()
+            lock_free.append(got)
+
+        t = threading.Thread(target=probe)
+        t.start()
+        t.join()
+        return batch_get(ranges, **kw)
+
+    ws.batch_get = checking_batch_get
+    assert len(repo.query_records("G1", "2026-02-01 00:00:00", "2026-03-01 00:00:00")) == 1
+    assert lock_free == [True]
+
+
+def test_query_skips_ingest_while_flush_holds_lock(sheets):
+    ws = sheets["records"]
+    ws.rows.append(["2026-02-01 10:00:00", "10", "餐飲", "a", "TWD", "u", "", "G1"])
+    repo = LedgerRepo.from_worksheets(ws, sheets["groups"], sheets["wallet"], records_sync_interval=0)
+    repo.query_records("G1", "2026-02-01 00:00:00", "2026-03-01 00:00:00")
+    ws.rows.append(["2026-02-02 10:00:00", "20", "餐飲", "b", "TWD", "u", "", "G1"])
+
+    held, release = threading.Event(), threading.Event()
+
+    def flush_in_backoff():
+        with repo._records_lock:
+            held.set()
+            release.wait(5)
+
+    t = threading.Thread(target=flush_in_backoff)
+    t.start()
+    held.wait(5)
+    try:
+        # 不會卡住：先回現有的 index
+        rows = repo.query_records("G1", "2026-02-01 00:00:00", "2026-03-01 00:00:00")
+        assert [r["item"] for r in rows] == ["a"]
+    finally:
+        release.set()
+        t.join()
+    rows = repo.query_records("G1", "2026-02-01 00:00:00", "2026-03-01 00:00:00")
+    assert [r["item"] for r in rows] == ["b", "a"]
+
+
+def test_rebuild_rollups_reloads_index(sheets):
+    ws = sheets["records"]
+    ws.rows.append(["2026-02-01 10:00:00", "10", "餐飲", "a", "TWD", "u", "", "G1"])
+    repo = LedgerRepo.from_worksheets(ws, sheets["groups"], sheets["wallet"], records_sync_interval=3600)
+    repo.query_records("G1", "2026-02-01 00:00:00", "2026-03-01 00:00:00")
+    ws.rows.append(["2026-02-02 10:00:00", "20", "餐飲", "b", "TWD", "u", "", "G1"])
+    repo.rebuild_rollups()
+    assert repo.summary_by_category("G1", "2026-02-01 00:00:00", "2026-03-01 00:00:00")["total_amount"] == 30
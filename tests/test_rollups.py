@@ -0,0 +1,85 @@
+import pytest
+
+from gsheets_repo import LedgerRepo
+from rollups import UNCATEGORIZED, RollupTable, build_summary, split_range
+from sqlite_repo import SQLiteLedgerRepo
+
+
+def test_split_range_uses_month_cells_for_whole_months():
+    assert split_range("2026-01-30 00:00:00", "2026-03-02 00:00:00") == (
+        ["2026-01-30", "2026-01-31", "2026-03-01"], ["2026-02"],
+    )
+    assert split_range("2026-02-01 00:00:00", "2026-02-02 00:00:00") == (["2026-02-01"], [])
+    assert split_range("2025-12-01", "2026-02-01") == ([], ["2025-12", "2026-01"])
+    assert split_range("2026-02-01 00:00:00", "2026-02-01 00:00:00") == ([], [])
+
+
+@pytest.mark.parametrize("start, end", [
+    ("2026-02-01 08:00:00", "2026-02-02 00:00:00"),
+    ("2026-02-01 00:00:00", "2026-02-02 12:30:00"),
+    ("昨天", "2026-02-02 00:00:00"),
+])
+def test_split_range_rejects_partial_days(start, end):
+    assert split_range(start, end) is None
+
+
+def test_rollup_collect_matches_raw_sum():
+    t = RollupTable()
+    t.add("G1", "2026-01-31 23:59:59", "餐飲", 10)
+    t.add("G1", "2026-02-01 00:00:00", "餐飲", 20)
+    t.add("G1", "2026-02-28 12:00:00", "", 30)
+    t.add("G1", "2026-03-01 00:00:00", "餐飲", 40)
+    t.add("G2", "2026-02-10 00:00:00", "餐飲", 50)
+    assert t.collect("G1", "2026-02-01 00:00:00", "2026-03-01 00:00:00") == {"餐飲": [20, 1], UNCATEGORIZED: [30, 1]}
+    assert t.collect("G1", "2026-01-31 00:00:00", "2026-03-02 00:00:00") == {"餐飲": [70, 3], UNCATEGORIZED: [30, 1]}
+    assert t.collect("G1", "2026-02-01 10:00:00", "2026-03-01 00:00:00") is None
+
+
+def test_build_summary_orders_and_filters():
+    s = build_summary({"餐飲": [100, 2], "交通": [300, 1], "空": [0, 0]})
+    assert list(s["by_category"]) == ["交通", "餐飲"]
+    assert (s["total_amount"], s["total_count"]) == (400, 3)
+    assert build_summary({"餐飲": [100, 2], "交通": [300, 1]}, category="餐飲")["total_amount"] == 100
+
+
+ROWS = [
+    ("2026-01-31 23:00:00", 10, "餐飲"),
+    ("2026-02-01 09:00:00", 20, "餐飲"),
+    ("2026-02-14 12:00:00", 30, "交通"),
+    ("2026-02-28 23:59:59", 40, ""),
+    ("2026-03-01 00:00:00", 50, "餐飲"),
+]
+
+
+@pytest.fixture(params=["sheets", "sqlite"])
+def store(request, sheets, tmp_path):
+    if request.param == "sheets":
+        repo = LedgerRepo.from_worksheets(sheets["records"], sheets["groups"], sheets["wallet"])
+    else:
+        repo = SQLiteLedgerRepo(str(tmp_path / "ledger.db"))
+    for ts, amount, cat in ROWS:
+        repo.add_record("G1", "u", "", "x", amount, cat, ts=ts)
+    yield repo
+    repo.close()
+
+
+@pytest.mark.parametrize("start, end", [
+    ("2026-02-01 00:00:00", "2026-03-01 00:00:00"),
+    ("2026-01-31 00:00:00", "2026-03-02 00:00:00"),
+    ("2026-02-01 08:00:00", "2026-02-28 23:59:59"),
+])
+def test_summary_from_rollups_matches_records(store, start, end):
+    expected: dict = {}
+    for ts, amount, cat in ROWS:
+        if start <= ts < end:
+            c = expected.setdefault(cat or UNCATEGORIZED, [0, 0])
+            c[0] += amount
+            c[1] += 1
+    assert store.summary_by_category("G1", start, end) == build_summary(expected)
+
+
+def test_rebuild_rollups_keeps_totals(store):
+    before = store.summary_by_category("G1", "2026-01-01 00:00:00", "2026-04-01 00:00:00")
+    store.rebuild_rollups()
+    assert store.summary_by_category("G1", "2026-01-01 00:00:00", "2026-04-01 00:00:00") == before
+    assert before["total_amount"] == 150
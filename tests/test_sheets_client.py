@@ -0,0 +1,94 @@
+import threading
+import time
+
+import pytest
+from gspread.exceptions import APIError
+
+from sheets_client import QuotaProxy, SheetsQuota
+
+
+class _Resp:
+    def __init__(self, code):
+        self.status_code = code
+        self.text = str(code)
+
+    def json(self):
+        return {"error": {"code": self.status_code, "message": f"HTTP {self.status_code}"}}
+
+
+class Flaky:
+    """
+    前 fail 次丟 code，之後成功；記下每個方法被呼叫幾次
+    """
+
+    def __init__(self, code, fail=1):
+        self.code = code
+        self.fail = fail
+        self.calls = {}
+
+    def _hit(self, name):
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.calls[name] <= self.fail:
+            raise APIError(_Resp(self.code))
+        return name
+
+    def get_all_values(self):
+        return self._hit("get_all_values")
+
+    def append_rows(self, rows):
+        return self._hit("append_rows")
+
+    def get_all_records(self):
+        time.sleep(0.05)
+        return self._hit("get_all_records")
+
+
+def _proxy(target):
+    return QuotaProxy(target, SheetsQuota(read_per_min=60000, write_per_min=60000, burst=100, backoff=0))
+
+
+def test_read_retries_5xx():
+    ws = Flaky(503)
+    assert _proxy(ws).get_all_values() == "get_all_values"
+    assert ws.calls["get_all_values"] == 2
+
+
+def test_append_not_retried_on_5xx():
+    ws = Flaky(500)
+    with pytest.raises(APIError):
+        _proxy(ws).append_rows([["x"]])
+    assert ws.calls["append_rows"] == 1
+
+
+def test_append_retried_on_429():
+    ws = Flaky(429, fail=2)
+    assert _proxy(ws).append_rows([["x"]]) == "append_rows"
+    assert ws.calls["append_rows"] == 3
+
+
+def test_other_errors_not_retried():
+    ws = Flaky(400)
+    with pytest.raises(APIError):
+        _proxy(ws).get_all_values()
+    assert ws.calls["get_all_values"] == 1
+
+
+def test_gives_up_after_max_retries():
+    ws = Flaky(429, fail=10)
+    quota = SheetsQuota(read_per_min=60000, write_per_min=60000, burst=100, max_retries=2, backoff=0)
+    with pytest.raises(APIError):
+        QuotaProxy(ws, quota).get_all_values()
+    assert ws.calls["get_all_values"] == 3
+
+
+def test_concurrent_reads_coalesce():
+    ws = Flaky(500, fail=0)
+    p = _proxy(ws)
+    out = []
+    threads = [threading.Thread(target=lambda: out.append(p.get_all_records())) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert out == ["get_all_records"] * 5
+    assert ws.calls["get_all_records"] < 5
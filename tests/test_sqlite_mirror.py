@@ -0,0 +1,114 @@
+import pytest
+
+from gsheets_repo import LedgerRepo
+from records_index import RECORD_COLUMNS
+from sqlite_repo import SheetsMirror, SQLiteLedgerRepo
+
+
+@pytest.fixture
+def sheets_repo(sheets):
+    return LedgerRepo.from_worksheets(sheets["records"], sheets["groups"], sheets["wallet"])
+
+
+def _mirror(repo):
+    # interval 很長：測試自己呼叫 flush，背景 thread 不搶
+    return SheetsMirror(None, interval=3600, repo=repo)
+
+
+def _seed(sheets):
+    sheets["groups"].rows.append(["G1", "TRUE", "2026-01-01 00:00:00", "u", ""])
+    sheets["wallet"].rows.append(["G1", "500", "2026-01-01 00:00:00", "u"])
+    sheets["records"].rows.append(["2026-02-01 10:00:00", "120", "餐飲", "午餐", "TWD", "u", "餐飲 120", "G1"])
+
+
+def test_empty_db_imports_from_sheets(tmp_path, sheets, sheets_repo):
+    _seed(sheets)
+    db = SQLiteLedgerRepo(str(tmp_path / "ledger.db"), mirror=_mirror(sheets_repo))
+    try:
+        assert db.get_group_enabled("G1")
+        assert db.get_balance("G1") == 500
+        rows = db.query_records("G1", "2026-02-01 00:00:00", "2026-03-01 00:00:00")
+        assert [(r["item"], r["amount"]) for r in rows] == [("午餐", 120)]
+        # 匯入的資料不會再鏡像回去
+        assert db.outbox_batch(10) == []
+    finally:
+        db.close()
+    assert len(sheets["records"].rows) == 2
+
+
+def test_import_failure_refuses_to_start(tmp_path, sheets, sheets_repo, monkeypatch):
+    def boom():
+        raise RuntimeError("sheets down")
+
+    monkeypatch.setattr(sheets_repo, "export_state", boom)
+    with pytest.raises(RuntimeError):
+        SQLiteLedgerRepo(str(tmp_path / "ledger.db"), mirror=_mirror(sheets_repo))
+
+
+def test_wallet_mirrors_deltas(tmp_path, sheets, sheets_repo):
+    _seed(sheets)
+    db = SQLiteLedgerRepo(str(tmp_path / "ledger.db"), mirror=_mirror(sheets_repo))
+    db.mirror.notify = lambda: None
+    try:
+        db.deposit("G1", 100, "u")
+        # 有人在 Sheets 上手動改了餘額
+        sheets["wallet"].rows[1][1] = "1000"
+        db.mirror.flush()
+    finally:
+        db.close()
+    assert sheets_repo.get_balance("G1") == 1100
+
+
+def test_outbox_survives_restart(tmp_path, sheets, sheets_repo, monkeypatch):
+    path = str(tmp_path / "ledger.db")
+    db = SQLiteLedgerRepo(path, mirror=_mirror(sheets_repo))
+    db.mirror.flush = lambda: 0  # 模擬還沒鏡像就掛掉
+    db.add_expenses("G1", "u", [{"amount": 50, "category": "餐飲", "item": "早餐"}], ts="2026-02-02 08:00:00")
+    db.enable_group("G1", "u")
+    db.close()
+    assert len(sheets["records"].rows) == 1
+
+    db = SQLiteLedgerRepo(path, mirror=_mirror(sheets_repo))
+    try:
+        # 背景 thread 啟動時就會搬；這裡再 flush 一次確定搬完
+        db.mirror.flush()
+        assert db.outbox_batch(10) == []
+    finally:
+        db.close()
+    assert [r[3] for r in sheets["records"].rows[1:]] == ["早餐"]
+    assert sheets_repo.get_balance("G1") == -50
+    assert sheets_repo.get_group_enabled("G1")
+
+
+def test_replayed_records_not_duplicated(tmp_path, sheets, sheets_repo):
+    path = str(tmp_path / "ledger.db")
+    db = SQLiteLedgerRepo(path, mirror=_mirror(sheets_repo))
+    db.mirror.flush = lambda: 0
+    db.add_record("G1", "u", "餐飲 80", "晚餐", 80, "餐飲", ts="2026-02-02 19:00:00")
+    (_, _, row), = db.outbox_batch(10)
+    db.close()
+    # append_rows 成功但 outbox 還沒刪就掛掉
+    sheets_repo.append_records([row])
+
+    db = SQLiteLedgerRepo(path, mirror=_mirror(sheets_repo))
+    try:
+        db.mirror.flush()
+    finally:
+        db.close()
+    assert len(sheets["records"].rows) == 2
+    assert sheets["records"].rows[0][len(RECORD_COLUMNS)] == "entry_id"
+
+
+def test_live_worker_skips_rows_a_dead_peer_wrote(tmp_path, sheets, sheets_repo):
+    path = str(tmp_path / "ledger.db")
+    db = SQLiteLedgerRepo(path, mirror=_mirror(sheets_repo))
+    db.mirror.notify = lambda: None  # 背景 thread 不動，等測試自己 flush
+    try:
+        db.add_record("G1", "u", "餐飲 80", "晚餐", 80, "餐飲", ts="2026-02-02 19:00:00")
+        # 另一個 worker 已經 append_rows，但還沒 outbox_done 就掛了
+        (_, _, row), = db.outbox_batch(10)
+        sheets_repo.append_records([row])
+        db.mirror.flush()
+    finally:
+        db.close()
+    assert len(sheets["records"].rows) == 2
@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+from user_registry import UserRegistry
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "secrets" / "user_ids.json")
+
+
+def test_add_is_idempotent(path):
+    reg = UserRegistry(path)
+    assert reg.add("U1")
+    assert not reg.add("U1")
+    assert reg.add(" U2 ")
+    assert reg.all() == ["U1", "U2"]
+    with open(path + ".log") as f:
+        assert f.read() == "U1\nU2\n"
+
+
+@pytest.mark.parametrize("user_id", ["", "  ", "U1\nU2"])
+def test_invalid_ids_rejected(path, user_id):
+    with pytest.raises(ValueError):
+        UserRegistry(path).add(user_id)
+
+
+def test_reads_legacy_snapshot(path, tmp_path):
+    (tmp_path / "secrets").mkdir()
+    with open(path, "w") as f:
+        json.dump({"user_ids": ["U1", "U2"]}, f)
+    reg = UserRegistry(path)
+    assert "U2" in reg
+    assert not reg.add("U1")
+    assert len(reg) == 2
+
+
+def test_compaction_rewrites_snapshot(path):
+    reg = UserRegistry(path, compact_lines=3)
+    for uid in ("U1", "U2", "U3"):
+        reg.add(uid)
+    with open(path) as f:
+        assert json.load(f) == {"user_ids": ["U1", "U2", "U3"]}
+    with open(path + ".log") as f:
+        assert f.read() == ""
+    reg.add("U4")
+    assert reg.all() == ["U1", "U2", "U3", "U4"]
+
+
+def test_workers_see_each_other(path):
+    a, b = UserRegistry(path, compact_lines=2), UserRegistry(path, compact_lines=100)
+    a.add("U1")
+    assert "U1" in b
+    b.add("U2")
+    a.add("U3")  # a 壓縮：b 的 offset 失效，要整個重讀
+    assert b.all() == ["U1", "U2", "U3"]
+    b.add("U4")
+    assert a.all() == ["U1", "U2", "U3", "U4"]
+
+
+def test_partial_log_line_ignored(path):
+    reg = UserRegistry(path)
+    reg.add("U1")
+    with open(path + ".log", "a") as f:
+        f.write("U2")  # 別的 worker 寫到一半
+    assert reg.all() == ["U1"]
+    with open(path + ".log", "a") as f:
+        f.write("\n")
+    assert reg.all() == ["U1", "U2"]
@@ -0,0 +1,121 @@
+import subprocess
+import sys
+
+import gspread
+import pytest
+
+from conftest import ROOT
+from fake_gspread import FakeSpreadsheet, FakeWorksheet
+from gsheets_repo import LedgerRepo
+from seed_wallet_events import seed
+from wallet_events import WALLET_EVENT_COLUMNS, EventWallet
+
+
+class _Resp:
+    def __init__(self, message):
+        self.text = message
+        self._message = message
+
+    def json(self):
+        return {"error": {"code": 400, "message": self._message}}
+
+
+class RacingSpreadsheet(FakeSpreadsheet):
+    """
+    add_worksheet 撞名時跟真的 API 一樣丟 APIError（別的 worker 剛建好）
+    """
+
+    def add_worksheet(self, title, rows=1000, cols=26, **kwargs):
+        if title in self._sheets:
+            raise gspread.exceptions.APIError(_Resp(f'A sheet with the name "{title}" already exists.'))
+        return super().add_worksheet(title, rows, cols, **kwargs)
+
+
+@pytest.fixture
+def repo(stats, sheets):
+    events = FakeWorksheet("wallet_events", [list(WALLET_EVENT_COLUMNS)], stats)
+    sheets["wallet"].rows.append(["G1", "1000", "", ""])
+    EventWallet(events, ws_wallet=sheets["wallet"]).seed_from_wallet()
+    return LedgerRepo.from_worksheets(
+        sheets["records"], sheets["groups"], sheets["wallet"], ws_wallet_events=events,
+    ), events
+
+
+def test_wallet_events_has_no_import_cycle():
+    # wallet_events 不能再從 gsheets_repo 拿私有 helper
+    out = subprocess.run([sys.executable, "-c", "import wallet_events"], cwd=ROOT, capture_output=True, text=True)
+    assert out.returncode == 0, out.stderr
+
+
+def test_seed_then_deltas(repo):
+    repo, events = repo
+    assert repo.get_balance("G1") == 1000
+    assert repo.deposit("G1", 500, "u") == 1500
+    assert repo.deduct("G1", 200, "u") == 1300
+    kinds = [r[2] for r in events.rows[1:]]
+    assert kinds == ["set", "deposit", "expense"]
+
+
+def test_replay_matches_live_balance(repo):
+    repo, events = repo
+    for i in range(7):
+        repo.deduct("G1", 10 + i, "u")
+    live = repo.get_balance("G1")
+    repo.rebuild_wallet()
+    assert repo.get_balance("G1") == live == 1000 - sum(10 + i for i in range(7))
+
+
+def test_snapshot_does_not_drop_later_deltas(stats, sheets):
+    events = FakeWorksheet("wallet_events", [list(WALLET_EVENT_COLUMNS)], stats)
+    repo = LedgerRepo.from_worksheets(sheets["records"], sheets["groups"], sheets["wallet"], ws_wallet_events=events)
+    repo._event_wallet.snapshot_every = 3
+    for _ in range(5):
+        repo.deposit("G2", 10, "u")
+    assert "snapshot" in [r[2] for r in events.rows[1:]]
+    # 另一個 process 從頭重播也要得到同樣的餘額
+    repo._event_wallet.rebuild()
+    assert repo.get_balance("G2") == 50
+
+
+def test_add_worksheet_race_reuses_existing(stats, sheets):
+    sh = RacingSpreadsheet(stats, worksheets=list(sheets.values()))
+    existing = FakeWorksheet("wallet_events", [list(WALLET_EVENT_COLUMNS)], stats)
+    sh._sheets["wallet_events"] = existing
+    repo = LedgerRepo.from_worksheets(sheets["records"], sheets["groups"], sheets["wallet"], spreadsheet=sh)
+    ws = repo._add_worksheet("wallet_events", WALLET_EVENT_COLUMNS)
+    assert ws is existing
+    assert existing.rows == [list(WALLET_EVENT_COLUMNS)]
+
+
+def test_add_worksheet_other_api_errors_propagate(stats, sheets):
+    class Broken(FakeSpreadsheet):
+        def add_worksheet(self, title, rows=1000, cols=26, **kwargs):
+            raise gspread.exceptions.APIError(_Resp("quota exceeded"))
+
+    repo = LedgerRepo.from_worksheets(
+        sheets["records"], sheets["groups"], sheets["wallet"], spreadsheet=Broken(stats, worksheets=[]),
+    )
+    with pytest.raises(gspread.exceptions.APIError):
+        repo._add_worksheet("wallet_events", WALLET_EVENT_COLUMNS)
+
+
+def test_unseeded_events_refuse_to_start(stats, sheets):
+    events = FakeWorksheet("wallet_events", [list(WALLET_EVENT_COLUMNS)], stats)
+    sheets["wallet"].rows.append(["G1", "1000", "", ""])
+    with pytest.raises(RuntimeError, match="seed_wallet_events"):
+        LedgerRepo.from_worksheets(sheets["records"], sheets["groups"], sheets["wallet"], ws_wallet_events=events)
+    # 啟動失敗不能順手寫任何事件
+    assert events.rows == [list(WALLET_EVENT_COLUMNS)]
+
+
+def test_seed_script_is_one_shot(spreadsheet, sheets):
+    sheets["wallet"].rows.append(["G1", "1000", "", ""])
+    assert seed(spreadsheet) == 1
+    repo = LedgerRepo.from_worksheets(
+        sheets["records"], sheets["groups"], sheets["wallet"], ws_wallet_events=spreadsheet.worksheet("wallet_events"),
+    )
+    repo.deposit("G1", 5, "u")
+    # 重跑不會再寫一筆 set 把剛剛的存入蓋掉
+    assert seed(spreadsheet) == 0
+    repo.rebuild_wallet()
+    assert repo.get_balance("G1") == 1005
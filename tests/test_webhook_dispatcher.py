@@ -0,0 +1,85 @@
+import threading
+from types import SimpleNamespace
+
+from webhook_worker import EventDispatcher
+
+
+class PingEvent:
+    def __init__(self, n):
+        self.n = n
+        self.timestamp = 0
+
+
+def _handler(fn, default=None):
+    return SimpleNamespace(_handlers={"PingEvent": fn}, _default=default)
+
+
+def test_events_processed_off_the_request_thread():
+    seen = []
+    done = threading.Event()
+
+    def on_ping(ev):
+        seen.append((ev.n, threading.current_thread().name))
+        if len(seen) == 3:
+            done.set()
+
+    d = EventDispatcher(_handler(on_ping), workers=2, queue_size=10)
+    assert all(d.submit(PingEvent(i)) for i in range(3))
+    assert done.wait(5)
+    d.shutdown()
+    assert sorted(n for n, _ in seen) == [0, 1, 2]
+    assert all(name.startswith("webhook-worker-") for _, name in seen)
+    assert d.stats()["processed"] == 3
+
+
+def test_full_queue_runs_inline():
+    gate = threading.Event()
+    started = threading.Event()
+    ran_inline = []
+
+    def on_ping(ev):
+        if ev.n == 0:
+            started.set()
+            gate.wait(5)
+        elif threading.current_thread() is threading.main_thread():
+            ran_inline.append(ev.n)
+
+    d = EventDispatcher(_handler(on_ping), workers=1, queue_size=1)
+    assert d.submit(PingEvent(0))
+    assert started.wait(5)
+    assert d.submit(PingEvent(1))  # 放進 queue（worker 還卡在 0）
+    assert d.submit(PingEvent(2)) is False  # queue 滿 -> 直接處理，不丟
+    gate.set()
+    d.shutdown()
+    assert ran_inline == [2]
+    st = d.stats()
+    assert st["inline"] == 1 and st["processed"] == 3
+
+
+def test_handler_errors_counted_and_worker_survives():
+    def on_ping(ev):
+        if ev.n == 0:
+            raise RuntimeError("boom")
+
+    d = EventDispatcher(_handler(on_ping), workers=1, queue_size=10)
+    d.submit(PingEvent(0))
+    d.submit(PingEvent(1))
+    d.shutdown()
+    assert d.stats()["failed"] == 1 and d.stats()["processed"] == 1
+
+
+def test_after_shutdown_events_run_inline():
+    seen = []
+    d = EventDispatcher(_handler(lambda ev: seen.append(ev.n)), workers=1)
+    d.submit(PingEvent(0))
+    d.shutdown()
+    assert d.submit(PingEvent(1)) is False
+    assert seen == [0, 1]
+
+
+def test_unknown_event_falls_back_to_default():
+    seen = []
+    d = EventDispatcher(SimpleNamespace(_handlers={}, _default=lambda ev: seen.append(ev)), workers=1)
+    d.submit(PingEvent(0))
+    d.shutdown()
+    assert len(seen) == 1
@@ -0,0 +1,80 @@
+import json
+import os
+
+import pytest
+
+from fake_gspread import FakeWorksheet
+from gsheets_repo import LedgerRepo
+from records_index import ENTRY_ID_COLUMN, RECORD_COLUMNS
+from write_behind import RecordWriteBehind, ensure_entry_id_header
+
+
+def _row(i: int, entry_id: str | None = None) -> list:
+    row = [f"2026-02-01 10:00:{i:02d}", 10 + i, "餐飲", f"item{i}", "TWD", "u", f"餐飲 {10 + i}", "G1"]
+    return row + [entry_id] if entry_id else row
+
+
+def _orphan_journal(journal_dir, rows, pid: int = 1) -> None:
+    # 模擬已經結束的 process 留下來的 journal
+    os.makedirs(journal_dir, exist_ok=True)
+    with open(os.path.join(journal_dir, f"records-{pid}.jsonl"), "w", encoding="utf-8") as f:
+        for r in rows:
+            f.write(json.dumps(r, ensure_ascii=False) + "\n")
+
+
+def _buffer(ws, journal_dir):
+    return RecordWriteBehind(ws, journal_dir=str(journal_dir), batch_size=1000, flush_interval=3600)
+
+
+def test_replay_skips_rows_already_written(tmp_path, stats):
+    ws = FakeWorksheet("records", [list(RECORD_COLUMNS) + [ENTRY_ID_COLUMN]], stats)
+    rows = [_row(i, f"e{i}") for i in range(3)]
+    # append_rows 成功了（前兩筆上去了），但 journal 還沒重寫就 crash
+    ws.rows.extend([[str(c) for c in r] for r in rows[:2]])
+    _orphan_journal(tmp_path, rows)
+
+    wb = _buffer(ws, tmp_path)
+    try:
+        assert len(wb.pending()) == 3
+        assert wb.flush() == 1
+        assert [r[-1] for r in ws.rows[1:]] == ["e0", "e1", "e2"]
+        assert wb.pending() == []
+    finally:
+        wb.close()
+
+
+def test_replay_checks_sheet_once(tmp_path, stats):
+    ws = FakeWorksheet("records", [list(RECORD_COLUMNS) + [ENTRY_ID_COLUMN]], stats)
+    _orphan_journal(tmp_path, [_row(0, "e0")])
+    wb = _buffer(ws, tmp_path)
+    try:
+        wb.flush()
+        wb.append(_row(1, "e1"))
+        before = stats.snapshot()["records.get"]
+        wb.flush()
+        # 只有 replay 出來的列要對 sheet；之後新寫的不用再讀 entry_id 欄
+        assert stats.snapshot()["records.get"] == before
+        assert len(ws.rows) == 3
+    finally:
+        wb.close()
+
+
+def test_repo_writes_entry_id_and_header(tmp_path, stats, sheets, monkeypatch):
+    monkeypatch.setenv("LEDGER_JOURNAL_DIR", str(tmp_path))
+    ws = sheets["records"]
+    repo = LedgerRepo.from_worksheets(ws, sheets["groups"], sheets["wallet"], write_behind=True)
+    try:
+        repo.add_record("G1", "u", "餐飲 100 午餐", "午餐", 100, "餐飲", ts="2026-02-01 12:00:00")
+        repo.add_record("G1", "u", "餐飲 80 晚餐", "晚餐", 80, "餐飲", ts="2026-02-01 19:00:00")
+        assert repo.flush_records() == 2
+    finally:
+        repo.close()
+    assert ws.rows[0][len(RECORD_COLUMNS)] == ENTRY_ID_COLUMN
+    ids = [r[len(RECORD_COLUMNS)] for r in ws.rows[1:]]
+    assert len(ids) == 2 and len(set(ids)) == 2 and all(ids)
+
+
+def test_ensure_header_refuses_foreign_column(stats):
+    ws = FakeWorksheet("records", [list(RECORD_COLUMNS) + ["memo"]], stats)
+    with pytest.raises(RuntimeError, match="memo"):
+        ensure_entry_id_header(ws)
@@ -0,0 +1,188 @@
+import fcntl
+import json
+import os
+import threading
+
+
+class UserRegistry:
+    """
+    好友 user id 名單：
+      - 記憶體裡是 dict（當有序 set 用），add / 查有沒有都是 O(1)
+      - 落地分兩個檔：snapshot（原本的 {"user_ids": [...]} JSON）+ append-only log（一行一個 id，寫完 fsync）
+      - log 超過 compact_lines 行就壓回 snapshot：寫暫存檔 + fsync + os.replace，再清空 log
+      - 多個 gunicorn worker 共用：寫 log / 壓縮都拿 log 的 flock；
+        讀的時候只 stat 一下，snapshot 換了（別的 worker 壓縮過）就整個重讀，否則只讀 log 新增的部分
+    """
+
+    def __init__(self, path: str, compact_lines: int | None = None):
+        if compact_lines is None:
+            compact_lines = int(os.getenv("USER_REGISTRY_COMPACT_LINES", "10000"))
+        self.path = path
+        self.log_path = path + ".log"
+        self.compact_lines = max(1, int(compact_lines))
+
+        self._lock = threading.Lock()
+        self._ids: dict[str, None] = {}
+        self._loaded = False
+        self._snapshot_id = None  # (st_ino, st_mtime_ns)
+        self._log_offset = 0
+        self._log_lines = 0
+
+    # =========================
+    # 檔案
+    # =========================
+    def _ensure_dir(self) -> None:
+        d = os.path.dirname(self.path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+
+    def _stat_snapshot(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns)
+
+    def _open_log(self, flags: int) -> int:
+        self._ensure_dir()
+        return os.open(self.log_path, flags | os.O_CREAT, 0o644)
+
+    def _read_snapshot(self) -> list[str]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return list(json.load(f).get("user_ids", []))
+        except FileNotFoundError:
+            return []
+
+    def _read_log(self, fd: int, offset: int) -> tuple[list[str], int]:
+        """
+        從 offset 讀到最後一個完整的換行；回傳 (ids, 新 offset)
+        """
+        os.lseek(fd, offset, os.SEEK_SET)
+        chunks = []
+        while True:
+            b = os.read(fd, 1 << 16)
+            if not b:
+                break
+            chunks.append(b)
+        data = b"".join(chunks)
+        end = data.rfind(b"\n") + 1
+        ids = [line for line in data[:end].decode("utf-8").split("\n") if line]
+        return ids, offset + end
+
+    def _reload(self) -> None:
+        # 呼叫端要持有 self._lock
+        fd = self._open_log(os.O_RDONLY)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            snapshot_id = self._stat_snapshot()
+            ids = dict.fromkeys(self._read_snapshot())
+            log_ids, offset = self._read_log(fd, 0)
+        finally:
+            os.close(fd)
+        ids.update(dict.fromkeys(log_ids))
+        self._ids = ids
+        self._snapshot_id = snapshot_id
+        self._log_offset = offset
+        self._log_lines = len(log_ids)
+        self._loaded = True
+
+    def _refresh(self) -> None:
+        # 呼叫端要持有 self._lock
+        if not self._loaded or self._stat_snapshot() != self._snapshot_id:
+            self._reload()
+            return
+        try:
+            size = os.path.getsize(self.log_path)
+        except FileNotFoundError:
+            size = 0
+        if size < self._log_offset:
+            self._reload()
+        elif size > self._log_offset:
+            fd = self._open_log(os.O_RDONLY)
+            try:
+                new_ids, self._log_offset = self._read_log(fd, self._log_offset)
+            finally:
+                os.close(fd)
+            self._log_lines += len(new_ids)
+            self._ids.update(dict.fromkeys(new_ids))
+
+    # =========================
+    # 對外
+    # =========================
+    def add(self, user_id: str) -> bool:
+        """
+        新的 id 寫進 log 並回 True；已經有了回 False（不碰檔案）
+        """
+        user_id = str(user_id).strip()
+        if not user_id or "\n" in user_id:
+            raise ValueError(f"invalid user id: {user_id!r}")
+
+        with self._lock:
+            if not self._loaded:
+                self._reload()
+            if user_id in self._ids:
+                return False
+
+            fd = self._open_log(os.O_WRONLY | os.O_APPEND)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                os.write(fd, (user_id + "\n").encode("utf-8"))
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+            # 順便把別的 worker 寫的也讀進來（包含剛剛自己那行）
+            self._refresh()
+            self._ids[user_id] = None
+
+            if self._log_lines >= self.compact_lines:
+                self._compact()
+            return True
+
+    def _compact(self) -> None:
+        # 呼叫端要持有 self._lock
+        fd = self._open_log(os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            # 拿到鎖之後重讀一次，別的 worker 可能剛壓縮完或剛寫進新的
+            ids = dict.fromkeys(self._read_snapshot())
+            log_ids, _ = self._read_log(fd, 0)
+            if not log_ids:
+                return
+            ids.update(dict.fromkeys(log_ids))
+
+            tmp = f"{self.path}.tmp.{os.getpid()}"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"user_ids": list(ids)}, f, ensure_ascii=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            os.ftruncate(fd, 0)
+            os.fsync(fd)
+
+            self._ids = ids
+            self._snapshot_id = self._stat_snapshot()
+            self._log_offset = 0
+            self._log_lines = 0
+        finally:
+            os.close(fd)
+
+    def compact(self) -> None:
+        with self._lock:
+            self._compact()
+
+    def all(self) -> list[str]:
+        with self._lock:
+            self._refresh()
+            return list(self._ids)
+
+    def __contains__(self, user_id: str) -> bool:
+        with self._lock:
+            self._refresh()
+            return str(user_id) in self._ids
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return len(self._ids)
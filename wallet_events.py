@@ -0,0 +1,257 @@
+import os
+import threading
+import time
+from datetime import datetime
+
+import metrics
+from sheets_client import wrap_worksheet
+from sheets_util import col_letter, to_int, updated_rows
+
+
+WALLET_EVENT_COLUMNS = ["ts", "group_id", "kind", "amount", "actor", "as_of_row"]
+
+# kind：deposit / expense 是異動（amount 一律正數），set / snapshot 是「到 as_of_row 為止」的餘額
+DELTA_KINDS = {"deposit": 1, "expense": -1}
+BALANCE_KINDS = ("set", "snapshot")
+
+
+class _GroupBalance:
+    __slots__ = ("balance", "snap_as_of", "tail")
+
+    def __init__(self):
+        self.balance = 0
+        self.snap_as_of = 0  # 目前採用的 snapshot 涵蓋到哪一列
+        self.tail: list[tuple[int, int]] = []  # snapshot 之後的 (列號, 異動)
+
+
+class EventWallet:
+    """
+    事件式儲存金（LEDGER_WALLET_MODE=events）：
+      - wallet_events 分頁只 append：存入 / 記帳各一列，不再改 wallet 的格子
+      - 每個群組每 snapshot_every 筆異動補一列 snapshot（餘額 + 涵蓋到的列號 as_of_row）
+      - 餘額 = 最新 snapshot + 之後的異動，在記憶體維護，get_balance 不打 API
+      - 多個 worker 一起寫：snapshot 只涵蓋 as_of_row 以前的列，比它新的異動照樣加上去，不會被蓋掉
+      - 增量同步跟 RecordsIndex 一樣：synced_rows 之後的列每 sync_interval 秒抓一次；自己寫的列直接套用
+      - balance_at(group_id, ts)：整張重播到指定時間點，用來對帳
+      - wallet 分頁變成顯示用：做 snapshot 時順便把餘額寫回去
+    """
+
+    def __init__(self, ws_events, ws_wallet=None, snapshot_every: int | None = None, sync_interval: float | None = None):
+        if snapshot_every is None:
+            snapshot_every = int(os.getenv("LEDGER_WALLET_SNAPSHOT_EVERY", "50"))
+        if sync_interval is None:
+            sync_interval = float(os.getenv("LEDGER_WALLET_SYNC_INTERVAL", "10"))
+
+        self.ws_events = wrap_worksheet(ws_events, "wallet_events")
+        self.ws_wallet = ws_wallet
+        self.snapshot_every = max(1, int(snapshot_every))
+        self.sync_interval = sync_interval
+
+        self._lock = threading.RLock()
+        self._reset()
+        self._display_rows: dict[str, int] | None = None
+
+    def _reset(self) -> None:
+        self._groups: dict[str, _GroupBalance] = {}
+        self._ahead: set[int] = set()
+        self.synced_rows = 1
+        self._synced_at: float | None = None
+
+    # =========================
+    # 套用事件
+    # =========================
+    @staticmethod
+    def _apply_to(groups: dict[str, _GroupBalance], sheet_row: int, values: list) -> None:
+        v = list(values) + [""] * (len(WALLET_EVENT_COLUMNS) - len(values))
+        gid, kind, amount = str(v[1]).strip(), str(v[2]).strip(), to_int(v[3])
+        if not gid:
+            return
+        g = groups.get(gid)
+        if g is None:
+            g = groups[gid] = _GroupBalance()
+
+        if kind in BALANCE_KINDS:
+            # set 沒寫 as_of_row = 就是它自己那一列
+            as_of = to_int(v[5]) or sheet_row
+            if as_of <= g.snap_as_of:
+                return
+            g.tail = [(r, d) for r, d in g.tail if r > as_of]
+            g.snap_as_of = as_of
+            g.balance = amount + sum(d for _, d in g.tail)
+        elif kind in DELTA_KINDS:
+            if sheet_row <= g.snap_as_of:
+                return
+            delta = DELTA_KINDS[kind] * amount
+            g.tail.append((sheet_row, delta))
+            g.balance += delta
+
+    def _apply(self, sheet_row: int, values: list) -> None:
+        # 呼叫端要持有 self._lock；用列號去重（跟 RecordsIndex 一樣：水位 + 超前的列）
+        if sheet_row <= self.synced_rows or sheet_row in self._ahead:
+            return
+        if sheet_row == self.synced_rows + 1:
+            self.synced_rows = sheet_row
+            while self.synced_rows + 1 in self._ahead:
+                self.synced_rows += 1
+                self._ahead.discard(self.synced_rows)
+        else:
+            self._ahead.add(sheet_row)
+        self._apply_to(self._groups, sheet_row, values)
+
+    def sync(self, force: bool = False) -> None:
+        with self._lock:
+            if (
+                not force
+                and self._synced_at is not None
+                and time.monotonic() - self._synced_at < self.sync_interval
+            ):
+                metrics.cache_hit("wallet_events", True)
+                return
+            metrics.cache_hit("wallet_events", False)
+
+            start = self.synced_rows + 1
+            values = self.ws_events.get(f"A{start}:{col_letter(len(WALLET_EVENT_COLUMNS))}")
+            for offset, v in enumerate(values):
+                if any(str(c).strip() for c in v):
+                    self._apply(start + offset, v)
+            # 空列也算讀過
+            if values:
+                self.synced_rows = max(self.synced_rows, start + len(values) - 1)
+                self._ahead = {r for r in self._ahead if r > self.synced_rows}
+            self._synced_at = time.monotonic()
+
+    def rebuild(self) -> None:
+        """
+        丟掉記憶體狀態，整張重讀
+        """
+        with self._lock:
+            self._reset()
+            self.sync(force=True)
+
+    # =========================
+    # 寫入（只 append）
+    # =========================
+    def _append(self, group_id: str, kind: str, amount: int, actor_user_id: str, as_of_row: int | str = "") -> None:
+        # 寫 sheet 時不持有 self._lock，不同群組可以同時寫；同一群組靠 KeyedProxy 依序
+        now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        row = [now, str(group_id), kind, int(amount), actor_user_id, as_of_row]
+        resp = self.ws_events.append_row(row, value_input_option="USER_ENTERED")
+        written = updated_rows(resp)
+        if written:
+            with self._lock:
+                self._apply(written[0], row)
+        else:
+            # 拿不到列號 -> 馬上整段同步一次
+            self.sync(force=True)
+
+    def _maybe_snapshot(self, group_id: str) -> None:
+        gid = str(group_id)
+        with self._lock:
+            g = self._groups.get(gid)
+            if g is None or len(g.tail) < self.snapshot_every:
+                return
+            # 只把水位以內的列算進 snapshot；超前的（自己剛寫、中間還有別人的列沒讀到）留給之後
+            self.sync(force=True)
+            covered = self.synced_rows
+            balance = g.balance - sum(d for r, d in g.tail if r > covered)
+        self._append(gid, "snapshot", balance, "system", covered)
+        self._display(gid, self.get_balance(gid))
+
+    def _display(self, group_id: str, balance: int) -> None:
+        # 失敗不影響記帳
+        if self.ws_wallet is None:
+            return
+        now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        try:
+            if self._display_rows is None:
+                values = self.ws_wallet.get_all_values()
+                rows: dict[str, int] = {}
+                for i, row in enumerate(values[1:], start=2):
+                    if row and str(row[0]).strip():
+                        rows.setdefault(str(row[0]).strip(), i)
+                self._display_rows = rows
+            row_idx = self._display_rows.get(group_id)
+            if row_idx:
+                self.ws_wallet.batch_update(
+                    [{"range": f"B{row_idx}:D{row_idx}", "values": [[str(balance), now, "snapshot"]]}],
+                    value_input_option="USER_ENTERED",
+                )
+            else:
+                resp = self.ws_wallet.append_row([group_id, balance, now, "snapshot"], value_input_option="USER_ENTERED")
+                written = updated_rows(resp)
+                if written:
+                    self._display_rows[group_id] = written[0]
+        except Exception as e:
+            print(f"[wallet] display update error: {e}")
+
+    def _record(self, group_id: str, kind: str, amount: int, actor_user_id: str) -> int:
+        self.sync()
+        self._append(group_id, kind, amount, actor_user_id)
+        self._maybe_snapshot(group_id)
+        with self._lock:
+            g = self._groups.get(str(group_id))
+            return g.balance if g else 0
+
+    def deposit(self, group_id: str, amount: int, actor_user_id: str) -> int:
+        return self._record(group_id, "deposit", int(amount), actor_user_id)
+
+    def deduct(self, group_id: str, amount: int, actor_user_id: str) -> int:
+        return self._record(group_id, "expense", int(amount), actor_user_id)
+
+    def set_balance(self, group_id: str, balance: int, actor_user_id: str) -> int:
+        return self._record(group_id, "set", int(balance), actor_user_id)
+
+    # =========================
+    # 查詢
+    # =========================
+    def get_balance(self, group_id: str) -> int:
+        with self._lock:
+            self.sync()
+            g = self._groups.get(str(group_id))
+            return g.balance if g else 0
+
+    def balance_at(self, group_id: str, ts: str) -> int:
+        """
+        重播 ts 之前（不含）的事件，回傳當時的餘額（對帳用，會整張讀一次）
+        """
+        values = self.ws_events.get_all_values()
+        groups: dict[str, _GroupBalance] = {}
+        for i, v in enumerate(values[1:], start=2):
+            if v and str(v[0]) < ts and len(v) > 1 and str(v[1]).strip() == str(group_id):
+                self._apply_to(groups, i, v)
+        g = groups.get(str(group_id))
+        return g.balance if g else 0
+
+    # =========================
+    # 從舊的 wallet 分頁搬過來
+    # =========================
+    def needs_seed(self) -> bool:
+        """
+        wallet_events 還是空的，但 wallet 分頁已經有餘額 -> 要先跑 seed_wallet_events.py 搬過來
+        """
+        if self.ws_wallet is None or len(self.ws_events.row_values(2)) > 0:
+            return False
+        return any(row and str(row[0]).strip() for row in self.ws_wallet.get_all_values()[1:])
+
+    def seed_from_wallet(self) -> int:
+        """
+        wallet_events 還是空的時候，把 wallet 分頁每個群組的餘額寫成一筆 set，回傳筆數
+        「是不是空的」跟 append 之間沒辦法跨 worker 鎖住，只給 seed_wallet_events.py 在 bot 停著的時候跑一次；
+        bot 啟動時只檢查（needs_seed），不自己搬
+        """
+        with self._lock:
+            if self.ws_wallet is None or len(self.ws_events.row_values(2)) > 0:
+                return 0
+            now = datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+            rows = []
+            seen = set()
+            for row in self.ws_wallet.get_all_values()[1:]:
+                gid = str(row[0]).strip() if row else ""
+                if gid and gid not in seen:
+                    seen.add(gid)
+                    rows.append([now, gid, "set", to_int(row[1] if len(row) > 1 else 0), "migrate", ""])
+            if rows:
+                self.ws_events.append_rows(rows, value_input_option="USER_ENTERED")
+                print(f"[wallet] seeded {len(rows)} balance(s) from wallet sheet")
+            self.sync(force=True)
+            return len(rows)
@@ -0,0 +1,218 @@
+import os
+import queue
+import threading
+import time
+
+from linebot.v3.webhooks import Event, MessageEvent
+from linebot.v3.models.events import UnknownEvent
+
+import metrics
+
+
+def _model_name(kind: str, suffix: str) -> str:
+    # LINE JSON 的 type -> SDK model 類別名稱：memberJoined -> MemberJoinedEvent、text -> TextMessageContent
+    return kind[:1].upper() + kind[1:] + suffix
+
+
+class EventPrefilter:
+    """
+    parse 成 pydantic model 之前，只看原始 JSON（event / source / message 的 type、groupId）決定要不要處理：
+      - 沒有註冊 handler 的 event（貼圖、圖片、join、unsend...）直接丟掉，不建 model
+      - skip(raw_event) 回傳理由字串的也丟掉（例：沒啟用記帳的群組）
+      - handler 有 default 時不做 handler 判斷（什麼都可能被處理）
+    """
+
+    def __init__(self, handler, skip=None):
+        self.handler = handler
+        self.skip = skip
+
+    def reason(self, ev: dict) -> str | None:
+        """
+        要丟掉回傳理由（metrics label），要處理回 None
+        """
+        if self.handler._default is None:
+            handlers = self.handler._handlers
+            name = _model_name(ev.get("type") or "", "Event")
+            handled = name in handlers
+            if not handled and name == "MessageEvent":
+                msg = ev.get("message") or {}
+                handled = f"{name}_{_model_name(msg.get('type') or '', 'MessageContent')}" in handlers
+            if not handled:
+                return "no_handler"
+        if self.skip is not None:
+            return self.skip(ev)
+        return None
+
+    def filter(self, raw_events: list) -> list:
+        kept = []
+        for ev in raw_events:
+            why = self.reason(ev)
+            if why is None:
+                kept.append(ev)
+            else:
+                metrics.WEBHOOK_PREFILTERED.inc(reason=why)
+        return kept
+
+
+def parse_events(body_json: dict) -> list:
+    """
+    跟 WebhookParser.parse 一樣把 body 轉成 event model（簽章要先驗過）
+    """
+    events = []
+    for ev in body_json.get("events", []):
+        try:
+            events.append(Event.from_dict(ev))
+        except ValueError:
+            events.append(UnknownEvent.new_from_json_dict(ev))
+    return events
+
+
+def dispatch_event(handler, event) -> None:
+    """
+    跟 WebhookHandler.handle 一樣的查表規則：
+    MessageEvent 先找 event+message 類型，再找 event 類型，最後 default
+    處理期間把 event timestamp 放進 metrics.current_event_ts（算回覆延遲用）
+    """
+    handlers = handler._handlers
+    func = None
+    if isinstance(event, MessageEvent):
+        func = handlers.get(f"{event.__class__.__name__}_{event.message.__class__.__name__}")
+    if func is None:
+        func = handlers.get(event.__class__.__name__)
+    if func is None:
+        func = handler._default
+    if func is None:
+        return
+
+    token = metrics.current_event_ts.set(getattr(event, "timestamp", None))
+    try:
+        func(event)
+    finally:
+        metrics.current_event_ts.reset(token)
+
+
+class EventDispatcher:
+    """
+    非同步處理 webhook：
+      - /callback 驗完簽章、parse 完就把 event 丟進 bounded queue，立刻回 200
+      - workers 條 thread 從 queue 拿 event，照 WebhookHandler 的註冊表呼叫 handler
+      - queue 滿了（backpressure）就在 request thread 直接處理，不丟 event
+      - shutdown() 停止收件並把 queue 處理完（gunicorn worker_exit / atexit 呼叫）
+    """
+
+    def __init__(self, handler, workers: int = 4, queue_size: int = 100):
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        self._queue: queue.Queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self._threads: list[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._closed = False
+        self._pid: int | None = None
+
+        self._stats = {
+            "enqueued": 0,
+            "processed": 0,
+            "failed": 0,
+            "inline": 0,
+            "max_depth": 0,
+            "wait_ms_total": 0.0,
+        }
+
+    # =========================
+    # 啟動 / 關閉
+    # =========================
+    def _ensure_started(self) -> None:
+        # gunicorn fork 之後 thread 不會跟過來，pid 變了就重開
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._threads = []
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, name=f"webhook-worker-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            self._pid = os.getpid()
+
+    def shutdown(self, timeout: float = 25.0) -> None:
+        """
+        停止收件，等 queue 內的 event 處理完（最多 timeout 秒）
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            started = self._pid == os.getpid()
+
+        if not started:
+            return
+
+        for _ in self._threads:
+            self._queue.put(None)
+
+        deadline = time.monotonic() + timeout
+        for t in self._threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+
+        left = self._queue.qsize()
+        if left:
+            print(f"[webhook] shutdown timeout, {left} event(s) dropped")
+
+    # =========================
+    # 收件 / 分派
+    # =========================
+    def submit(self, event) -> bool:
+        """
+        放進 queue 回 True；queue 滿或已關閉則直接同步處理並回 False
+        """
+        if not self._closed:
+            self._ensure_started()
+            try:
+                self._queue.put_nowait((time.monotonic(), event))
+            except queue.Full:
+                pass
+            else:
+                with self._lock:
+                    self._stats["enqueued"] += 1
+                    depth = self._queue.qsize()
+                    if depth > self._stats["max_depth"]:
+                        self._stats["max_depth"] = depth
+                return True
+
+        with self._lock:
+            self._stats["inline"] += 1
+        self._process(event)
+        return False
+
+    def _process(self, event) -> None:
+        try:
+            dispatch_event(self.handler, event)
+        except Exception as e:
+            print(f"[webhook] handler error: {e}")
+            with self._lock:
+                self._stats["failed"] += 1
+        else:
+            with self._lock:
+                self._stats["processed"] += 1
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                queued_at, event = item
+                with self._lock:
+                    self._stats["wait_ms_total"] += (time.monotonic() - queued_at) * 1000
+                self._process(event)
+            finally:
+                self._queue.task_done()
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self._stats)
+        out["depth"] = self._queue.qsize()
+        out["capacity"] = self._queue.maxsize
+        out["workers"] = self.workers
+        return out
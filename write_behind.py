@@ -0,0 +1,248 @@
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+
+from partitions import partition_runs
+from records_index import ENTRY_ID_COLUMN, RECORD_COLUMNS
+from sheets_util import col_letter
+
+
+# entry_id 固定在 RECORD_COLUMNS 後面那一欄（I）
+_ENTRY_POS = len(RECORD_COLUMNS)
+
+
+def entry_id_of(row: list) -> str | None:
+    return str(row[_ENTRY_POS]) if len(row) > _ENTRY_POS and row[_ENTRY_POS] else None
+
+
+def ensure_entry_id_header(ws) -> None:
+    """
+    records 分頁的 header 沒有 entry_id 就補上（舊的分頁只有 RECORD_COLUMNS）
+    那一欄已經被別的欄位佔用就丟錯，不把 id 寫進別人的欄位
+    """
+    header = [str(h).strip() for h in ws.row_values(1)]
+    if len(header) > _ENTRY_POS and header[_ENTRY_POS] == ENTRY_ID_COLUMN:
+        return
+    if len(header) > _ENTRY_POS and header[_ENTRY_POS]:
+        raise RuntimeError(
+            f"records header column {col_letter(_ENTRY_POS + 1)} is '{header[_ENTRY_POS]}', expected '{ENTRY_ID_COLUMN}'"
+        )
+    if not any(header):
+        full = list(RECORD_COLUMNS) + [ENTRY_ID_COLUMN]
+        ws.batch_update([{"range": f"A1:{col_letter(len(full))}1", "values": [full]}], value_input_option="RAW")
+        return
+    ws.update_acell(f"{col_letter(_ENTRY_POS + 1)}1", ENTRY_ID_COLUMN)
+
+
+def read_entry_ids(ws) -> set[str]:
+    """
+    分頁上已經有的 entry_id（整欄讀一次）
+    """
+    col = col_letter(_ENTRY_POS + 1)
+    return {str(v[0]) for v in ws.get(f"{col}2:{col}") if v and str(v[0]).strip()}
+
+
+class RecordWriteBehind:
+    """
+    records 的 write-behind：
+      - append() 先寫本地 journal（一行一筆 JSON，fsync 後才回傳），再放進 pending
+      - 背景 thread 湊滿 batch_size 筆或每 flush_interval 秒，用一次 append_rows 寫進 sheet
+      - 寫成功後呼叫 on_flushed(rows, append_rows 的回應, 分區 key)，並把 journal 重寫成剩下的 pending
+      - 有給 partition_key / worksheet_for 時依分區分段寫（一段一次 append_rows）
+      - 每個 process 一個 journal 檔並持有 flock；啟動時接手沒人持有的舊 journal（crash 留下的）
+      - 每列帶 entry_id（RECORD_COLUMNS 後面一欄）：append_rows 成功但 journal 還沒重寫就 crash 的話，
+        replay 出來的列寫之前先讀一次該分頁的 entry_id，已經在 sheet 上的略過，不會重複記帳
+    """
+
+    def __init__(
+        self,
+        ws_records,
+        journal_dir: str,
+        on_flushed=None,
+        batch_size: int = 20,
+        flush_interval: float = 2.0,
+        flush_guard=None,
+        partition_key=None,
+        worksheet_for=None,
+    ):
+        self.ws_records = ws_records
+        self.partition_key = partition_key
+        self.worksheet_for = worksheet_for
+        self.journal_dir = journal_dir
+        self.on_flushed = on_flushed
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = flush_interval
+
+        # 讀 pending 跟 flush 後更新 index 都要拿這把鎖，讀的人才不會看到重複或漏掉
+        self.lock = threading.RLock()
+        # flush 的 append_rows + on_flushed 期間持有；傳入 index 同步用的鎖，避免同步先讀到這批列
+        self._flush_lock = flush_guard or threading.Lock()
+        self._pending: list[list] = []
+        # replay 出來、還沒確認是否已經寫進 sheet 的 entry_id
+        self._unverified: set[str] = set()
+        self._wake = threading.Event()
+        self._closed = False
+
+        os.makedirs(journal_dir, exist_ok=True)
+        self.journal_path = os.path.join(journal_dir, f"records-{os.getpid()}.jsonl")
+        self._journal = open(self.journal_path, "a+", encoding="utf-8")
+        fcntl.flock(self._journal, fcntl.LOCK_EX)
+
+        self._replay()
+
+        self._thread = threading.Thread(target=self._run, name="records-write-behind", daemon=True)
+        self._thread.start()
+
+    # =========================
+    # journal
+    # =========================
+    @staticmethod
+    def _read_journal(f) -> list[list]:
+        f.seek(0)
+        rows = []
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                # crash 時寫到一半的最後一行
+                continue
+        return rows
+
+    def _replay(self) -> None:
+        """
+        自己的 journal + 沒有 process 持有的舊 journal 全部收進 pending
+        """
+        rows = self._read_journal(self._journal)
+
+        for path in sorted(glob.glob(os.path.join(self.journal_dir, "records-*.jsonl"))):
+            if os.path.abspath(path) == os.path.abspath(self.journal_path):
+                continue
+            try:
+                f = open(path, "r", encoding="utf-8")
+            except OSError:
+                continue
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()  # 還活著的 worker 在用
+                continue
+            try:
+                rows.extend(self._read_journal(f))
+                os.remove(path)
+            finally:
+                f.close()
+
+        with self.lock:
+            self._pending = rows
+            self._unverified = {i for i in map(entry_id_of, rows) if i}
+            self._rewrite_journal(rows)
+
+        if rows:
+            print(f"[write-behind] replayed {len(rows)} record(s) from journal")
+
+    def _rewrite_journal(self, rows: list[list]) -> None:
+        self._journal.seek(0)
+        self._journal.truncate()
+        for r in rows:
+            self._journal.write(json.dumps(r, ensure_ascii=False) + "\n")
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    # =========================
+    # API
+    # =========================
+    def append(self, row: list) -> None:
+        self.extend([row])
+
+    def extend(self, rows: list[list]) -> None:
+        """
+        多筆一起寫 journal（一次 fsync）
+        """
+        if not rows:
+            return
+        with self.lock:
+            if self._closed:
+                raise RuntimeError("write-behind buffer is closed")
+            self._journal.seek(0, os.SEEK_END)
+            self._journal.write("".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows))
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._pending.extend(rows)
+            if len(self._pending) >= self.batch_size:
+                self._wake.set()
+
+    def pending(self) -> list[list]:
+        with self.lock:
+            return list(self._pending)
+
+    def flush(self) -> int:
+        """
+        把目前 pending 一次 append_rows，回傳寫入筆數（失敗時保留 pending 並往外丟錯）
+        """
+        with self._flush_lock:
+            with self.lock:
+                batch = list(self._pending)
+            if not batch:
+                return 0
+
+            runs = partition_runs(batch, self.partition_key) if self.partition_key else [(None, batch)]
+            written = 0
+            for key, run in runs:
+                ws = self.worksheet_for(key) if self.worksheet_for else self.ws_records
+                fresh = self._drop_written(ws, run)
+                resp = ws.append_rows(fresh, value_input_option="USER_ENTERED") if fresh else None
+
+                # 每寫完一段就從 pending / journal 拿掉，後面的段失敗也不會重寫這段
+                with self.lock:
+                    if self.on_flushed and fresh:
+                        self.on_flushed(fresh, resp, key)
+                    self._pending = self._pending[len(run):]
+                    self._rewrite_journal(self._pending)
+                written += len(fresh)
+            return written
+
+    def _drop_written(self, ws, run: list[list]) -> list[list]:
+        """
+        replay 出來的列：已經在 sheet 上（上次 crash 前其實寫成功了）的拿掉
+        """
+        ids = {i for i in map(entry_id_of, run) if i in self._unverified}
+        if not ids:
+            return run
+        existing = read_entry_ids(ws)
+        fresh = [r for r in run if entry_id_of(r) not in existing]
+        self._unverified -= ids
+        if len(fresh) < len(run):
+            print(f"[write-behind] skipped {len(run) - len(fresh)} replayed record(s) already in sheet")
+        return fresh
+
+    def _run(self) -> None:
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[write-behind] flush error: {e}")
+                time.sleep(self.flush_interval)
+
+    def close(self) -> None:
+        """
+        停掉背景 thread 並做最後一次 flush；失敗的部分留在 journal，下次啟動 replay
+        """
+        with self.lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._wake.set()
+        self._thread.join(self.flush_interval + 5)
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"[write-behind] final flush error: {e}")
+        self._journal.close()